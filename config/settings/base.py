@@ -1,6 +1,7 @@
 """
 Base settings to build other settings files upon.
 """
+from datetime import timedelta
 
 import environ
 
@@ -237,6 +238,30 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 # http://docs.celeryproject.org/en/latest/userguide/configuration.html#std:setting-result_serializer
 CELERY_RESULT_SERIALIZER = 'json'
+# http://docs.celeryproject.org/en/3.1/userguide/periodic-tasks.html
+CELERYBEAT_SCHEDULE = {
+    # por si no se programo o fallo la tarea al encolar apuestas (ver
+    # prode.apuestas.cola.encolar)
+    'drenar-apuestas': {
+        'task': 'prode.apuestas.tasks.drenar_apuestas',
+        'schedule': timedelta(minutes=1),
+    },
+    # carga el leaderboard si se vacio el redis
+    'reconstruir-leaderboard': {
+        'task': 'prode.apuestas.tasks.reconstruir_leaderboard',
+        'schedule': timedelta(minutes=5),
+    },
+    # por si no se pudo encolar o fallo el procesamiento de los resultados
+    'procesar-resultados-pendientes': {
+        'task': 'prode.apuestas.tasks.procesar_pendientes',
+        'schedule': timedelta(minutes=5),
+    },
+    # cerrar un partido cambia los maximos de todos los usuarios
+    'actualizar-maximos': {
+        'task': 'prode.apuestas.tasks.actualizar_maximos',
+        'schedule': timedelta(minutes=5),
+    },
+}
 # django-allauth
 # ------------------------------------------------------------------------------
 ACCOUNT_ALLOW_REGISTRATION = env.bool('DJANGO_ACCOUNT_ALLOW_REGISTRATION', True)
@@ -263,3 +288,39 @@ COUNTRIES_ONLY = ('AR', 'AU', 'BE', 'BR', 'CH', 'CO', 'CR', 'DE', 'DK', 'EG',
                   'ES', 'FR', 'GB', 'HR', 'IR', 'IS', 'JP', 'KR', 'MA', 'MX',
                   'NG', 'PA', 'PE', 'PL', 'PT', 'RS', 'RU', 'SA', 'SE', 'SN',
                   'TN', 'UY')
+# Alias del cache de redis donde se guarda el ranking (ver
+# prode.apuestas.leaderboard). Si es None el ranking se lee de la base de datos
+LEADERBOARD_CACHE = env('DJANGO_LEADERBOARD_CACHE', default=None)
+# Simulacion de los partidos pendientes para estimar la probabilidad de
+# ganar de cada usuario (ver prode.apuestas.simulacion)
+SIMULACION = {
+    'CANTIDAD': env.int('DJANGO_SIMULACION_CANTIDAD', 10000),
+    'PUESTOS': env.int('DJANGO_SIMULACION_PUESTOS', 3),
+    # 'uniforme' o 'apuestas'
+    'METODO': env('DJANGO_SIMULACION_METODO', default='uniforme'),
+}
+# Cola de apuestas para los minutos previos al vencimiento de cada etapa (ver
+# prode.apuestas.cola)
+COLA_APUESTAS = {
+    # alias del cache de redis, si es None las apuestas se guardan directamente
+    'CACHE': env('DJANGO_COLA_APUESTAS_CACHE', default=None),
+    # minutos antes del vencimiento desde los que se encola, None es siempre
+    'MINUTOS': env.int('DJANGO_COLA_APUESTAS_MINUTOS', 15),
+    # apuestas guardadas en cada bloque al vaciar la cola
+    'LOTE': env.int('DJANGO_COLA_APUESTAS_LOTE', 1000),
+}
+# Feed de resultados que lee el comando importar_resultados (ver
+# prode.apuestas.importacion). Hasta tener un feed en vivo es la ruta de un
+# archivo CSV o JSON local
+RESULTADOS_FEED = env('DJANGO_RESULTADOS_FEED', default=None)
+# Limites de pedidos por usuario y por IP (ver prode.apuestas.limites)
+LIMITES = {
+    # vista: {tipo: (capacidad, pedidos por minuto)}
+    'apostar': {'usuario': (20, 10), 'ip': (300, 150)},
+    'apostar_partido': {'usuario': (60, 60), 'ip': (600, 600)},
+    'detalle': {'usuario': (30, 15), 'ip': (300, 150)},
+    'apuestas_partido': {'usuario': (60, 30), 'ip': (600, 300)},
+    'ranking': {'usuario': (30, 15), 'ip': (300, 150)},
+}
+# Cantidad de proxies de confianza que agregan la IP en X-Forwarded-For
+LIMITES_PROXIES = env.int('DJANGO_LIMITES_PROXIES', 0)
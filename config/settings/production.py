@@ -218,3 +218,7 @@ RAVEN_CONFIG = {
 }
 # Your stuff...
 # ------------------------------------------------------------------------------
+# El ranking se guarda en sorted sets del mismo redis que usa el cache
+LEADERBOARD_CACHE = env('DJANGO_LEADERBOARD_CACHE', default='default')
+# La aplicacion corre detras de un proxy que agrega X-Forwarded-For
+LIMITES_PROXIES = env.int('DJANGO_LIMITES_PROXIES', 1)
@@ -6,11 +6,5 @@ class ApuestasConfig(AppConfig):
     verbose_name = "Apuestas"
 
     def ready(self):
-        """Override this to put in:
-            Users system checks
-            Users signal registration
-        """
-        try:
-            import users.signals  # noqa F401
-        except ImportError:
-            pass
+        """Registra las signals que mantienen actualizados los puntajes."""
+        from . import signals  # noqa F401
@@ -0,0 +1,98 @@
+"""Cache de datos derivados de los resultados (ranking, puntajes, etc).
+
+Todas las entradas dependen de un unico contador, la "version de los
+resultados", que se incrementa cada vez que cambia el resultado de un partido
+o una apuesta de un partido terminado. Cada entrada se guarda junto a la
+version con la que se calculo y solo se usa si coincide con la actual, por lo
+que invalidar todo es un solo ``incr`` sin recorrer keys.
+
+Ademas cada partido tiene su propia version, que cambia cuando cambian su
+resultado, sus apuestas o sus estadisticas. Se usa en las keys de los
+fragmentos de templates de etapas vencidas (ver ``versiones_partidos``), que asi
+solo se vuelven a renderizar cuando cambia el partido que muestran.
+"""
+import random
+
+from django.core.cache import cache
+
+VERSION_KEY = 'prode:resultados:version'
+PREFIJO = 'prode:resultados'
+# los fragmentos viejos no se borran, quedan con otra key hasta que expiran
+TIMEOUT_FRAGMENTOS = 60 * 60 * 24
+
+
+def invalidar(key=VERSION_KEY):
+    """Incrementa la version de los resultados."""
+    try:
+        cache.incr(key)
+    except ValueError:
+        # no existe la version (primer uso o el cache la descarto)
+        version_inicial(key)
+
+
+def version_inicial(key=VERSION_KEY):
+    """Inicializa la version de los resultados.
+
+    Se usa un numero al azar para no repetir una version que pueda seguir en
+    el cache junto a datos viejos.
+    """
+    version = random.randint(1, 2 ** 62)
+    if not cache.add(key, version, timeout=None):
+        return cache.get(key)
+    return version
+
+
+def version_partido_key(partido):
+    return f'{PREFIJO}:partido:{partido.pk}:version'
+
+
+def invalidar_partidos(partidos):
+    """Incrementa la version de cada partido."""
+    for partido in partidos:
+        invalidar(version_partido_key(partido))
+
+
+def versiones_partidos(partidos):
+    """Obtiene la version de cada partido, con una sola consulta al cache.
+
+    Guarda la version de cada partido en su atributo ``version`` y devuelve
+    la combinacion de todas, para los fragmentos que dependen de todos los
+    partidos (por ejemplo los mejores puntajes de la etapa).
+
+    :returns: Texto con las versiones de los partidos
+    """
+    partidos = list(partidos)
+    keys = [version_partido_key(partido) for partido in partidos]
+    versiones = cache.get_many(keys)
+    for key, partido in zip(keys, partidos):
+        version = versiones.get(key)
+        partido.version = (version_inicial(key) if version is None
+                           else version)
+    return '-'.join(str(partido.version) for partido in partidos)
+
+
+def obtener(nombre, calcular, timeout=None):
+    """Obtiene un valor del cache o lo calcula si no esta o es de una version
+    vieja de los resultados.
+
+    Un acierto cuesta una sola consulta al cache, ya que se obtienen juntos la
+    version actual y el valor guardado.
+
+    :param nombre: Nombre del valor, por ejemplo ``'ranking'``
+    :param calcular: Funcion sin parametros que calcula el valor
+    :param timeout: Segundos que se guarda el valor. Por defecto no expira ya
+                    que se invalida cambiando la version.
+    """
+    key = f'{PREFIJO}:{nombre}'
+    valores = cache.get_many([VERSION_KEY, key])
+    version = valores.get(VERSION_KEY)
+    guardado = valores.get(key)
+    if version is not None and guardado is not None:
+        version_guardada, valor = guardado
+        if version_guardada == version:
+            return valor
+    if version is None:
+        version = version_inicial()
+    valor = calcular()
+    cache.set(key, (version, valor), timeout=timeout)
+    return valor
@@ -0,0 +1,325 @@
+"""Cola de apuestas para los minutos previos al vencimiento de una etapa.
+
+Cerca de ``Etapa.vencimiento`` las apuestas llegan de a miles por minuto y
+guardar cada una dentro de la transaccion del pedido satura la base de datos.
+Con la cola configurada, las apuestas validadas se agregan a una lista de
+redis junto a la hora en que las recibio el servidor y una tarea de celery
+las guarda luego en bloque (ver ``drenar``). La tarea se programa con cada
+pedido y ademas corre periodicamente con celery beat, asi ninguna apuesta
+queda en la cola si una tarea falla o no se programa.
+
+La hora de recepcion, y no la hora en que se vacia la cola, es la que decide
+si la apuesta llego antes del comienzo del partido y del vencimiento de la
+etapa.
+"""
+import json
+from datetime import (
+    datetime,
+    timedelta,
+)
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+
+from . import (
+    models,
+    utils,
+)
+
+
+class ColaEnMemoria:
+    """Implementa en memoria los comandos de listas usados por
+    ``ColaApuestas``.
+
+    Permite usar la cola con el cache locmem en desarrollo y en los tests,
+    sin un redis real. Solo sirve si la cola se vacia en el mismo proceso
+    (``CELERY_ALWAYS_EAGER``).
+    """
+
+    def __init__(self):
+        self.listas = {}
+
+    def pipeline(self, transaction=True):
+        return _PipelineEnMemoria(self)
+
+    def rpush(self, key, *valores):
+        lista = self.listas.setdefault(key, [])
+        lista.extend(valores)
+        return len(lista)
+
+    def lpush(self, key, *valores):
+        lista = self.listas.setdefault(key, [])
+        lista[:0] = reversed(valores)
+        return len(lista)
+
+    def lrange(self, key, inicio, fin):
+        lista = self.listas.get(key, [])
+        fin = len(lista) if fin == -1 else fin + 1
+        return lista[inicio:fin]
+
+    def ltrim(self, key, inicio, fin):
+        self.listas[key] = self.lrange(key, inicio, fin)
+        return True
+
+    def llen(self, key):
+        return len(self.listas.get(key, []))
+
+
+class _PipelineEnMemoria:
+    """Acumula los comandos y los ejecuta juntos en ``execute``."""
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+        self.comandos = []
+
+    def __getattr__(self, nombre):
+        def comando(*args):
+            self.comandos.append((getattr(self.cliente, nombre), args))
+            return self
+        return comando
+
+    def execute(self):
+        comandos, self.comandos = self.comandos, []
+        return [funcion(*args) for funcion, args in comandos]
+
+
+class ColaApuestas:
+    """Apuestas recibidas pendientes de guardar, en una lista de redis.
+
+    :param cliente: Cliente de redis (redis-py o ``ColaEnMemoria``)
+    """
+    key = 'prode:apuestas:pendientes'
+    campos = (('usuario_id', 'partido_id') +
+              models.Apuesta.objects.campos_apuesta)
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def agregar(self, apuestas, recibida=None):
+        """Agrega las apuestas al final de la cola.
+
+        :param apuestas: Instancias de ``Apuesta`` ya validadas
+        :param recibida: Hora en que el servidor recibio las apuestas, por
+                         defecto ahora
+        :returns: Cantidad de apuestas en la cola luego de agregarlas
+        """
+        recibida = recibida or timezone.now()
+        valores = [
+            self.serializar(
+                {campo: getattr(apuesta, campo) for campo in self.campos},
+                recibida,
+            )
+            for apuesta in apuestas
+        ]
+        if not valores:
+            return self.cantidad()
+        return self.cliente.rpush(self.key, *valores)
+
+    def devolver(self, pendientes):
+        """Vuelve a poner al principio de la cola apuestas extraidas, en el
+        mismo orden, por ejemplo si no se pudieron guardar.
+        """
+        valores = [self.serializar(pendiente, pendiente['recibida'])
+                   for pendiente in pendientes]
+        if valores:
+            # LPUSH agrega de a uno, el ultimo queda primero
+            self.cliente.lpush(self.key, *reversed(valores))
+
+    def serializar(self, datos, recibida):
+        return json.dumps(dict(
+            {campo: datos[campo] for campo in self.campos},
+            recibida=recibida.timestamp(),
+        ))
+
+    def extraer(self, cantidad):
+        """Saca de la cola las primeras ``cantidad`` apuestas.
+
+        :returns: Lista de diccionarios con los ``campos`` de la apuesta y la
+                  hora ``recibida`` (``datetime``), en el orden en que se
+                  agregaron
+        """
+        pipe = self.cliente.pipeline(transaction=True)
+        pipe.lrange(self.key, 0, cantidad - 1)
+        pipe.ltrim(self.key, cantidad, -1)
+        valores, _ = pipe.execute()
+        pendientes = []
+        for valor in valores:
+            pendiente = json.loads(valor)
+            pendiente['recibida'] = datetime.fromtimestamp(
+                pendiente['recibida'], tz=timezone.utc)
+            pendientes.append(pendiente)
+        return pendientes
+
+    def cantidad(self):
+        """Obtiene la cantidad de apuestas pendientes."""
+        return self.cliente.llen(self.key)
+
+
+_clientes_en_memoria = {}
+
+
+def get_cola():
+    """Obtiene la cola configurada en ``settings.COLA_APUESTAS['CACHE']``.
+
+    Si el cache es de django_redis usa su conexion, en otro caso (por ejemplo
+    locmem) usa una ``ColaEnMemoria`` por proceso, que solo se permite con
+    ``CELERY_ALWAYS_EAGER``: si la cola la vaciara un worker aparte, las
+    apuestas encoladas en memoria se perderian.
+
+    :returns: ``ColaApuestas`` o None si no esta configurada
+    :raises ImproperlyConfigured: si el cache no es de django_redis y las
+                                  tareas no se ejecutan en el mismo proceso
+    """
+    alias = settings.COLA_APUESTAS['CACHE']
+    if alias is None:
+        return None
+    if type(caches[alias]).__module__.startswith('django_redis'):
+        from django_redis import get_redis_connection
+        return ColaApuestas(get_redis_connection(alias))
+    if not getattr(settings, 'CELERY_ALWAYS_EAGER', False):
+        raise ImproperlyConfigured(
+            f'COLA_APUESTAS usa el cache {alias!r}, que no es de redis. '
+            'Solo se puede usar con CELERY_ALWAYS_EAGER.')
+    if alias not in _clientes_en_memoria:
+        _clientes_en_memoria[alias] = ColaEnMemoria()
+    return ColaApuestas(_clientes_en_memoria[alias])
+
+
+def usar_cola(etapa):
+    """Obtiene la cola si las apuestas de la etapa se deben encolar.
+
+    Se encolan las apuestas recibidas en los ultimos
+    ``settings.COLA_APUESTAS['MINUTOS']`` minutos antes del vencimiento de la
+    etapa (siempre si es None).
+
+    :returns: ``ColaApuestas`` o None si se deben guardar directamente
+    """
+    cola = get_cola()
+    minutos = settings.COLA_APUESTAS['MINUTOS']
+    if cola is None or minutos is None:
+        return cola
+    if etapa.vencimiento - timezone.now() <= timedelta(minutes=minutos):
+        return cola
+    return None
+
+
+def encolar(cola, apuestas):
+    """Agrega las apuestas a la cola y programa la tarea que la vacia cuando
+    se confirme la transaccion.
+
+    Se programa una tarea por cada pedido: si otra ya esta vaciando la cola
+    termina enseguida (ver ``drenar``). Si la tarea no llega a programarse,
+    por ejemplo porque se deshace la transaccion, las apuestas se guardan en
+    la siguiente ejecucion periodica.
+    """
+    # tasks importa este modulo
+    from . import tasks
+
+    apuestas = list(apuestas)
+    if apuestas:
+        cola.agregar(apuestas)
+        transaction.on_commit(tasks.drenar_apuestas.delay)
+
+
+def guardar_o_encolar(etapa, apuestas):
+    """Guarda las apuestas de la etapa con ``utils.guardar_apuestas`` o las
+    encola si la etapa esta por vencer (ver ``usar_cola``).
+
+    :returns: True si las apuestas se encolaron
+    """
+    cola = usar_cola(etapa)
+    if cola is None:
+        utils.guardar_apuestas(apuestas)
+        return False
+    encolar(cola, apuestas)
+    return True
+
+
+def a_tiempo(pendiente, partido):
+    """Indica si la apuesta se recibio antes del comienzo del partido y del
+    vencimiento de su etapa."""
+    recibida = pendiente['recibida']
+    if partido.fecha is None or recibida >= partido.fecha:
+        return False
+    return partido.etapa is not None and recibida <= partido.etapa.vencimiento
+
+
+@transaction.atomic
+def guardar_pendientes(pendientes):
+    """Guarda en bloque las apuestas sacadas de la cola.
+
+    Se descartan las que llegaron tarde. Si un usuario apuesta varias veces
+    en el mismo partido se guarda la ultima.
+
+    :param pendientes: Apuestas devueltas por ``ColaApuestas.extraer``
+    :returns: Cantidad de apuestas guardadas
+    """
+    ultimas = {
+        (pendiente['usuario_id'], pendiente['partido_id']): pendiente
+        for pendiente in sorted(pendientes, key=lambda p: p['recibida'])
+    }
+    partidos = (models.Partido.objects
+                .select_related('etapa')
+                .in_bulk({partido for _, partido in ultimas}))
+    ultimas = {
+        clave: pendiente
+        for clave, pendiente in ultimas.items()
+        if clave[1] in partidos and a_tiempo(pendiente, partidos[clave[1]])
+    }
+    existentes = {
+        (usuario, partido): pk
+        for usuario, partido, pk in models.Apuesta.objects
+        .filter(usuario__in={usuario for usuario, _ in ultimas},
+                partido__in={partido for _, partido in ultimas})
+        .values_list('usuario', 'partido', 'pk')
+        .order_by()
+    }
+    utils.guardar_apuestas(
+        models.Apuesta(
+            pk=existentes.get(clave),
+            partido=partidos[clave[1]],
+            **{campo: pendiente[campo] for campo in ColaApuestas.campos
+               if campo != 'partido_id'}
+        )
+        for clave, pendiente in ultimas.items()
+    )
+    return len(ultimas)
+
+
+def drenar(cola=None, lote=None):
+    """Vacia la cola guardando las apuestas en bloques de ``lote``.
+
+    Solo un proceso a la vez vacia la cola, para que las apuestas se guarden
+    en el orden en que se recibieron. Si otro proceso la esta vaciando no se
+    hace nada.
+
+    :returns: Cantidad de apuestas guardadas
+    """
+    cola = cola or get_cola()
+    if cola is None:
+        return 0
+    lote = lote or settings.COLA_APUESTAS['LOTE']
+    bloqueo = caches[settings.COLA_APUESTAS['CACHE']]
+    key = f'{cola.key}:drenando'
+    guardadas = 0
+    while True:
+        if not bloqueo.add(key, True, timeout=300):
+            return guardadas
+        try:
+            pendientes = cola.extraer(lote)
+            while pendientes:
+                try:
+                    guardadas += guardar_pendientes(pendientes)
+                except Exception:
+                    cola.devolver(pendientes)
+                    raise
+                pendientes = cola.extraer(lote)
+        finally:
+            bloqueo.delete(key)
+        # pudieron llegar apuestas entre la ultima extraccion y liberar el
+        # bloqueo, cuya tarea no pudo vaciar la cola
+        if not cola.cantidad():
+            return guardadas
@@ -0,0 +1,153 @@
+"""Resumen de las apuestas de cada partido.
+
+Con muchos apostadores el detalle de una etapa no puede listar cada apuesta
+de cada partido. En su lugar se muestra, por partido, cuantos apostaron a
+cada ganador, los resultados exactos mas apostados y, si el partido termino,
+cuantos obtuvieron cada puntaje. Todo se calcula con ``GROUP BY`` en la base
+de datos (tres consultas para cualquier cantidad de partidos) y se guarda en
+``EstadisticaPartido``, ``ResultadoApostado`` y ``PuntosObtenidos``.
+
+Las estadisticas se calculan la primera vez que se piden luego del
+vencimiento de la etapa y se recalculan cuando cambia el resultado del
+partido o los puntos de la etapa (ver ``signals``). Al recalcularlas cambia
+la version de cada partido, que invalida los fragmentos cacheados del
+detalle de la etapa (ver ``cache.versiones_partidos``).
+"""
+from collections import defaultdict
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from . import (
+    cache,
+    constants,
+    models,
+    puntuacion,
+)
+
+# cantidad de resultados exactos que se guardan por partido
+RESULTADOS_FRECUENTES = 5
+
+CAMPO_GANADOR = {
+    constants.GANA_LOCAL: 'gana_local',
+    constants.EMPATE: 'empate',
+    constants.GANA_VISITANTE: 'gana_visitante',
+}
+
+
+def calcular(partidos):
+    """Calcula las estadisticas de los partidos sin guardarlas.
+
+    :returns: Tupla (lista de ``EstadisticaPartido``, lista de
+              ``ResultadoApostado``, lista de ``PuntosObtenidos``)
+    """
+    partidos = list(partidos)
+    apuestas = models.Apuesta.objects.filter(partido__in=partidos).order_by()
+    estadisticas = {partido.pk: models.EstadisticaPartido(partido=partido)
+                    for partido in partidos}
+    ganadores = (apuestas
+                 .values_list('partido', 'ganador')
+                 .annotate(cantidad=Count('pk')))
+    for partido, ganador, cantidad in ganadores:
+        estadistica = estadisticas[partido]
+        setattr(estadistica, CAMPO_GANADOR[ganador], cantidad)
+        estadistica.apuestas += cantidad
+
+    # los resultados de cada partido son pocos, el top se elige aca
+    por_partido = defaultdict(list)
+    frecuentes = (apuestas
+                  .values_list('partido', 'goles_local', 'goles_visitante')
+                  .annotate(cantidad=Count('pk'))
+                  .order_by('partido', '-cantidad', 'goles_local',
+                            'goles_visitante'))
+    for partido, goles_local, goles_visitante, cantidad in frecuentes:
+        if len(por_partido[partido]) < RESULTADOS_FRECUENTES:
+            por_partido[partido].append(models.ResultadoApostado(
+                partido_id=partido, goles_local=goles_local,
+                goles_visitante=goles_visitante, cantidad=cantidad))
+    resultados = [resultado
+                  for partido in partidos
+                  for resultado in por_partido[partido.pk]]
+
+    terminados = [partido for partido in partidos if partido.terminado()]
+    puntos = [
+        models.PuntosObtenidos(partido_id=partido, puntos=puntos_apuesta,
+                               cantidad=cantidad)
+        for partido, puntos_apuesta, cantidad in (
+            apuestas
+            .filter(partido__in=terminados)
+            .annotate(puntos=puntuacion.REGLA.expresion())
+            .values_list('partido', 'puntos')
+            .annotate(cantidad=Count('pk'))
+        )
+    ] if terminados else []
+    return list(estadisticas.values()), resultados, puntos
+
+
+@transaction.atomic
+def actualizar(partidos):
+    """Calcula y guarda las estadisticas de los partidos, reemplazando las
+    que ya tenian."""
+    partidos = list(partidos)
+    estadisticas, resultados, puntos = calcular(partidos)
+    # tambien cambia la version de los partidos
+    borrar(partidos)
+    models.EstadisticaPartido.objects.bulk_create(estadisticas)
+    models.ResultadoApostado.objects.bulk_create(resultados)
+    models.PuntosObtenidos.objects.bulk_create(puntos)
+
+
+def tiene_estadistica(partido):
+    try:
+        partido.estadistica
+    except ObjectDoesNotExist:
+        return False
+    return True
+
+
+def de_etapa(etapa):
+    """Obtiene los partidos de la etapa con sus estadisticas precargadas.
+
+    Las estadisticas que faltan se calculan y guardan en el momento, por lo
+    que solo deberia usarse con etapas vencidas.
+
+    :returns: Lista de ``Partido`` ordenada por fecha
+    """
+    partidos = (etapa.partidos
+                .select_related('estadistica')
+                .prefetch_related('resultados_apostados',
+                                  'puntos_obtenidos'))
+    faltantes = [partido for partido in partidos
+                 if not tiene_estadistica(partido)]
+    if not faltantes:
+        return list(partidos)
+    actualizar(faltantes)
+    return list(partidos.all())
+
+
+def borrar(partidos):
+    """Borra las estadisticas de los partidos e invalida los fragmentos que
+    las muestran."""
+    partidos = list(partidos)
+    for modelo in (models.EstadisticaPartido, models.ResultadoApostado,
+                   models.PuntosObtenidos):
+        modelo.objects.filter(partido__in=partidos).delete()
+    cache.invalidar_partidos(partidos)
+
+
+def actualizar_vencidos(partidos):
+    """Recalcula las estadisticas de los partidos de etapas vencidas.
+
+    Las de etapas no vencidas se calculan recien cuando se piden.
+    """
+    partidos = list(partidos)
+    vencidas = set(models.Etapa.objects
+                   .filter(pk__in={partido.etapa_id for partido in partidos},
+                           vencimiento__lt=timezone.now())
+                   .values_list('pk', flat=True))
+    vencidos = [partido for partido in partidos
+                if partido.etapa_id in vencidas]
+    if vencidos:
+        actualizar(vencidos)
@@ -2,8 +2,9 @@ from django import forms
 from django.utils import text
 
 from . import (
-    constants,
+    importacion,
     models,
+    renderizado,
 )
 
 
@@ -24,17 +25,13 @@ class ApuestaForm(forms.ModelForm):
 
         En vez de mostrar `local` o `visitante` muestra el nombre del pais
         """
-        local = self.partido.local.name
-        visitante = self.partido.visitante.name
+        # los nombres y las opciones se calculan una vez por pais
+        etiquetas = renderizado.etiquetas(self.partido)
         # cambio choices del ganador
-        self.fields['ganador'].choices = (
-            (constants.EMPATE, 'Empate'),
-            (constants.GANA_LOCAL, f'Gana {local}'),
-            (constants.GANA_VISITANTE, f'Gana {visitante}'),
-        )
+        self.fields['ganador'].choices = etiquetas['opciones']
         # cambio labels de goles
-        self.fields['goles_local'].label = local
-        self.fields['goles_visitante'].label = visitante
+        self.fields['goles_local'].label = etiquetas['local']
+        self.fields['goles_visitante'].label = etiquetas['visitante']
 
     def save(self, commit=True):
         """Guarda apuesta. Asocia partido y usuario pasado por constructor"""
@@ -50,10 +47,19 @@ class ApuestaBaseFormSet(forms.BaseFormSet):
     """Clase base de los formset generados por formset_factory."""
 
     def __init__(self, *args, **kwargs):
-        """Guarda atributos ``usuario`` y ``etapa``"""
+        """Guarda atributos ``usuario`` y ``etapa``.
+
+        Carga de una vez los partidos de la etapa y las apuestas del usuario,
+        para no consultar la base de datos por cada formulario. Los partidos
+        no empezados de la etapa se pueden pasar ya cargados en ``partidos``.
+        """
         self.usuario = kwargs.pop('usuario')
         self.etapa = kwargs.pop('etapa')
-        self.partidos = self.etapa.partidos.no_empezados().order_by('id')
+        partidos = kwargs.pop('partidos', None)
+        if partidos is None:
+            partidos = self.etapa.partidos.no_empezados().order_by('id')
+        self.partidos = list(partidos)
+        self.apuestas = self.get_apuestas()
         super().__init__(*args, **kwargs)
 
     def get_form_kwargs(self, index):
@@ -66,21 +72,29 @@ class ApuestaBaseFormSet(forms.BaseFormSet):
             kwargs['instance'] = self.get_apuesta(partido)
         return kwargs
 
+    def get_apuestas(self):
+        """Obtiene las apuestas del usuario en los partidos del formset.
+
+        :returns: Diccionario {id de partido: ``Apuesta``}
+        """
+        apuestas = (models.Apuesta.objects
+                    .filter(usuario=self.usuario, partido__in=self.partidos)
+                    .order_by())
+        return {apuesta.partido_id: apuesta for apuesta in apuestas}
+
     def get_apuesta(self, partido):
         """Obtiene apuesta asociada al partido hecha por el usuario.
 
         :returns: ``Apuesta`` o None
         """
-        apuesta = partido.apuestas.filter(usuario=self.usuario)
-        if not apuesta.exists():
-            return None
-        return apuesta.get()
+        return self.apuestas.get(partido.pk)
 
 
 class EtapaForm(forms.ModelForm):
     class Meta:
         model = models.Etapa
-        fields = ('publica', 'nombre', 'vencimiento')
+        fields = ('publica', 'nombre', 'vencimiento', 'puntos_ganador',
+                  'puntos_goles')
 
     def save(self, commit=True):
         etapa = super().save(commit=False)
@@ -116,3 +130,42 @@ class CargarResultadosForm(forms.ModelForm):
         visitante = self.instance.visitante.name
         self.fields['goles_local'].label = local
         self.fields['goles_visitante'].label = visitante
+
+
+class ImportarResultadosForm(forms.Form):
+    archivo = forms.FileField(
+        help_text='CSV o JSON con las columnas etapa, local, visitante, '
+                  'goles_local, goles_visitante y opcionalmente fecha '
+                  '(AAAA-MM-DD)')
+    formato = forms.ChoiceField(
+        required=False,
+        choices=(('', 'Según la extensión'),) + tuple(
+            (formato, formato.upper()) for formato in importacion.FORMATOS),
+    )
+
+    def __init__(self, *args, **kwargs):
+        """Guarda si se pueden corregir resultados ya cargados."""
+        self.correcciones = kwargs.pop('correcciones', False)
+        super().__init__(*args, **kwargs)
+        self.partidos = []
+
+    def clean(self):
+        """Lee el archivo y empareja cada fila con su partido."""
+        cleaned_data = super().clean()
+        archivo = cleaned_data.get('archivo')
+        if archivo is None:
+            return cleaned_data
+        try:
+            contenido = archivo.read().decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise forms.ValidationError('El archivo debe estar en UTF-8')
+        try:
+            formato = (cleaned_data.get('formato') or
+                       importacion.formato_de(archivo.name))
+            self.partidos = importacion.emparejar(
+                importacion.leer(contenido, formato),
+                correcciones=self.correcciones,
+            )
+        except importacion.ErrorImportacion as error:
+            raise forms.ValidationError(error.errores)
+        return cleaned_data
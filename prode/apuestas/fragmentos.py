@@ -0,0 +1,44 @@
+"""Fragmentos cacheados del detalle de las etapas vencidas.
+
+Los partidos y los mejores puntajes de una etapa vencida se renderizan en
+``apuestas/etapa_partidos.html`` y ``apuestas/etapa_puntajes.html`` dentro
+de un ``{% cache %}`` cuya key depende de la version de cada partido (ver
+``cache.versiones_partidos``). Los datos se obtienen solo si el fragmento no
+esta en el cache.
+
+Luego de cargar resultados los fragmentos se renderizan de antemano (ver
+``calentar``), asi el primer pedido despues de un partido no paga el costo.
+"""
+from django.template.loader import render_to_string
+from django.utils.functional import SimpleLazyObject
+
+from . import (
+    cache,
+    estadisticas,
+    models,
+)
+
+TEMPLATES = ('apuestas/etapa_partidos.html', 'apuestas/etapa_puntajes.html')
+
+
+def contexto(etapa):
+    """Obtiene el contexto de los fragmentos de la etapa.
+
+    Los partidos con sus estadisticas y los 10 mejores puntajes se obtienen
+    recien cuando se usan.
+    """
+    return {
+        'etapa': etapa,
+        'version_partidos': cache.versiones_partidos(etapa.partidos.all()),
+        'timeout_fragmentos': cache.TIMEOUT_FRAGMENTOS,
+        'puntajes': SimpleLazyObject(
+            lambda: models.Puntaje.objects.ranking(etapa=etapa, limite=10)),
+        'partidos': SimpleLazyObject(lambda: estadisticas.de_etapa(etapa)),
+    }
+
+
+def calentar(etapa):
+    """Renderiza los fragmentos de la etapa que no esten en el cache."""
+    datos = contexto(etapa)
+    for template in TEMPLATES:
+        render_to_string(template, datos)
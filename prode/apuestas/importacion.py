@@ -0,0 +1,265 @@
+"""Importacion de resultados desde un feed CSV o JSON.
+
+Cada fila del feed tiene el slug de la etapa, el pais local, el visitante
+(codigo o nombre), los goles de cada uno y opcionalmente la fecha del
+partido (``AAAA-MM-DD``), necesaria solo si en la etapa hay mas de un
+partido entre los mismos paises. Por ejemplo en CSV::
+
+    etapa,local,visitante,goles_local,goles_visitante,fecha
+    grupos,AR,IS,1,1,2018-06-16
+
+o en JSON, una lista de objetos con las mismas claves.
+
+Todas las filas se validan y emparejan con sus partidos antes de guardar
+nada; luego los resultados se guardan juntos con ``resultados.guardar`` y se
+encola un solo ``tasks.procesar_resultados`` con todos los partidos que
+cambiaron.
+
+Mientras no haya un feed en vivo, la fuente configurada en
+``settings.RESULTADOS_FEED`` es un archivo local (ver ``FuenteArchivo``).
+"""
+import csv
+import io
+import json
+import os
+from collections import (
+    defaultdict,
+    namedtuple,
+)
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django_countries import countries
+
+from . import (
+    models,
+    resultados,
+    tasks,
+)
+
+FORMATOS = ('csv', 'json')
+COLUMNAS = ('etapa', 'local', 'visitante', 'goles_local', 'goles_visitante')
+
+Fila = namedtuple('Fila', ('numero', 'etapa', 'local', 'visitante',
+                           'goles_local', 'goles_visitante', 'fecha'))
+
+
+class ErrorImportacion(ValueError):
+    """El feed no se puede importar.
+
+    :param errores: Lista de mensajes, uno por problema encontrado
+    """
+
+    def __init__(self, errores):
+        super().__init__('\n'.join(errores))
+        self.errores = errores
+
+
+def formato_de(nombre):
+    """Obtiene el formato del feed por la extension del archivo."""
+    formato = os.path.splitext(nombre)[1].lstrip('.').lower()
+    if formato not in FORMATOS:
+        raise ErrorImportacion(
+            [f'No se reconoce el formato del archivo {nombre}, use '
+             f'{" o ".join(FORMATOS)}'])
+    return formato
+
+
+def _pais(valor):
+    valor = str(valor).strip()
+    return (countries.alpha2(valor) or
+            countries.by_name(valor) or
+            countries.by_name(valor, language=settings.LANGUAGE_CODE) or
+            None)
+
+
+def _goles(valor):
+    try:
+        goles = int(str(valor).strip())
+    except (TypeError, ValueError):
+        return None
+    return goles if goles >= 0 else None
+
+
+def _vacio(valor):
+    return valor is None or str(valor).strip() == ''
+
+
+def _fila(numero, datos):
+    """Valida los datos de una fila.
+
+    :returns: Tupla (``Fila`` o None, lista de errores)
+    """
+    faltantes = [columna for columna in COLUMNAS
+                 if _vacio(datos.get(columna))]
+    if faltantes:
+        return None, [f'Fila {numero}: faltan {", ".join(faltantes)}']
+    errores = []
+    local, visitante = _pais(datos['local']), _pais(datos['visitante'])
+    for pais, valor in ((local, datos['local']),
+                        (visitante, datos['visitante'])):
+        if pais is None:
+            errores.append(f'Fila {numero}: no se reconoce el pais {valor}')
+    goles_local = _goles(datos['goles_local'])
+    goles_visitante = _goles(datos['goles_visitante'])
+    if goles_local is None or goles_visitante is None:
+        errores.append(f'Fila {numero}: los goles deben ser enteros '
+                       'positivos')
+    fecha = None
+    if not _vacio(datos.get('fecha')):
+        try:
+            fecha = parse_date(str(datos['fecha']).strip())
+        except ValueError:
+            pass
+        if fecha is None:
+            errores.append(f'Fila {numero}: la fecha {datos["fecha"]} no es '
+                           'AAAA-MM-DD')
+    if errores:
+        return None, errores
+    return Fila(numero, str(datos['etapa']).strip(), local, visitante,
+                goles_local, goles_visitante, fecha), []
+
+
+def leer(contenido, formato):
+    """Lee las filas del feed.
+
+    :param contenido: Texto del feed
+    :param formato: ``'csv'`` o ``'json'``
+    :returns: Lista de ``Fila``
+    :raises ErrorImportacion: Si el feed no se puede leer o alguna fila no
+                              es valida
+    """
+    if formato == 'csv':
+        datos = list(csv.DictReader(io.StringIO(contenido)))
+    else:
+        try:
+            datos = json.loads(contenido)
+        except ValueError as error:
+            raise ErrorImportacion([f'El JSON no es valido: {error}'])
+        if not isinstance(datos, list) or not all(isinstance(fila, dict)
+                                                  for fila in datos):
+            raise ErrorImportacion(['El JSON debe ser una lista de objetos'])
+    filas, errores = [], []
+    for numero, fila in enumerate(datos, start=1):
+        fila, errores_fila = _fila(numero, fila)
+        if fila is not None:
+            filas.append(fila)
+        errores += errores_fila
+    if errores:
+        raise ErrorImportacion(errores)
+    return filas
+
+
+class FuenteArchivo:
+    """Feed de resultados leido de un archivo local.
+
+    Reemplaza al feed en vivo hasta que exista: cualquier objeto con un
+    metodo ``filas`` puede usarse como fuente.
+
+    :param ruta: Ruta del archivo CSV o JSON
+    :param formato: ``'csv'`` o ``'json'``. Por defecto segun la extension.
+    """
+
+    def __init__(self, ruta, formato=None):
+        self.ruta = ruta
+        self.formato = formato or formato_de(ruta)
+
+    def filas(self):
+        """Lee las filas del archivo.
+
+        :returns: Lista de ``Fila``
+        """
+        try:
+            with open(self.ruta, encoding='utf-8-sig') as archivo:
+                contenido = archivo.read()
+        except OSError as error:
+            raise ErrorImportacion(
+                [f'No se puede leer {self.ruta}: {error.strerror}'])
+        return leer(contenido, self.formato)
+
+
+def get_fuente():
+    """Obtiene la fuente de resultados configurada o None si no hay."""
+    if not settings.RESULTADOS_FEED:
+        return None
+    return FuenteArchivo(settings.RESULTADOS_FEED)
+
+
+def emparejar(filas, correcciones=True):
+    """Busca el partido de cada fila y le asigna los goles, sin guardarlo.
+
+    Los partidos se buscan con una sola consulta, por etapa y par de paises
+    y, si la fila la tiene, por la fecha del partido.
+
+    :param filas: ``Fila`` leidas del feed
+    :param correcciones: Si se pueden cambiar resultados ya cargados
+    :returns: Lista de ``Partido`` con los goles de las filas
+    :raises ErrorImportacion: Si alguna fila no corresponde a un solo partido
+                              terminado
+    """
+    filas = list(filas)
+    etapas = {fila.etapa for fila in filas}
+    candidatos = defaultdict(list)
+    for partido in (models.Partido.objects
+                    .filter(etapa__slug__in=etapas)
+                    .select_related('etapa')):
+        candidatos[(partido.etapa.slug, partido.local.code,
+                    partido.visitante.code)].append(partido)
+    terminados = set(models.Partido.objects
+                     .terminados()
+                     .filter(etapa__slug__in=etapas)
+                     .values_list('pk', flat=True))
+
+    emparejados, errores = {}, []
+    for fila in filas:
+        encontrados = candidatos[(fila.etapa, fila.local, fila.visitante)]
+        if fila.fecha is not None:
+            encontrados = [
+                partido for partido in encontrados
+                if partido.fecha is not None and
+                timezone.localtime(partido.fecha).date() == fila.fecha
+            ]
+        descripcion = (f'Fila {fila.numero}: {fila.local} - '
+                       f'{fila.visitante} en {fila.etapa}')
+        if not encontrados:
+            errores.append(f'{descripcion} no existe')
+            continue
+        if len(encontrados) > 1:
+            errores.append(f'{descripcion} se juega mas de una vez, indique '
+                           'la fecha')
+            continue
+        [partido] = encontrados
+        resultado = (fila.goles_local, fila.goles_visitante)
+        if partido.pk in emparejados:
+            errores.append(f'{descripcion} esta repetido')
+        elif partido.pk not in terminados:
+            errores.append(f'{descripcion} todavia no termino')
+        elif (not correcciones and partido.terminado() and
+              (partido.goles_local, partido.goles_visitante) != resultado):
+            errores.append(f'{descripcion} ya tiene resultado')
+        else:
+            partido.goles_local, partido.goles_visitante = resultado
+            emparejados[partido.pk] = partido
+    if errores:
+        raise ErrorImportacion(errores)
+    return list(emparejados.values())
+
+
+@transaction.atomic
+def importar(partidos, si_falla=None):
+    """Guarda los resultados de los partidos y, al terminar la transaccion,
+    encola un solo procesamiento para todos los que cambiaron (ver
+    ``tasks.procesar_al_confirmar``).
+
+    :param partidos: Devueltos por ``emparejar``
+    :param si_falla: Funcion sin parametros que se llama si no se pudo
+                     encolar el procesamiento
+    :returns: Lista de ``CambioResultado``
+    """
+    cambios = resultados.guardar(partidos)
+    if cambios:
+        tasks.procesar_al_confirmar(
+            [cambio.partido_id for cambio in cambios], si_falla=si_falla)
+    return cambios
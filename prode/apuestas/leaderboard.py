@@ -0,0 +1,310 @@
+"""Ranking guardado en sorted sets de redis.
+
+Cada ranking (el total y uno por etapa) es un sorted set donde los miembros
+son los nombres de usuario. Como score se guarda el puntaje negado, de esta
+forma ``ZRANK`` ordena de mayor a menor por puntos y, en caso de empate, por
+los bytes del nombre de usuario. Asi obtener el puesto o el puntaje de un
+usuario es O(log n) en lugar de armar el ranking completo.
+
+El ranking de la base de datos desempata por nombre de usuario segun la
+collation de la base, que puede ordenar distinto (mayusculas, acentos). Solo
+cambia el orden entre usuarios empatados, que tienen el mismo puesto.
+
+Los rankings se cargan completos con ``Leaderboard.reconstruir``, que deja
+una marca (ver ``Leaderboard.completo``). Mientras no este la marca, por
+ejemplo luego de vaciar o reiniciar el redis, el ranking se lee de la base de
+datos y la tarea periodica ``tasks.reconstruir_leaderboard`` lo vuelve a
+cargar.
+"""
+import bisect
+import fnmatch
+import itertools
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import models
+from .managers import Rank
+
+
+class RedisEnMemoria:
+    """Implementa en memoria los comandos de sorted sets usados por
+    ``Leaderboard``.
+
+    Permite usar el leaderboard con el cache locmem en desarrollo y en los
+    tests, sin un redis real.
+    """
+
+    def __init__(self):
+        # key -> {miembro: score}
+        self.scores = {}
+        # key -> lista ordenada de (score, miembro)
+        self.ordenados = {}
+        # key -> valor, para las keys que no son sorted sets
+        self.valores = {}
+
+    def pipeline(self, transaction=True):
+        return _PipelineEnMemoria(self)
+
+    def execute_command(self, comando, key, *args):
+        scores = self.scores.setdefault(key, {})
+        ordenados = self.ordenados.setdefault(key, [])
+        if comando == 'ZREM':
+            for miembro in args:
+                if miembro in scores:
+                    ordenados.remove((scores.pop(miembro), miembro))
+            return
+        if comando != 'ZADD':
+            raise NotImplementedError(comando)
+        for score, miembro in zip(args[::2], args[1::2]):
+            if miembro in scores:
+                ordenados.remove((scores[miembro], miembro))
+            scores[miembro] = float(score)
+            bisect.insort(ordenados, (float(score), miembro))
+
+    def delete(self, *keys):
+        for key in keys:
+            self.scores.pop(key, None)
+            self.ordenados.pop(key, None)
+            self.valores.pop(key, None)
+
+    def set(self, key, valor):
+        self.valores[key] = valor
+        return True
+
+    def exists(self, key):
+        return int(key in self.valores or bool(self.scores.get(key)))
+
+    def scan_iter(self, match):
+        return [key for key in list(self.scores) + list(self.valores)
+                if fnmatch.fnmatchcase(key, match)]
+
+    def zrank(self, key, miembro):
+        score = self.zscore(key, miembro)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.ordenados[key], (score, miembro))
+
+    def zscore(self, key, miembro):
+        return self.scores.get(key, {}).get(miembro)
+
+    def zcard(self, key):
+        return len(self.scores.get(key, {}))
+
+    def zcount(self, key, minimo, maximo):
+        # solo se usa con la forma ('-inf', '(score')
+        maximo = float(maximo.lstrip('('))
+        ordenados = self.ordenados.get(key, [])
+        return bisect.bisect_left(ordenados, (maximo,))
+
+    def zrange(self, key, inicio, fin, withscores=False):
+        ordenados = self.ordenados.get(key, [])
+        fin = len(ordenados) if fin == -1 else fin + 1
+        if withscores:
+            return [(miembro, score) for score, miembro in ordenados[inicio:fin]]
+        return [miembro for _, miembro in ordenados[inicio:fin]]
+
+
+class _PipelineEnMemoria:
+    """Ejecuta los comandos en el momento, ``execute`` no hace nada."""
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def __getattr__(self, nombre):
+        return getattr(self.cliente, nombre)
+
+    def execute(self):
+        return []
+
+
+class Leaderboard:
+    """Ranking de apostadores guardado en redis.
+
+    :param cliente: Cliente de redis (redis-py, fakeredis o
+                    ``RedisEnMemoria``)
+    """
+    prefijo = 'prode:ranking'
+    # cantidad de usuarios que se cargan en cada ZADD al reconstruir
+    lote = 1000
+
+    def __init__(self, cliente):
+        self.cliente = cliente
+
+    def key(self, etapa=None):
+        """Obtiene la key del ranking total o de la etapa."""
+        if etapa is None:
+            return self.prefijo
+        etapa_id = getattr(etapa, 'pk', etapa)
+        return f'{self.prefijo}:etapa:{etapa_id}'
+
+    @property
+    def marca(self):
+        """Key que indica que los rankings estan completos."""
+        return f'{self.prefijo}:completo'
+
+    def completo(self):
+        """Indica si los rankings se cargaron completos con ``reconstruir``.
+
+        No lo estan si nunca se reconstruyeron o si se vacio o reinicio el
+        redis, aunque luego se hayan guardado algunos puntajes.
+        """
+        return bool(self.cliente.exists(self.marca))
+
+    def guardar(self, puntajes, pipeline=None):
+        """Guarda los puntajes.
+
+        :param puntajes: Iterable de tuplas (nombre de usuario, id de etapa o
+                         None para el total, puntos)
+        """
+        pipe = pipeline or self.cliente.pipeline()
+        for username, etapa, puntos in puntajes:
+            pipe.execute_command('ZADD', self.key(etapa), -puntos, username)
+        if pipeline is None:
+            pipe.execute()
+
+    def quitar(self, miembros, pipeline=None):
+        """Quita usuarios de los rankings.
+
+        :param miembros: Iterable de tuplas (nombre de usuario, id de etapa o
+                         None para el total)
+        """
+        pipe = pipeline or self.cliente.pipeline()
+        for username, etapa in miembros:
+            pipe.execute_command('ZREM', self.key(etapa), username)
+        if pipeline is None:
+            pipe.execute()
+
+    def quitar_usuario(self, username):
+        """Quita al usuario del ranking total y de los de todas las etapas."""
+        etapas = [None] + list(models.Etapa.objects.values_list('pk',
+                                                                flat=True))
+        self.quitar((username, etapa) for etapa in etapas)
+
+    def borrar_etapa(self, etapa):
+        """Borra el ranking de la etapa."""
+        self.cliente.delete(self.key(etapa))
+
+    def posicion(self, username, etapa=None):
+        """Obtiene el puesto del usuario en el ranking.
+
+        :returns: int o None si el usuario no esta en el ranking
+        """
+        posicion = self.cliente.zrank(self.key(etapa), username)
+        if posicion is None:
+            return None
+        return posicion + 1
+
+    def puesto(self, username, etapa=None):
+        """Obtiene el puesto del usuario como en ``pagina``: los usuarios
+        empatados comparten el puesto.
+
+        :returns: int o None si el usuario no esta en el ranking
+        """
+        key = self.key(etapa)
+        score = self.cliente.zscore(key, username)
+        if score is None:
+            return None
+        return self.cliente.zcount(key, '-inf', f'({score}') + 1
+
+    def puntos(self, username, etapa=None):
+        """Obtiene los puntos del usuario.
+
+        :returns: int o None si el usuario no esta en el ranking
+        """
+        score = self.cliente.zscore(self.key(etapa), username)
+        if score is None:
+            return None
+        return int(-score)
+
+    def cantidad(self, etapa=None):
+        """Obtiene la cantidad de usuarios en el ranking."""
+        return self.cliente.zcard(self.key(etapa))
+
+    def pagina(self, inicio, cantidad, etapa=None):
+        """Obtiene una porcion del ranking.
+
+        :param inicio: Indice (desde 0) del primer usuario a obtener
+        :param cantidad: Cantidad de usuarios a obtener
+
+        :returns: Lista de ``Rank``
+        """
+        key = self.key(etapa)
+        filas = self.cliente.zrange(key, inicio, inicio + cantidad - 1,
+                                    withscores=True)
+        ranking = []
+        puesto = anterior = None
+        for indice, (username, score) in enumerate(filas, start=inicio + 1):
+            if score != anterior:
+                # el puesto es la cantidad de usuarios con mas puntos + 1
+                puesto = (indice if anterior is not None else
+                          self.cliente.zcount(key, '-inf', f'({score}') + 1)
+                anterior = score
+            if isinstance(username, bytes):
+                username = username.decode()
+            ranking.append(Rank(username, int(-score), puesto))
+        return ranking
+
+    def reconstruir(self):
+        """Vuelve a cargar todos los rankings a partir de los puntajes
+        guardados en la base de datos.
+
+        Antes se borran todas las keys del prefijo, incluidas las de etapas
+        borradas, asi no quedan usuarios o etapas que ya no existen. Cada
+        ``ZADD`` carga hasta ``lote`` usuarios. Se hace en una transaccion
+        para que no se vea el ranking vacio mientras se reconstruye.
+        """
+        keys = set(self.cliente.scan_iter(match=f'{self.prefijo}*'))
+        puntajes = (models.Puntaje.objects
+                    .values_list('etapa', 'usuario__username', 'puntos')
+                    .order_by('etapa')
+                    .iterator())
+        pipe = self.cliente.pipeline(transaction=True)
+        if keys:
+            pipe.delete(*keys)
+        for etapa, filas in itertools.groupby(puntajes,
+                                              key=lambda fila: fila[0]):
+            while True:
+                lote = list(itertools.islice(filas, self.lote))
+                if not lote:
+                    break
+                argumentos = []
+                for _, username, puntos in lote:
+                    argumentos += [-puntos, username]
+                pipe.execute_command('ZADD', self.key(etapa), *argumentos)
+        pipe.set(self.marca, 1)
+        pipe.execute()
+
+
+_clientes_en_memoria = {}
+
+
+def get_leaderboard():
+    """Obtiene el leaderboard configurado en ``settings.LEADERBOARD_CACHE``.
+
+    Si el cache es de django_redis usa su conexion, en otro caso (por ejemplo
+    locmem) usa un ``RedisEnMemoria`` por proceso.
+
+    :returns: ``Leaderboard`` o None si no esta configurado
+    """
+    alias = settings.LEADERBOARD_CACHE
+    if alias is None:
+        return None
+    if type(caches[alias]).__module__.startswith('django_redis'):
+        from django_redis import get_redis_connection
+        return Leaderboard(get_redis_connection(alias))
+    if alias not in _clientes_en_memoria:
+        _clientes_en_memoria[alias] = RedisEnMemoria()
+    return Leaderboard(_clientes_en_memoria[alias])
+
+
+def get_leaderboard_completo():
+    """Obtiene el leaderboard si esta configurado y tiene los rankings
+    completos (ver ``Leaderboard.completo``).
+
+    :returns: ``Leaderboard`` o None si hay que leer de la base de datos
+    """
+    tablero = get_leaderboard()
+    if tablero is None or not tablero.completo():
+        return None
+    return tablero
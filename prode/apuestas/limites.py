@@ -0,0 +1,139 @@
+"""Limite de pedidos por usuario y por IP con token buckets.
+
+Cada limite es un balde de ``capacidad`` fichas que se recarga a razon de
+``por_minuto`` fichas por minuto; cada pedido consume una ficha y si no hay
+fichas se responde 429 sin ejecutar la vista. El estado de cada balde se
+guarda en el cache de django, por lo que se comparte entre procesos. La
+lectura y escritura no son atomicas: con pedidos concurrentes del mismo
+usuario el limite puede excederse levemente, a cambio de una sola consulta
+de lectura y una de escritura al cache por balde.
+
+Los limites se configuran en ``settings.LIMITES`` por nombre de vista::
+
+    LIMITES = {
+        'ranking': {'usuario': (20, 10), 'ip': (200, 100)},
+    }
+
+Los rechazos se cuentan por vista y tipo de limite, ver ``rechazos``.
+"""
+import functools
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+
+PREFIJO = 'prode:limites'
+
+
+class TokenBucket:
+    """Balde de fichas guardado en el cache.
+
+    :param key: Key del cache donde se guarda el balde
+    :param capacidad: Cantidad maxima de fichas
+    :param por_minuto: Fichas que se recargan por minuto
+    """
+
+    def __init__(self, key, capacidad, por_minuto):
+        self.key = key
+        self.capacidad = capacidad
+        self.por_segundo = por_minuto / 60
+
+    def consumir(self, ahora=None):
+        """Consume una ficha.
+
+        :returns: 0 si habia fichas o los segundos que faltan para que haya
+                  una
+        """
+        ahora = time.time() if ahora is None else ahora
+        fichas, ultimo = cache.get(self.key, (self.capacidad, ahora))
+        fichas = min(self.capacidad,
+                     fichas + (ahora - ultimo) * self.por_segundo)
+        if fichas < 1:
+            return (1 - fichas) / self.por_segundo
+        # el balde lleno equivale a no tenerlo, puede expirar
+        lleno = (self.capacidad - fichas + 1) / self.por_segundo
+        cache.set(self.key, (fichas - 1, ahora), timeout=math.ceil(lleno))
+        return 0
+
+
+def ip_cliente(request):
+    """Obtiene la IP del cliente.
+
+    Si hay ``settings.LIMITES_PROXIES`` proxies de confianza adelante, la IP
+    es la que agrego el primero de ellos en ``X-Forwarded-For``.
+    """
+    proxies = settings.LIMITES_PROXIES
+    reenviadas = request.META.get('HTTP_X_FORWARDED_FOR', '')
+    ips = [ip.strip() for ip in reenviadas.split(',') if ip.strip()]
+    if proxies and len(ips) >= proxies:
+        return ips[-proxies]
+    return request.META.get('REMOTE_ADDR')
+
+
+def baldes(nombre, request):
+    """Obtiene los baldes que limitan el pedido a la vista ``nombre``.
+
+    :returns: Lista de tuplas (tipo de limite, ``TokenBucket``)
+    """
+    limites = settings.LIMITES.get(nombre, {})
+    claves = {'ip': ip_cliente(request)}
+    if request.user.is_authenticated:
+        claves['usuario'] = request.user.pk
+    return [
+        (tipo, TokenBucket(f'{PREFIJO}:{nombre}:{tipo}:{claves[tipo]}',
+                           *limites[tipo]))
+        for tipo in ('usuario', 'ip')
+        if tipo in limites and claves.get(tipo) is not None
+    ]
+
+
+def registrar_rechazo(nombre, tipo):
+    key = f'{PREFIJO}:rechazos:{nombre}:{tipo}'
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            # el cache descarto la key entre add e incr
+            cache.add(key, 1, timeout=None)
+
+
+def rechazos():
+    """Obtiene la cantidad de pedidos rechazados.
+
+    :returns: Diccionario {(nombre de vista, tipo de limite): rechazos}
+    """
+    claves = [(nombre, tipo)
+              for nombre, limites in settings.LIMITES.items()
+              for tipo in limites]
+    valores = cache.get_many([f'{PREFIJO}:rechazos:{nombre}:{tipo}'
+                              for nombre, tipo in claves])
+    return {
+        (nombre, tipo): valores.get(f'{PREFIJO}:rechazos:{nombre}:{tipo}', 0)
+        for nombre, tipo in claves
+    }
+
+
+def limitar(nombre):
+    """Decorador de vistas que limita los pedidos con los limites de
+    ``settings.LIMITES[nombre]``.
+
+    Se aplica a las vistas de clase con ``method_decorator`` sobre
+    ``dispatch``, asi el pedido se rechaza antes de tocar la base de datos.
+    """
+    def decorador(vista):
+        @functools.wraps(vista)
+        def vista_limitada(request, *args, **kwargs):
+            for tipo, balde in baldes(nombre, request):
+                espera = balde.consumir()
+                if espera:
+                    registrar_rechazo(nombre, tipo)
+                    response = HttpResponse(
+                        'Demasiados pedidos, intente nuevamente en unos '
+                        'segundos', status=429, content_type='text/plain')
+                    response['Retry-After'] = math.ceil(espera)
+                    return response
+            return vista(request, *args, **kwargs)
+        return vista_limitada
+    return decorador
@@ -0,0 +1,65 @@
+"""Importa resultados desde un feed CSV o JSON.
+
+Sin archivo lee la fuente configurada en ``settings.RESULTADOS_FEED``. Todos
+los resultados se guardan en una sola transaccion y se encola un solo
+procesamiento de puntajes (ver ``prode.apuestas.importacion``).
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from prode.apuestas import importacion
+
+
+class Command(BaseCommand):
+    help = 'Importa resultados de partidos desde un archivo CSV o JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'archivo', nargs='?',
+            help='Archivo con los resultados. Por defecto el feed '
+                 'configurado en RESULTADOS_FEED.')
+        parser.add_argument(
+            '--formato', choices=importacion.FORMATOS,
+            help='Formato del archivo. Por defecto segun la extension.')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run',
+            help='No guarda nada, muestra los resultados que cambiarian.')
+
+    def handle(self, *args, **options):
+        try:
+            fuente = self.get_fuente(options['archivo'], options['formato'])
+            partidos = importacion.emparejar(fuente.filas())
+        except importacion.ErrorImportacion as error:
+            raise CommandError(f'No se importo ningun resultado:\n{error}')
+        if options['dry_run']:
+            for partido in partidos:
+                self.stdout.write(f'  {self.describir(partido)}')
+            self.stdout.write(f'{len(partidos)} resultados leidos, no se '
+                              'guardo ningun cambio')
+            return
+        cambios = importacion.importar(partidos, si_falla=self.avisar_demora)
+        for cambio in cambios:
+            self.stdout.write(f'  {self.describir(cambio.partido)}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(cambios)} resultados importados, '
+            f'{len(partidos) - len(cambios)} sin cambios'
+        ))
+
+    def avisar_demora(self):
+        self.stderr.write(self.style.WARNING(
+            'No se pudo encolar el procesamiento de los resultados, los '
+            'procesara la tarea procesar_pendientes'))
+
+    def get_fuente(self, archivo, formato):
+        """Obtiene la fuente del archivo o la configurada."""
+        if archivo:
+            return importacion.FuenteArchivo(archivo, formato)
+        fuente = importacion.get_fuente()
+        if fuente is None:
+            raise CommandError('Indique el archivo o configure '
+                               'DJANGO_RESULTADOS_FEED')
+        return fuente
+
+    def describir(self, partido):
+        return (f'{partido.local.code} {partido.goles_local} - '
+                f'{partido.goles_visitante} {partido.visitante.code} '
+                f'[{partido.etapa.slug}]')
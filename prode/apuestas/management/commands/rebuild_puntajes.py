@@ -0,0 +1,176 @@
+"""Recalcula todos los puntajes guardados a partir de las apuestas.
+
+Pensado para correr luego de corregir resultados o cambiar las reglas de
+puntaje. Los usuarios se dividen en lotes por id; los puntajes de cada lote se
+calculan en un pool de procesos y se guardan en bloque desde el proceso
+principal. Al terminar se reconstruye el leaderboard, si esta configurado.
+"""
+import multiprocessing
+import os
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from prode.apuestas import (
+    cache,
+    leaderboard,
+    models,
+    utils,
+)
+
+
+def calcular_lote(lote):
+    """Calcula los puntajes de un lote de usuarios.
+
+    Se ejecuta dentro de los procesos del pool, por eso recibe y devuelve
+    solo datos simples.
+
+    :param lote: Tupla (ids de usuarios, ids de etapas o None)
+    :returns: Tupla (ids de usuarios, ids de etapas, puntajes calculados)
+    """
+    usuarios, etapas = lote
+    return usuarios, etapas, utils.calcular_puntajes(usuarios, etapas)
+
+
+def diferencias(filas, guardados):
+    """Compara los puntajes calculados con los guardados.
+
+    :param filas: Puntajes devueltos por ``utils.calcular_puntajes``
+    :param guardados: ``QuerySet`` de ``Puntaje`` que serian reemplazados
+    :returns: Lista ordenada por usuario de tuplas
+              (usuario, etapa, puntos guardados, puntos calculados). Los
+              puntos que no existen son None.
+    """
+    antes = {
+        (username, etapa): puntos
+        for username, etapa, puntos in guardados.values_list(
+            'usuario__username', 'etapa__slug', 'puntos')
+    }
+    slugs = dict(models.Etapa.objects.values_list('id', 'slug'))
+    despues = {
+        (fila['usuario__username'], slugs.get(fila.get('partido__etapa'))):
+        fila['puntos']
+        for fila in filas
+    }
+    claves = sorted(antes.keys() | despues.keys(),
+                    key=lambda clave: (clave[0], clave[1] or ''))
+    return [
+        (username, etapa, antes.get((username, etapa)),
+         despues.get((username, etapa)))
+        for username, etapa in claves
+        if antes.get((username, etapa)) != despues.get((username, etapa))
+    ]
+
+
+class Command(BaseCommand):
+    help = 'Recalcula los puntajes guardados a partir de las apuestas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--etapa', action='append', dest='etapas', metavar='SLUG',
+            help='Recalcula solo esta etapa (y el total de quienes apostaron '
+                 'en ella). Se puede repetir.')
+        parser.add_argument(
+            '--dry-run', action='store_true', dest='dry_run',
+            help='No guarda nada, muestra las diferencias con los puntajes '
+                 'guardados.')
+        parser.add_argument(
+            '--procesos', type=int, default=os.cpu_count() or 1,
+            help='Cantidad de procesos para calcular los puntajes.')
+        parser.add_argument(
+            '--lote', type=int, default=1000,
+            help='Cantidad de usuarios por lote.')
+
+    def handle(self, *args, **options):
+        if options['lote'] < 1 or options['procesos'] < 1:
+            raise CommandError('--lote y --procesos deben ser mayores a 0')
+        etapas = self.get_etapas(options['etapas'])
+        lotes = self.get_lotes(etapas, options['lote'])
+        self.dry_run = options['dry_run']
+        self.cambios = 0
+        inicio = time.monotonic()
+        usuarios = puntajes = 0
+        for numero, (ids, etapas_lote, filas) in enumerate(
+                self.calcular(lotes, options['procesos']), start=1):
+            self.procesar(filas, ids, etapas_lote)
+            usuarios += len(ids)
+            puntajes += len(filas)
+            transcurrido = time.monotonic() - inicio
+            self.stdout.write(
+                f'Lote {numero}/{len(lotes)}: {usuarios} usuarios, '
+                f'{puntajes} puntajes '
+                f'({usuarios / max(transcurrido, 1e-6):.0f} usuarios/s)'
+            )
+        if self.dry_run:
+            self.stdout.write(f'{self.cambios} puntajes distintos, '
+                              'no se guardo ningun cambio')
+            return
+        cache.invalidar()
+        tablero = leaderboard.get_leaderboard()
+        if tablero is not None:
+            tablero.reconstruir()
+            self.stdout.write('Leaderboard reconstruido')
+        transcurrido = time.monotonic() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'{puntajes} puntajes de {usuarios} usuarios recalculados en '
+            f'{transcurrido:.2f}s'
+        ))
+
+    def get_etapas(self, slugs):
+        """Obtiene los ids de las etapas pedidas o None si son todas."""
+        if not slugs:
+            return None
+        etapas = dict(models.Etapa.objects
+                      .filter(slug__in=slugs)
+                      .values_list('slug', 'id'))
+        faltantes = set(slugs) - etapas.keys()
+        if faltantes:
+            raise CommandError(
+                f'No existen las etapas: {", ".join(sorted(faltantes))}')
+        return sorted(etapas.values())
+
+    def get_lotes(self, etapas, cantidad):
+        """Divide los usuarios a recalcular en lotes de ``cantidad`` ids.
+
+        Si se recalculan etapas puntuales solo se incluyen los usuarios que
+        apostaron en ellas. Si se recalcula todo se incluyen todos los
+        usuarios, asi tambien se borran los puntajes de quienes ya no tienen
+        apuestas.
+        """
+        if etapas is None:
+            usuarios = get_user_model().objects.all()
+        else:
+            usuarios = get_user_model().objects.filter(
+                apuestas__partido__etapa__in=etapas).distinct()
+        ids = list(usuarios.order_by('pk').values_list('pk', flat=True))
+        return [(ids[i:i + cantidad], etapas)
+                for i in range(0, len(ids), cantidad)]
+
+    def calcular(self, lotes, procesos):
+        """Calcula los puntajes de cada lote, en paralelo si hay mas de un
+        proceso.
+
+        :returns: Iterador de tuplas (ids, etapas, puntajes calculados)
+        """
+        if procesos == 1 or len(lotes) <= 1:
+            yield from map(calcular_lote, lotes)
+            return
+        # los procesos hijos no pueden compartir las conexiones abiertas
+        connections.close_all()
+        with multiprocessing.Pool(min(procesos, len(lotes))) as pool:
+            yield from pool.imap(calcular_lote, lotes)
+
+    def procesar(self, filas, usuarios, etapas):
+        """Guarda los puntajes del lote o muestra las diferencias si es
+        ``--dry-run``.
+        """
+        if not self.dry_run:
+            utils.guardar_puntajes(filas, usuarios=usuarios, etapas=etapas)
+            return
+        guardados = utils.puntajes_guardados(usuarios=usuarios, etapas=etapas)
+        for username, etapa, antes, despues in diferencias(filas, guardados):
+            self.cambios += 1
+            self.stdout.write(f'  {username} [{etapa or "total"}]: '
+                              f'{antes} -> {despues}')
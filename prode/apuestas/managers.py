@@ -1,37 +1,156 @@
-import itertools
+import sqlite3
 from collections import namedtuple
 from datetime import timedelta
 
+from django.db import (
+    connections,
+    router,
+)
 from django.db.models import (
+    BooleanField,
     Case,
+    CharField,
     F,
+    IntegerField,
     Manager,
-    PositiveSmallIntegerField,
+    Q,
+    Subquery,
+    Sum,
     Value,
     When,
+    Window,
+    functions,
 )
 from django.utils import timezone
+from django_countries import countries
 
-from prode.apuestas.constants import (
-    EMPATE,
-    GANA_LOCAL,
-    GANA_VISITANTE,
-    PUNTOS_GANADOR,
-    PUNTOS_GOLES,
-)
+from prode.apuestas import constants
+from prode.apuestas.puntuacion import REGLA
+
+
+class Rank(namedtuple('Rank', 'username puntos')):
+    """Fila del ranking con la forma (nombre de usuario, puntos).
+
+    Ademas tiene el atributo ``puesto`` con la posicion en el ranking, donde
+    los usuarios empatados comparten puesto.
+    """
+
+    def __new__(cls, username, puntos, puesto=None):
+        rank = super().__new__(cls, username, puntos)
+        rank.puesto = puesto
+        return rank
+
+
+class Alcanzable(namedtuple('Alcanzable', 'maximo eliminado')):
+    """Puntos maximos que todavia puede alcanzar un usuario y si ya no puede
+    alcanzar al primero del ranking.
+    """
+    __slots__ = ()
+
+
+def abierto(partido=''):
+    """Obtiene la condicion de los partidos en los que todavia se puede
+    apostar: no tienen resultado, no empezaron y su etapa no esta vencida.
+
+    :param partido: Prefijo para llegar al partido, por ejemplo
+                    ``'partido__'`` sobre ``Apuesta``
+    """
+    ahora = timezone.now()
+    return Q(**{f'{partido}goles_local__isnull': True,
+                f'{partido}fecha__gt': ahora,
+                f'{partido}etapa__vencimiento__gt': ahora})
+
+
+def maximo_apuesta():
+    """Obtiene los puntos maximos que todavia puede sumar una apuesta como
+    expresion del ORM sobre ``Apuesta``.
+
+    Son los puntos obtenidos si el partido tiene resultado o los maximos de
+    la apuesta si ya no se puede cambiar. En los partidos abiertos es 0, los
+    puntos que se pueden sumar ahi no dependen de la apuesta (ver
+    ``PartidoManager.puntos_abiertos``).
+    """
+    return Case(
+        When(partido__goles_local__isnull=False, then=REGLA.expresion()),
+        When(abierto(partido='partido__'), then=Value(0)),
+        default=REGLA.expresion_maxima(),
+        output_field=IntegerField(),
+    )
+
+
+def nombre_pais(campo):
+    """Obtiene el nombre del pais guardado en ``campo`` como expresion del
+    ORM, en el idioma activo.
+
+    Solo incluye los paises de ``settings.COUNTRIES_ONLY``.
+
+    :param campo: Campo con el codigo del pais, por ejemplo
+                  ``'partido__local'``
+    """
+    return Case(
+        *[When(**{campo: codigo}, then=Value(str(nombre)))
+          for codigo, nombre in countries],
+        default=F(campo),
+        output_field=CharField(),
+    )
+
+
+def agregar_puestos(puntajes, desde=0, primer_puesto=None):
+    """Calcula los puestos en python de la misma forma que ``RANK()``.
 
+    Se usa cuando la base de datos no soporta funciones de ventana.
 
-Rank = namedtuple('Rank', 'username puntos')
+    :param puntajes: tuplas (nombre de usuario, puntos) ordenadas de mayor a
+                     menor por puntos
+    :param desde: Indice en el ranking completo del primer puntaje
+    :param primer_puesto: Funcion que recibe los puntos del primer puntaje y
+                          devuelve su puesto. Solo se usa si ``desde`` no es 0
 
+    :returns: Lista de ``Rank``
+    """
+    ranking = []
+    puesto = anterior = None
+    for indice, (username, puntos) in enumerate(puntajes, start=desde + 1):
+        if puntos != anterior:
+            if anterior is None and desde:
+                puesto = primer_puesto(puntos)
+            else:
+                puesto = indice
+            anterior = puntos
+        ranking.append(Rank(username, puntos, puesto))
+    return ranking
 
-def por_usuario(item):
-    """Funcion auxiliar para ordenar por usuario."""
-    return item[0]
 
+def ordenar_ranking(queryset, desde=0, limite=None):
+    """Ordena de mayor a menor por puntos y calcula el puesto de cada usuario
+    en la base de datos.
 
-def por_puntaje(item):
-    """Funcion auxiliar para ordenar por puntaje descendente."""
-    return -item[1]
+    :param queryset: ``QuerySet`` con los campos ``usuario__username`` y
+                     ``puntos``
+    :param desde: Cantidad de usuarios a saltear (``OFFSET``)
+    :param limite: Cantidad maxima de usuarios a obtener (``LIMIT``). Si es
+                   None se obtienen todos.
+
+    :returns: Lista de ``Rank``
+    """
+    ordenado = queryset.order_by('-puntos', 'usuario__username')
+    fin = None if limite is None else desde + limite
+    if not connections[queryset.db].features.supports_over_clause:
+        def primer_puesto(puntos):
+            return queryset.filter(puntos__gt=puntos).count() + 1
+        return agregar_puestos(
+            ordenado.values_list('usuario__username', 'puntos')[desde:fin],
+            desde=desde,
+            primer_puesto=primer_puesto,
+        )
+    # el puesto se calcula sobre todas las filas, antes del LIMIT
+    puestos = (
+        ordenado
+        .annotate(puesto=Window(expression=functions.Rank(),
+                                order_by=F('puntos').desc()))
+        .values_list('usuario__username', 'puntos', 'puesto')
+    )
+    return [Rank(*puesto) for puesto in puestos[desde:fin]]
 
 
 class PartidoManager(Manager):
@@ -44,9 +163,138 @@ class PartidoManager(Manager):
         """Obtiene partidos no empezados"""
         return self.get_queryset().filter(fecha__gt=timezone.now())
 
+    def abiertos(self):
+        """Obtiene partidos en los que todavia se puede apostar"""
+        return self.get_queryset().filter(abierto())
+
+    def cerrados(self, desde, hasta):
+        """Obtiene partidos sin resultado en los que se dejo de poder apostar
+        entre ``desde`` y ``hasta``, porque empezaron o vencio su etapa."""
+        return self.get_queryset().filter(
+            Q(fecha__gt=desde, fecha__lte=hasta) |
+            Q(etapa__vencimiento__gt=desde, etapa__vencimiento__lte=hasta),
+            goles_local__isnull=True,
+        )
+
+    def puntos_abiertos(self):
+        """Obtiene los puntos que todavia se pueden sumar apostando en los
+        partidos abiertos.
+
+        :returns: Diccionario {id de etapa: puntos}
+        """
+        return dict(
+            self.abiertos()
+            .order_by()
+            .values('etapa')
+            .annotate(puntos=Sum(REGLA.expresion_partido(partido='')))
+            .values_list('etapa', 'puntos')
+        )
+
+
+def soporta_upsert(connection):
+    """Indica si la base de datos soporta ``INSERT ... ON CONFLICT``."""
+    if connection.vendor == 'postgresql':
+        return True
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 24)
+    return False
+
 
 class ApuestaManager(Manager):
-    def get_puntajes(self, etapa):
+    # campos que se actualizan si la apuesta ya existe
+    campos_apuesta = ('ganador', 'goles_local', 'goles_visitante')
+    # filas por cada INSERT, SQLite acepta hasta 999 parametros
+    filas_por_insert = 100
+
+    def con_puntaje(self):
+        """Obtiene las apuestas con los puntos y el ganador para mostrar
+        calculados en la base de datos.
+
+        Anota ``puntos``, que es None si el partido no tiene resultado, y
+        ``ganador_display``, el nombre del pais apostado o "Empate". Asi las
+        apuestas se pueden mostrar sin puntuarlas una por una ni acceder a
+        su partido (ver ``Apuesta.puntaje`` y
+        ``Apuesta.get_ganador_display``).
+        """
+        terminado = Q(partido__goles_local__isnull=False,
+                      partido__goles_visitante__isnull=False)
+        return self.get_queryset().annotate(
+            puntos=Case(
+                When(terminado, then=REGLA.expresion()),
+                default=Value(None),
+                output_field=IntegerField(),
+            ),
+            ganador_display=Case(
+                When(ganador=constants.GANA_LOCAL,
+                     then=nombre_pais('partido__local')),
+                When(ganador=constants.GANA_VISITANTE,
+                     then=nombre_pais('partido__visitante')),
+                default=Value('Empate'),
+                output_field=CharField(),
+            ),
+        )
+
+    def guardar(self, apuestas):
+        """Guarda las apuestas en bloque.
+
+        Las apuestas de un usuario en un partido que ya tiene apuesta la
+        reemplazan. Si la base de datos lo soporta se usa un unico
+        ``INSERT ... ON CONFLICT`` (upsert) por cada bloque de apuestas,
+        sino se insertan las nuevas con ``bulk_create`` y se actualizan las
+        existentes (las que tienen ``pk``) una por una.
+
+        No se envia ``post_save``, ver ``utils.guardar_apuestas``.
+
+        :param apuestas: Instancias de ``Apuesta`` con ``usuario`` y
+                         ``partido``
+        """
+        apuestas = list(apuestas)
+        if not apuestas:
+            return
+        connection = connections[router.db_for_write(self.model)]
+        if soporta_upsert(connection):
+            self._upsert(connection, apuestas)
+            return
+        self.bulk_create([apuesta for apuesta in apuestas
+                          if apuesta.pk is None])
+        for apuesta in apuestas:
+            if apuesta.pk is not None:
+                self.filter(pk=apuesta.pk).update(**{
+                    campo: getattr(apuesta, campo)
+                    for campo in self.campos_apuesta
+                })
+
+    def _upsert(self, connection, apuestas):
+        """Guarda las apuestas con ``INSERT ... ON CONFLICT DO UPDATE``."""
+        opts = self.model._meta
+        quote = connection.ops.quote_name
+        columnas = [opts.get_field(campo).column
+                    for campo in ('usuario', 'partido') + self.campos_apuesta]
+        actualizar = ', '.join(
+            f'{quote(columna)} = EXCLUDED.{quote(columna)}'
+            for columna in columnas[2:]
+        )
+        fila = '(' + ', '.join(['%s'] * len(columnas)) + ')'
+        with connection.cursor() as cursor:
+            for inicio in range(0, len(apuestas), self.filas_por_insert):
+                bloque = apuestas[inicio:inicio + self.filas_por_insert]
+                sql = (
+                    f'INSERT INTO {quote(opts.db_table)} '
+                    f'({", ".join(quote(columna) for columna in columnas)}) '
+                    f'VALUES {", ".join([fila] * len(bloque))} '
+                    f'ON CONFLICT ({quote(columnas[0])}, {quote(columnas[1])})'
+                    f' DO UPDATE SET {actualizar}'
+                )
+                parametros = [
+                    valor
+                    for apuesta in bloque
+                    for valor in (apuesta.usuario_id, apuesta.partido_id,
+                                  *(getattr(apuesta, campo)
+                                    for campo in self.campos_apuesta))
+                ]
+                cursor.execute(sql, parametros)
+
+    def get_puntajes(self, etapa, desde=0, limite=None):
         """Obtiene puntajes obtenidos por los usuario en la etapa.
 
         Devuelve una lista de tuplas ordenadas de mayor a menor por puntajes.
@@ -54,55 +302,176 @@ class ApuestaManager(Manager):
 
         :param etapa: Etapa que se quiere obtener puntajes
         :type etapa: ``models.Etapa``
+        :param desde: Cantidad de usuarios a saltear
+        :param limite: Cantidad maxima de usuarios a obtener
 
         :returns: Lista de tuplas
         """
         queryset = self.get_queryset().filter(partido__etapa=etapa)
-        return self.ranking(queryset)
+        return self.ranking(queryset, desde=desde, limite=limite)
 
-    def ranking(self, queryset=None):
+    def ranking(self, queryset=None, desde=0, limite=None):
         """Obtiene puntajes obtenidos por los usuario en todas las etapas.
 
         Devuelve una lista de tuplas ordenadas de mayor a menor por puntajes.
-        Las tuplas tienen la forma (nombre de usuario, puntos)
+        Las tuplas tienen la forma (nombre de usuario, puntos). La suma, el
+        orden y el puesto se calculan en la base de datos, que devuelve una
+        sola fila por usuario.
+
+        :param desde: Cantidad de usuarios a saltear (``OFFSET``)
+        :param limite: Cantidad maxima de usuarios a obtener (``LIMIT``)
 
-        :returns: Lista de tuplas (nombre de usuario, puntos)
+        :returns: Lista de ``Rank`` (nombre de usuario, puntos)
         """
         if queryset is None:
             queryset = self.get_queryset()
         puntajes = (
-            queryset.annotate(
-                # Puntos por ganador
-                puntos_ganador=Case(
-                    When(ganador=GANA_LOCAL,
-                         partido__goles_local__gt=F('partido__goles_visitante'),
-                         then=Value(PUNTOS_GANADOR)),
-                    When(ganador=GANA_VISITANTE,
-                         partido__goles_visitante__gt=F('partido__goles_local'),
-                         then=Value(PUNTOS_GANADOR)),
-                    When(ganador=EMPATE,
-                         partido__goles_visitante=F('partido__goles_local'),
-                         then=Value(PUNTOS_GANADOR)),
-                    default=0,
-                    output_field=PositiveSmallIntegerField(),
-                ),
-                # Puntos por goles
-                puntos_goles=Case(
-                    When(goles_local=F('partido__goles_local'),
-                         goles_visitante=F('partido__goles_visitante'),
-                         then=Value(PUNTOS_GOLES)),
-                    default=0,
-                    output_field=PositiveSmallIntegerField(),
-                ),
-            )
-            .annotate(puntos=F('puntos_goles') + F('puntos_ganador'))
-            .values_list('usuario__username', 'puntos')
-            .order_by('usuario__username')
+            queryset
+            .order_by()
+            .values('usuario__username')
+            .annotate(puntos=Sum(REGLA.expresion()))
+        )
+        return ordenar_ranking(puntajes, desde=desde, limite=limite)
+
+    def puntos_por_usuario(self, queryset=None, por_etapa=False):
+        """Suma en la base de datos los puntos obtenidos por cada usuario.
+
+        :param queryset: Apuestas a tener en cuenta. Por defecto todas.
+        :param por_etapa: Si es verdadero, suma los puntos por usuario y etapa
+
+        Ademas suma en ``maximo`` los puntos que todavia pueden obtener con
+        las apuestas: los puntos de los partidos con resultado y los maximos
+        de los partidos sin resultado en los que ya no se puede cambiar la
+        apuesta. Los partidos abiertos no se suman porque el usuario todavia
+        puede cambiar su apuesta, ver ``PartidoManager.puntos_abiertos``.
+
+        :returns: ``QuerySet`` de diccionarios con las claves ``usuario``,
+                  ``usuario__username``, ``puntos``, ``maximo`` y
+                  ``partido__etapa`` si se agrupa por etapa
+        """
+        if queryset is None:
+            queryset = self.get_queryset()
+        campos = ['usuario', 'usuario__username']
+        if por_etapa:
+            campos.append('partido__etapa')
+        return (
+            queryset
+            # quito el ordenamiento por defecto para que no se agrupe por el
+            .order_by()
+            .values(*campos)
+            .annotate(puntos=Sum(REGLA.expresion()),
+                      maximo=Sum(maximo_apuesta()))
         )
-        # obtengo puntajes sumados por usuario
-        puntajes_sumados = [
-            Rank(user, sum(puntos for _, puntos in group))
-            for user, group in itertools.groupby(puntajes, key=por_usuario)
-        ]
-        # ordeno por cantidad de puntos de mayor a menor
-        return sorted(puntajes_sumados, key=por_puntaje)
+
+
+class PuntajeManager(Manager):
+    def ranking(self, etapa=None, desde=0, limite=None):
+        """Obtiene el ranking a partir de los puntajes guardados.
+
+        :param etapa: Etapa de la que se quiere el ranking. Si es None se
+                      obtiene el ranking de todas las etapas.
+        :param desde: Cantidad de usuarios a saltear (``OFFSET``)
+        :param limite: Cantidad maxima de usuarios a obtener (``LIMIT``)
+
+        :returns: Lista de tuplas (nombre de usuario, puntos) ordenadas de
+                  mayor a menor por puntos
+        """
+        return ordenar_ranking(self.get_queryset().filter(etapa=etapa),
+                               desde=desde,
+                               limite=limite)
+
+    def cantidad(self, etapa=None):
+        """Obtiene la cantidad de usuarios en el ranking."""
+        return self.get_queryset().filter(etapa=etapa).count()
+
+    def alcanzables(self, usernames, etapa=None):
+        """Obtiene los puntos maximos que pueden alcanzar los usuarios y si
+        estan eliminados, es decir si ya no pueden alcanzar los puntos del
+        primero.
+
+        :param usernames: Nombres de usuario a consultar
+        :returns: Diccionario {nombre de usuario: ``Alcanzable``}. No se
+                  incluyen los puntajes sin maximo calculado.
+        """
+        puntajes = self.get_queryset().filter(etapa=etapa)
+        puntos_primero = Subquery(
+            puntajes.order_by('-puntos').values('puntos')[:1])
+        filas = (
+            puntajes
+            .filter(usuario__username__in=usernames, maximo__isnull=False)
+            .annotate(eliminado=Case(
+                When(maximo__lt=puntos_primero, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField(),
+            ))
+            .values_list('usuario__username', 'maximo', 'eliminado')
+        )
+        return {username: Alcanzable(maximo, eliminado)
+                for username, maximo, eliminado in filas}
+
+    def alrededor(self, usuario, cantidad, etapa=None):
+        """Obtiene la porcion del ranking alrededor del usuario.
+
+        :param cantidad: Cantidad de usuarios a obtener antes y despues del
+                         usuario
+
+        :returns: Lista de hasta ``2 * cantidad + 1`` ``Rank`` o lista vacia
+                  si el usuario no tiene puntaje
+        """
+        posicion = self.posicion(usuario, etapa=etapa)
+        if posicion is None:
+            return []
+        desde = max(posicion - 1 - cantidad, 0)
+        limite = posicion - desde + cantidad
+        return self.ranking(etapa=etapa, desde=desde, limite=limite)
+
+    def puntos(self, etapa=None):
+        """Obtiene los puntos guardados en la etapa, o el total si no se
+        indica etapa.
+
+        Util desde el related manager del usuario: ``usuario.puntajes.puntos()``
+
+        :returns: int
+        """
+        puntos = (
+            self.get_queryset()
+            .filter(etapa=etapa)
+            .values_list('puntos', flat=True)
+            .first()
+        )
+        return puntos or 0
+
+    def posicion(self, usuario, etapa=None):
+        """Obtiene el puesto del usuario en el ranking sin armar el ranking
+        completo.
+
+        :returns: int o None si el usuario no tiene puntaje
+        """
+        try:
+            puntaje = self.get_queryset().get(usuario=usuario, etapa=etapa)
+        except self.model.DoesNotExist:
+            return None
+        # cuento los usuarios que estan antes en el ranking. En caso de empate
+        # se ordena por nombre de usuario
+        mejores = self.get_queryset().filter(
+            Q(puntos__gt=puntaje.puntos) |
+            Q(puntos=puntaje.puntos,
+              usuario__username__lt=usuario.username),
+            etapa=etapa,
+        )
+        return mejores.count() + 1
+
+    def puesto(self, usuario, etapa=None):
+        """Obtiene el puesto del usuario como en ``ordenar_ranking``: los
+        usuarios empatados comparten el puesto.
+
+        :returns: int o None si el usuario no tiene puntaje
+        """
+        puntos = (self.get_queryset()
+                  .filter(usuario=usuario, etapa=etapa)
+                  .values_list('puntos', flat=True)
+                  .first())
+        if puntos is None:
+            return None
+        mejores = self.get_queryset().filter(puntos__gt=puntos, etapa=etapa)
+        return mejores.count() + 1
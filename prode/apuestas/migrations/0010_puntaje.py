@@ -0,0 +1,81 @@
+# Generated by Django 2.0.5 on 2026-10-18 06:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def calcular_puntajes(apps, schema_editor):
+    """Guarda los puntajes de las apuestas hechas hasta el momento.
+
+    Usa las reglas de puntaje vigentes al momento de la migracion: 1 punto
+    por ganador y 3 por goles.
+    """
+    Apuesta = apps.get_model('apuestas', 'Apuesta')
+    Puntaje = apps.get_model('apuestas', 'Puntaje')
+    F = models.F
+    puntos_ganador = models.Case(
+        models.When(ganador='L',
+                    partido__goles_local__gt=F('partido__goles_visitante'),
+                    then=1),
+        models.When(ganador='V',
+                    partido__goles_visitante__gt=F('partido__goles_local'),
+                    then=1),
+        models.When(ganador='E',
+                    partido__goles_visitante=F('partido__goles_local'),
+                    then=1),
+        default=0,
+        output_field=models.IntegerField(),
+    )
+    puntos_goles = models.Case(
+        models.When(goles_local=F('partido__goles_local'),
+                    goles_visitante=F('partido__goles_visitante'),
+                    then=3),
+        default=0,
+        output_field=models.IntegerField(),
+    )
+    puntos = models.Sum(puntos_ganador) + models.Sum(puntos_goles)
+    apuestas = Apuesta.objects.order_by()
+    por_etapa = (apuestas
+                 .filter(partido__etapa__isnull=False)
+                 .values('usuario', 'partido__etapa')
+                 .annotate(puntos=puntos))
+    totales = apuestas.values('usuario').annotate(puntos=puntos)
+    Puntaje.objects.bulk_create(
+        [Puntaje(usuario_id=fila['usuario'],
+                 etapa_id=fila['partido__etapa'],
+                 puntos=fila['puntos'])
+         for fila in por_etapa] +
+        [Puntaje(usuario_id=fila['usuario'], puntos=fila['puntos'])
+         for fila in totales],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('apuestas', '0009_auto_20180620_2051'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Puntaje',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puntos', models.PositiveIntegerField(default=0)),
+                ('etapa', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='puntajes', to='apuestas.Etapa')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='puntajes', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='puntaje',
+            index=models.Index(fields=['etapa', '-puntos'], name='apuestas_pu_etapa_i_e3e1f1_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='puntaje',
+            unique_together={('usuario', 'etapa')},
+        ),
+        migrations.RunPython(calcular_puntajes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.0.5 on 2026-10-18 06:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apuestas', '0010_puntaje'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='etapa',
+            name='puntos_ganador',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Puntos por acertar el ganador del partido. Dejar vacío\n        para usar el valor por defecto (1)', null=True),
+        ),
+        migrations.AddField(
+            model_name='etapa',
+            name='puntos_goles',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Puntos por acertar la cantidad de goles de cada equipo.\n        Dejar vacío para usar el valor por defecto (3)', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.0.5 on 2026-10-18 07:01
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('apuestas', '0011_etapa_puntos'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Probabilidad',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('primero', models.FloatField(help_text='Probabilidad de terminar primero')),
+                ('entre_primeros', models.FloatField(help_text='Probabilidad de terminar entre los primeros ``puestos``')),
+                ('puestos', models.PositiveSmallIntegerField()),
+                ('simulaciones', models.PositiveIntegerField()),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('usuario', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='probabilidad', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.0.5 on 2026-10-18 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apuestas', '0012_probabilidad'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='puntaje',
+            name='maximo',
+            field=models.PositiveIntegerField(help_text='Puntos maximos que todavia puede alcanzar', null=True),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 2.0.5 on 2026-10-18 07:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apuestas', '0013_puntaje_maximo'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EstadisticaPartido',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('apuestas', models.PositiveIntegerField(default=0)),
+                ('gana_local', models.PositiveIntegerField(default=0)),
+                ('empate', models.PositiveIntegerField(default=0)),
+                ('gana_visitante', models.PositiveIntegerField(default=0)),
+                ('actualizado', models.DateTimeField(auto_now=True)),
+                ('partido', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='estadistica', to='apuestas.Partido')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PuntosObtenidos',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puntos', models.PositiveSmallIntegerField()),
+                ('cantidad', models.PositiveIntegerField()),
+                ('partido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='puntos_obtenidos', to='apuestas.Partido')),
+            ],
+            options={
+                'ordering': ('-puntos',),
+            },
+        ),
+        migrations.CreateModel(
+            name='ResultadoApostado',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('goles_local', models.PositiveSmallIntegerField()),
+                ('goles_visitante', models.PositiveSmallIntegerField()),
+                ('cantidad', models.PositiveIntegerField()),
+                ('partido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='resultados_apostados', to='apuestas.Partido')),
+            ],
+            options={
+                'ordering': ('-cantidad', 'goles_local', 'goles_visitante'),
+            },
+        ),
+    ]
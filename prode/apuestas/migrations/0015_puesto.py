@@ -0,0 +1,30 @@
+# Generated by Django 2.0.5 on 2026-10-18 07:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('apuestas', '0014_estadisticas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Puesto',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('puesto', models.PositiveIntegerField()),
+                ('anterior', models.PositiveIntegerField(help_text='Puesto antes del ultimo cambio', null=True)),
+                ('etapa', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='puestos', to='apuestas.Etapa')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='puestos', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='puesto',
+            unique_together={('usuario', 'etapa')},
+        ),
+    ]
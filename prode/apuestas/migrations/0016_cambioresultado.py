@@ -0,0 +1,30 @@
+# Generated by Django 2.0.5 on 2026-10-18 07:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apuestas', '0015_puesto'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CambioResultado',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('goles_local_anterior', models.PositiveSmallIntegerField(null=True)),
+                ('goles_visitante_anterior', models.PositiveSmallIntegerField(null=True)),
+                ('goles_local', models.PositiveSmallIntegerField(null=True)),
+                ('goles_visitante', models.PositiveSmallIntegerField(null=True)),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('aplicado', models.BooleanField(default=False)),
+                ('partido', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cambios_resultado', to='apuestas.Partido')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations
+from django.db.models import Min
+
+
+def borrar_totales_repetidos(apps, schema_editor):
+    """Deja un solo puntaje total por usuario, el mas antiguo."""
+    Puntaje = apps.get_model('apuestas', 'Puntaje')
+    totales = Puntaje.objects.filter(etapa__isnull=True)
+    conservar = (totales
+                 .values('usuario')
+                 .annotate(primero=Min('id'))
+                 .values_list('primero', flat=True))
+    totales.exclude(id__in=list(conservar)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('apuestas', '0016_cambioresultado'),
+    ]
+
+    # unique_together no impide repetir el total de un usuario porque la
+    # etapa es nula, para eso se agrega un indice unico parcial
+    operations = [
+        migrations.RunPython(borrar_totales_repetidos,
+                             migrations.RunPython.noop),
+        migrations.RunSQL(
+            ['CREATE UNIQUE INDEX apuestas_puntaje_total_unico '
+             'ON apuestas_puntaje (usuario_id) WHERE etapa_id IS NULL'],
+            ['DROP INDEX apuestas_puntaje_total_unico'],
+        ),
+    ]
@@ -8,6 +8,7 @@ from django_countries.fields import CountryField
 from . import (
     constants,
     managers,
+    puntuacion,
 )
 
 
@@ -36,6 +37,20 @@ class Etapa(models.Model):
     publica = models.BooleanField(help_text="""
     Tildar cuando la etapa este lista para ser mostrada a los apostadores para
     que empiecen a apostar""")
+    # permiten cambiar las reglas de puntaje en la etapa, por ejemplo doble
+    # puntaje en la final. Si son nulos se usan los puntos por defecto
+    puntos_ganador = models.PositiveSmallIntegerField(
+        blank=True,
+        null=True,
+        help_text=f"""Puntos por acertar el ganador del partido. Dejar vacío
+        para usar el valor por defecto ({constants.PUNTOS_GANADOR})""",
+    )
+    puntos_goles = models.PositiveSmallIntegerField(
+        blank=True,
+        null=True,
+        help_text=f"""Puntos por acertar la cantidad de goles de cada equipo.
+        Dejar vacío para usar el valor por defecto ({constants.PUNTOS_GOLES})""",
+    )
 
     created = models.DateTimeField(auto_now_add=True)
 
@@ -173,19 +188,197 @@ class Apuesta(models.Model):
             * 1 punto si acierta el ganador
             * 3 puntos si acierta la cantidad de goles por equipo
             * 4 puntos si acierta ambos
+
+        La etapa puede redefinir los puntos de cada acierto. Las reglas estan
+        definidas en ``puntuacion.REGLA``.
         """
-        puntos = 0
-        goles_local = self.partido.goles_local
-        goles_visitante = self.partido.goles_visitante
-        resultado = self.partido.resultado
-        # verifico si coincide ganador
-        if self.ganador == resultado:
-            puntos += constants.PUNTOS_GANADOR
-        # verifico si coincide goles
-        if (self.goles_local == goles_local and
-                self.goles_visitante == goles_visitante):
-            puntos += constants.PUNTOS_GOLES
-        return puntos
+        return puntuacion.REGLA.puntuar(self)
 
     def __str__(self):
         return f'Apuesta "{self.partido}" por {self.usuario}'
+
+
+class CambioResultado(models.Model):
+    """Cambio en el resultado de un partido, con el resultado anterior y el
+    nuevo.
+
+    Se registra al cargar resultados (ver ``resultados``). Mientras no este
+    ``aplicado`` los puntajes guardados siguen calculados con el resultado
+    anterior.
+    """
+    partido = models.ForeignKey(Partido,
+                                related_name='cambios_resultado',
+                                on_delete=models.CASCADE)
+    goles_local_anterior = models.PositiveSmallIntegerField(null=True)
+    goles_visitante_anterior = models.PositiveSmallIntegerField(null=True)
+    goles_local = models.PositiveSmallIntegerField(null=True)
+    goles_visitante = models.PositiveSmallIntegerField(null=True)
+    fecha = models.DateTimeField(auto_now_add=True)
+    aplicado = models.BooleanField(default=False)
+
+    class Meta:
+        ordering = ('id',)
+
+    @property
+    def correccion(self):
+        """Si el partido ya tenia resultado y lo sigue teniendo."""
+        return None not in (self.goles_local_anterior,
+                            self.goles_visitante_anterior,
+                            self.goles_local,
+                            self.goles_visitante)
+
+    def __str__(self):
+        return (f'{self.partido.local.name} - {self.partido.visitante.name}: '
+                f'{self.goles_local_anterior}-{self.goles_visitante_anterior}'
+                f' a {self.goles_local}-{self.goles_visitante}')
+
+
+class Puntaje(models.Model):
+    """Puntaje acumulado por un usuario.
+
+    Se guarda un registro por cada etapa en la que aposto el usuario y uno
+    con ``etapa`` nula con el total de todas sus apuestas. Se mantiene
+    actualizado cada vez que se cargan resultados (ver ``signals``), de modo
+    que armar el ranking no requiera recorrer todas las apuestas.
+    """
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                related_name='puntajes',
+                                on_delete=models.CASCADE)
+    etapa = models.ForeignKey(Etapa,
+                              null=True,
+                              related_name='puntajes',
+                              on_delete=models.CASCADE)
+    puntos = models.PositiveIntegerField(default=0)
+    maximo = models.PositiveIntegerField(
+        null=True,
+        help_text='Puntos maximos que todavia puede alcanzar',
+    )
+    objects = managers.PuntajeManager()
+
+    class Meta:
+        # el total (etapa nula) es unico por el indice parcial
+        # apuestas_puntaje_total_unico, ver migracion 0017
+        unique_together = ('usuario', 'etapa')
+        indexes = [
+            models.Index(fields=['etapa', '-puntos']),
+        ]
+
+    def __str__(self):
+        etapa = self.etapa or 'Total'
+        return f'{self.usuario}: {self.puntos} puntos ({etapa})'
+
+
+class Puesto(models.Model):
+    """Puesto de un usuario en el ranking de una etapa, o en el total si
+    ``etapa`` es nula, junto al puesto que tenia antes del ultimo cambio.
+
+    Se actualiza luego de cargar resultados (ver ``puestos``).
+    """
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL,
+                                related_name='puestos',
+                                on_delete=models.CASCADE)
+    etapa = models.ForeignKey(Etapa,
+                              null=True,
+                              related_name='puestos',
+                              on_delete=models.CASCADE)
+    puesto = models.PositiveIntegerField()
+    anterior = models.PositiveIntegerField(
+        null=True,
+        help_text='Puesto antes del ultimo cambio',
+    )
+
+    class Meta:
+        # el total (etapa nula) es unico por el indice parcial
+        # apuestas_puesto_total_unico, ver migracion 0018
+        unique_together = ('usuario', 'etapa')
+
+    @property
+    def cambio(self):
+        """Puestos que subio (positivo) o bajo (negativo) en el ultimo
+        cambio, None si no tenia puesto."""
+        if self.anterior is None:
+            return None
+        return self.anterior - self.puesto
+
+    def __str__(self):
+        etapa = self.etapa or 'Total'
+        return f'{self.usuario}: puesto {self.puesto} ({etapa})'
+
+
+class Probabilidad(models.Model):
+    """Probabilidad de un usuario de ganar el prode.
+
+    Se estima simulando los partidos que faltan jugar (ver ``simulacion``) y
+    se vuelve a calcular cada vez que se cargan resultados.
+    """
+    usuario = models.OneToOneField(settings.AUTH_USER_MODEL,
+                                   related_name='probabilidad',
+                                   on_delete=models.CASCADE)
+    primero = models.FloatField(help_text='Probabilidad de terminar primero')
+    entre_primeros = models.FloatField(
+        help_text='Probabilidad de terminar entre los primeros ``puestos``')
+    puestos = models.PositiveSmallIntegerField()
+    simulaciones = models.PositiveIntegerField()
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.usuario}: {self.primero:.1%} de terminar primero'
+
+
+class EstadisticaPartido(models.Model):
+    """Resumen de las apuestas de un partido.
+
+    Se calcula con ``GROUP BY`` en la base de datos una vez vencida la etapa,
+    cuando ya no cambian las apuestas, y se vuelve a calcular si cambia el
+    resultado del partido (ver ``estadisticas``). Junto a los
+    ``ResultadoApostado`` y ``PuntosObtenidos`` del partido permite mostrar
+    el detalle de la etapa sin recorrer todas las apuestas.
+    """
+    partido = models.OneToOneField(Partido,
+                                   related_name='estadistica',
+                                   on_delete=models.CASCADE)
+    apuestas = models.PositiveIntegerField(default=0)
+    gana_local = models.PositiveIntegerField(default=0)
+    empate = models.PositiveIntegerField(default=0)
+    gana_visitante = models.PositiveIntegerField(default=0)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.partido}: {self.apuestas} apuestas'
+
+
+class ResultadoApostado(models.Model):
+    """Cantidad de apuestas a un resultado exacto de un partido.
+
+    Solo se guardan los resultados mas apostados de cada partido.
+    """
+    partido = models.ForeignKey(Partido,
+                                related_name='resultados_apostados',
+                                on_delete=models.CASCADE)
+    goles_local = models.PositiveSmallIntegerField()
+    goles_visitante = models.PositiveSmallIntegerField()
+    cantidad = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ('-cantidad', 'goles_local', 'goles_visitante')
+
+    def __str__(self):
+        return (f'{self.partido.local.name} {self.goles_local} - '
+                f'{self.goles_visitante} {self.partido.visitante.name}: '
+                f'{self.cantidad}')
+
+
+class PuntosObtenidos(models.Model):
+    """Cantidad de apuestas de un partido terminado que obtuvieron
+    ``puntos``."""
+    partido = models.ForeignKey(Partido,
+                                related_name='puntos_obtenidos',
+                                on_delete=models.CASCADE)
+    puntos = models.PositiveSmallIntegerField()
+    cantidad = models.PositiveIntegerField()
+
+    class Meta:
+        ordering = ('-puntos',)
+
+    def __str__(self):
+        return f'{self.partido}: {self.cantidad} con {self.puntos} puntos'
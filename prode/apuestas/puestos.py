@@ -0,0 +1,87 @@
+"""Puestos guardados en los rankings y cuantos puestos cambio cada usuario.
+
+El ranking se sigue armando con los puntajes guardados (ver
+``PuntajeManager.ranking``); los ``Puesto`` solo guardan el puesto que se
+calculo luego de la ultima carga de resultados y el que tenia el usuario
+antes, para mostrar cuantos puestos subio o bajo.
+
+Actualizar es idempotente: el puesto anterior solo se reemplaza si cambio el
+puesto, por lo que volver a actualizar con los mismos puntajes no pierde los
+cambios.
+"""
+from django.db import transaction
+
+from . import (
+    models,
+    utils,
+)
+
+
+def calcular(etapa=None):
+    """Calcula el puesto de cada usuario con los puntajes guardados, donde
+    los usuarios empatados comparten puesto (como ``RANK()``).
+
+    :returns: Diccionario {id de usuario: puesto}
+    """
+    puntajes = (models.Puntaje.objects
+                .filter(etapa=etapa)
+                .order_by('-puntos')
+                .values_list('usuario', 'puntos'))
+    puestos = {}
+    puesto = anterior = None
+    for indice, (usuario, puntos) in enumerate(puntajes, start=1):
+        if puntos != anterior:
+            puesto, anterior = indice, puntos
+        puestos[usuario] = puesto
+    return puestos
+
+
+@transaction.atomic
+def actualizar(etapas=(None,)):
+    """Recalcula los puestos guardados en los rankings de las etapas.
+
+    Antes de calcular cada ranking se bloquean sus usuarios (ver
+    ``utils.bloquear_usuarios``), asi dos actualizaciones simultaneas no
+    borran e insertan los mismos puestos a la vez y los puestos se calculan
+    con los puntajes que guardo un recalculo que termino antes.
+
+    :param etapas: Etapas (o ids) a actualizar, None es el ranking total
+    """
+    for etapa in etapas:
+        utils.bloquear_usuarios(models.Puntaje.objects
+                                .filter(etapa=etapa)
+                                .values('usuario'))
+        puestos = calcular(etapa)
+        guardados = {
+            usuario: (puesto, anterior)
+            for usuario, puesto, anterior in (models.Puesto.objects
+                                              .filter(etapa=etapa)
+                                              .values_list('usuario',
+                                                           'puesto',
+                                                           'anterior'))
+        }
+        nuevos = []
+        for usuario, puesto in puestos.items():
+            guardado, anterior = guardados.get(usuario, (None, None))
+            if guardado != puesto:
+                anterior = guardado
+            nuevos.append(models.Puesto(usuario_id=usuario,
+                                        etapa_id=getattr(etapa, 'pk', etapa),
+                                        puesto=puesto,
+                                        anterior=anterior))
+        models.Puesto.objects.filter(etapa=etapa).delete()
+        models.Puesto.objects.bulk_create(nuevos, batch_size=1000)
+
+
+def cambios(usernames, etapa=None):
+    """Obtiene cuantos puestos subio o bajo cada usuario en el ultimo cambio.
+
+    :returns: Diccionario {nombre de usuario: cambio}, sin los usuarios que
+              no tenian puesto antes
+    """
+    puestos = (models.Puesto.objects
+               .filter(etapa=etapa, usuario__username__in=usernames,
+                       anterior__isnull=False)
+               .values_list('usuario__username', 'puesto', 'anterior'))
+    return {username: anterior - puesto
+            for username, puesto, anterior in puestos}
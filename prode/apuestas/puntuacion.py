@@ -0,0 +1,292 @@
+"""Reglas de puntaje de las apuestas.
+
+Las reglas se definen una sola vez en ``REGLA`` como una lista de criterios
+(acertar el ganador, acertar los goles) y a partir de ella se obtiene:
+
+* la expresion del ORM para puntuar dentro de la base de datos
+  (``ReglaPuntaje.expresion``)
+* el calculo vectorizado con NumPy para puntuar miles de apuestas de una vez
+  (``ReglaPuntaje.calcular``)
+* el puntaje de una apuesta individual (``ReglaPuntaje.puntuar``)
+* los puntos maximos que todavia puede sumar una apuesta de un partido sin
+  resultado (``ReglaPuntaje.expresion_maxima``)
+
+Cada etapa puede redefinir los puntos de cada criterio (por ejemplo doble
+puntaje en la final) con los campos ``Etapa.puntos_ganador`` y
+``Etapa.puntos_goles``. Si estan vacios se usan los puntos por defecto de
+``constants``.
+
+Los partidos sin resultado se representan con ``None`` (o ``NaN``) en los
+goles y suman 0 puntos.
+"""
+import numpy as np
+from django.db.models import (
+    Case,
+    F,
+    IntegerField,
+    Q,
+    Value,
+    When,
+)
+from django.db.models.functions import (
+    Coalesce,
+    Greatest,
+)
+
+from . import constants
+
+# El ganador se codifica como el signo de goles_local - goles_visitante
+SIGNO_GANADOR = {
+    constants.GANA_LOCAL: 1,
+    constants.EMPATE: 0,
+    constants.GANA_VISITANTE: -1,
+}
+
+
+class Criterio:
+    """Condicion que debe cumplir una apuesta para sumar puntos.
+
+    :param puntos: Puntos por defecto si se cumple la condicion
+    :param campo: Campo de ``Etapa`` que permite redefinir los puntos
+    """
+    # si la condicion solo se cumple acertando el resultado exacto
+    exacto = False
+
+    def __init__(self, puntos, campo):
+        self.puntos = puntos
+        self.campo = campo
+
+    def condicion(self, resultado='partido__'):
+        """Obtiene la condicion como ``Q`` sobre ``Apuesta``.
+
+        :param resultado: Prefijo de los campos ``goles_local`` y
+                          ``goles_visitante`` con el resultado. Con ``''`` se
+                          evalua como si el resultado fuera el apostado.
+        """
+        raise NotImplementedError
+
+    def evaluar(self, apuestas):
+        """Evalua la condicion sobre arrays.
+
+        :param apuestas: ``Columnas`` con los datos de las apuestas
+        :returns: ``numpy.ndarray`` de booleanos
+        """
+        raise NotImplementedError
+
+    def cumple(self, apuesta):
+        """Evalua la condicion sobre una ``Apuesta``."""
+        raise NotImplementedError
+
+    def expresion_puntos(self, partido='partido__'):
+        """Obtiene los puntos del criterio en la etapa del partido como
+        expresion del ORM.
+
+        :param partido: Prefijo para llegar al partido. Con ``''`` se usa
+                        sobre ``Partido``.
+        """
+        return Coalesce(F(f'{partido}etapa__{self.campo}'),
+                        Value(self.puntos))
+
+    def expresion(self, resultado='partido__'):
+        """Obtiene los puntos que suma la apuesta como expresion del ORM.
+
+        :param resultado: Ver ``condicion``
+        """
+        return Case(
+            When(self.condicion(resultado), then=self.expresion_puntos()),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+
+    def puntos_etapa(self, etapa):
+        """Obtiene los puntos que otorga el criterio en la etapa."""
+        puntos = getattr(etapa, self.campo, None)
+        return self.puntos if puntos is None else puntos
+
+
+class AciertaGanador(Criterio):
+    """La apuesta acierta quien gana el partido o si es empate."""
+
+    def __init__(self, puntos=constants.PUNTOS_GANADOR,
+                 campo='puntos_ganador'):
+        super().__init__(puntos, campo)
+
+    def condicion(self, resultado='partido__'):
+        goles_local = f'{resultado}goles_local'
+        goles_visitante = f'{resultado}goles_visitante'
+        return (
+            Q(ganador=constants.GANA_LOCAL,
+              **{f'{goles_local}__gt': F(goles_visitante)}) |
+            Q(ganador=constants.GANA_VISITANTE,
+              **{f'{goles_visitante}__gt': F(goles_local)}) |
+            Q(ganador=constants.EMPATE,
+              **{goles_visitante: F(goles_local)})
+        )
+
+    def evaluar(self, apuestas):
+        # las comparaciones con NaN son falsas
+        resultado = np.sign(apuestas.partido_goles_local -
+                            apuestas.partido_goles_visitante)
+        return apuestas.ganador == resultado
+
+    def cumple(self, apuesta):
+        return apuesta.ganador == apuesta.partido.resultado
+
+
+class AciertaGoles(Criterio):
+    """La apuesta acierta la cantidad exacta de goles de cada equipo."""
+    exacto = True
+
+    def __init__(self, puntos=constants.PUNTOS_GOLES, campo='puntos_goles'):
+        super().__init__(puntos, campo)
+
+    def condicion(self, resultado='partido__'):
+        return Q(goles_local=F(f'{resultado}goles_local'),
+                 goles_visitante=F(f'{resultado}goles_visitante'))
+
+    def evaluar(self, apuestas):
+        return ((apuestas.goles_local == apuestas.partido_goles_local) &
+                (apuestas.goles_visitante == apuestas.partido_goles_visitante))
+
+    def cumple(self, apuesta):
+        return (apuesta.goles_local == apuesta.partido.goles_local and
+                apuesta.goles_visitante == apuesta.partido.goles_visitante)
+
+
+def _array(valores):
+    """Convierte una secuencia a array de floats con NaN en lugar de None."""
+    return np.array([np.nan if valor is None else valor for valor in valores],
+                    dtype=float)
+
+
+class Columnas:
+    """Datos de un conjunto de apuestas como arrays, una posicion por apuesta.
+    """
+
+    def __init__(self, ganador, goles_local, goles_visitante,
+                 partido_goles_local, partido_goles_visitante):
+        self.ganador = np.array([SIGNO_GANADOR[valor] for valor in ganador],
+                                dtype=float)
+        self.goles_local = _array(goles_local)
+        self.goles_visitante = _array(goles_visitante)
+        self.partido_goles_local = _array(partido_goles_local)
+        self.partido_goles_visitante = _array(partido_goles_visitante)
+
+    def __len__(self):
+        return len(self.ganador)
+
+
+class ReglaPuntaje:
+    """Conjunto de criterios con los que se puntua una apuesta.
+
+    Los puntos de una apuesta son la suma de los puntos de cada criterio que
+    cumple.
+    """
+
+    def __init__(self, *criterios):
+        self.criterios = criterios
+
+    @property
+    def campos_etapa(self):
+        """Campos de ``Etapa`` con los que se redefinen los puntos."""
+        return [criterio.campo for criterio in self.criterios]
+
+    def expresion(self, resultado='partido__'):
+        """Obtiene los puntos de la apuesta como expresion del ORM.
+
+        Se puede usar en ``annotate`` o dentro de un ``Sum`` sobre un
+        ``QuerySet`` de ``Apuesta``.
+
+        :param resultado: Ver ``Criterio.condicion``
+        """
+        return _sumar(criterio.expresion(resultado)
+                      for criterio in self.criterios)
+
+    def expresion_maxima(self):
+        """Obtiene los puntos maximos que puede sumar la apuesta, sea cual
+        sea el resultado, como expresion del ORM.
+
+        El maximo se obtiene si el resultado es el apostado o, si el
+        ganador apostado no coincide con los goles apostados, acertando solo
+        el ganador.
+        """
+        return Greatest(
+            self.expresion(resultado=''),
+            _sumar(criterio.expresion_puntos()
+                   for criterio in self.criterios if not criterio.exacto),
+            output_field=IntegerField(),
+        )
+
+    def expresion_partido(self, partido='partido__'):
+        """Obtiene los puntos que otorga un partido a quien acierta todo como
+        expresion del ORM.
+
+        :param partido: Ver ``Criterio.expresion_puntos``
+        """
+        return _sumar(criterio.expresion_puntos(partido)
+                      for criterio in self.criterios)
+
+    def calcular(self, ganador, goles_local, goles_visitante,
+                 partido_goles_local, partido_goles_visitante, **puntos):
+        """Calcula los puntos de cada apuesta con operaciones vectorizadas.
+
+        Todos los parametros son secuencias del mismo largo, una posicion por
+        apuesta.
+
+        :param ganador: Ganador apostado (``constants.GANA_LOCAL``, etc)
+        :param goles_local: Goles apostados al local
+        :param goles_visitante: Goles apostados al visitante
+        :param partido_goles_local: Goles del local en el partido o None
+        :param partido_goles_visitante: Goles del visitante en el partido o
+                                        None
+        :param puntos: Puntos redefinidos por la etapa de cada apuesta, con
+                       el nombre del campo de ``Etapa`` como clave. Las
+                       posiciones en None usan los puntos por defecto.
+
+        :returns: ``numpy.ndarray`` de enteros con los puntos de cada apuesta
+        """
+        apuestas = Columnas(ganador, goles_local, goles_visitante,
+                            partido_goles_local, partido_goles_visitante)
+        total = np.zeros(len(apuestas), dtype=int)
+        for criterio in self.criterios:
+            puntos_criterio = np.full(len(apuestas), criterio.puntos,
+                                      dtype=float)
+            if puntos.get(criterio.campo) is not None:
+                redefinidos = _array(puntos[criterio.campo])
+                puntos_criterio = np.where(np.isnan(redefinidos),
+                                           puntos_criterio, redefinidos)
+            total += (criterio.evaluar(apuestas) *
+                      puntos_criterio).astype(int)
+        return total
+
+    def puntuar(self, apuesta):
+        """Calcula los puntos de una apuesta.
+
+        :raises ValueError: Si el partido no tiene resultado
+        """
+        etapa = apuesta.partido.etapa
+        return sum(criterio.puntos_etapa(etapa)
+                   for criterio in self.criterios
+                   if criterio.cumple(apuesta))
+
+
+def _sumar(expresiones):
+    """Suma expresiones del ORM."""
+    expresiones = list(expresiones)
+    if not expresiones:
+        return Value(0)
+    expresion = expresiones[0]
+    for otra in expresiones[1:]:
+        expresion = expresion + otra
+    return expresion
+
+
+REGLA = ReglaPuntaje(AciertaGanador(), AciertaGoles())
+
+
+def calcular_puntos(*args, **kwargs):
+    """Calcula los puntos de cada apuesta con ``REGLA``.
+
+    Ver ``ReglaPuntaje.calcular``.
+    """
+    return REGLA.calcular(*args, **kwargs)
@@ -0,0 +1,130 @@
+"""Renderizado rapido de la pantalla de apuestas.
+
+Con ``{{ form|crispy }}`` cada campo de cada partido se arma con varios
+templates y, en una etapa de 48 partidos, eso domina el tiempo de respuesta.
+Ademas los nombres de los paises se resuelven en ``django_countries`` una y
+otra vez. Aca el markup fijo de cada partido (nombres, banderas, labels y
+opciones del ganador) se arma una sola vez por proceso, por pais local,
+visitante e idioma, y en cada pedido solo se completan el prefijo del
+formulario y los valores apostados.
+
+El markup es el mismo que arma crispy con bootstrap4 para un formulario sin
+errores; los formularios con errores se siguen renderizando con crispy.
+"""
+import functools
+
+from django.utils import translation
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+from django_countries.fields import Country
+
+from . import constants
+
+CAMPO = (
+    '<div id="div_id_{{prefijo}}-{campo}" class="form-group">'
+    '<label for="id_{{prefijo}}-{campo}" class="col-form-label '
+    'requiredField">{label}<span class="asteriskField">*</span></label>'
+    '<div class="">{widget}</div></div>'
+)
+SELECT = (
+    '<select name="{{prefijo}}-{campo}" class="select form-control" '
+    'id="id_{{prefijo}}-{campo}">{opciones}</select>'
+)
+OPCION = '<option value="{valor}"{{{marca}}}>{label}</option>'
+NUMERO = (
+    '<input type="number" name="{{prefijo}}-{campo}" value="{{{campo}}}" '
+    'min="0" class="numberinput form-control" id="id_{{prefijo}}-{campo}" />'
+)
+
+
+def _texto(valor):
+    """Escapa el texto para HTML y para ``str.format``."""
+    return escape(valor).replace('{', '{{').replace('}', '}}')
+
+
+@functools.lru_cache(maxsize=512)
+def _etiquetas(local, visitante, idioma):
+    local, visitante = Country(local), Country(visitante)
+    return {
+        'local': local.name,
+        'visitante': visitante.name,
+        'bandera_local': local.unicode_flag,
+        'bandera_visitante': visitante.unicode_flag,
+        'opciones': (
+            (constants.EMPATE, 'Empate'),
+            (constants.GANA_LOCAL, f'Gana {local.name}'),
+            (constants.GANA_VISITANTE, f'Gana {visitante.name}'),
+        ),
+    }
+
+
+def etiquetas(partido):
+    """Obtiene los nombres, banderas y opciones del ganador del partido.
+
+    :returns: Diccionario con las claves ``local``, ``visitante``,
+              ``bandera_local``, ``bandera_visitante`` y ``opciones``
+    """
+    return _etiquetas(partido.local.code, partido.visitante.code,
+                      translation.get_language())
+
+
+@functools.lru_cache(maxsize=512)
+def _titulo(local, visitante, idioma):
+    datos = _etiquetas(local, visitante, idioma)
+    return mark_safe(escape(
+        f'{datos["local"]} {datos["bandera_local"]} - '
+        f'{datos["visitante"]} {datos["bandera_visitante"]}'
+    ))
+
+
+def titulo(partido):
+    """Obtiene el titulo del partido, por ejemplo "Argentina 🇦🇷 - Brasil 🇧🇷"."""
+    return _titulo(partido.local.code, partido.visitante.code,
+                   translation.get_language())
+
+
+@functools.lru_cache(maxsize=512)
+def _plantilla(local, visitante, idioma):
+    """Arma el markup fijo de los campos de la apuesta como plantilla de
+    ``str.format`` con los campos ``prefijo``, ``goles_local``,
+    ``goles_visitante`` y una marca por cada opcion del ganador.
+    """
+    datos = _etiquetas(local, visitante, idioma)
+    opciones = ''.join(
+        OPCION.format(valor=_texto(valor), marca=f'marca_{valor}',
+                      label=_texto(label))
+        for valor, label in datos['opciones']
+    )
+    return ''.join([
+        CAMPO.format(campo='ganador', label='Ganador',
+                     widget=SELECT.format(campo='ganador', opciones=opciones)),
+        CAMPO.format(campo='goles_local', label=_texto(datos['local']),
+                     widget=NUMERO.format(campo='goles_local')),
+        CAMPO.format(campo='goles_visitante',
+                     label=_texto(datos['visitante']),
+                     widget=NUMERO.format(campo='goles_visitante')),
+    ])
+
+
+def campos(form):
+    """Renderiza los campos de un ``ApuestaForm`` sin errores.
+
+    :returns: HTML seguro
+    """
+    partido = form.partido
+    plantilla = _plantilla(partido.local.code, partido.visitante.code,
+                           translation.get_language())
+    ganador = form['ganador'].value()
+    goles_local = form['goles_local'].value()
+    goles_visitante = form['goles_visitante'].value()
+    return mark_safe(plantilla.format(
+        prefijo=escape(form.prefix),
+        goles_local=escape('' if goles_local is None else goles_local),
+        goles_visitante=escape('' if goles_visitante is None
+                               else goles_visitante),
+        **{
+            f'marca_{valor}': ' selected' if valor == ganador else ''
+            for valor in (constants.EMPATE, constants.GANA_LOCAL,
+                          constants.GANA_VISITANTE)
+        }
+    ))
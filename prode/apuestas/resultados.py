@@ -0,0 +1,213 @@
+"""Carga de resultados y recalculo de puntajes por diferencia.
+
+``guardar`` escribe los resultados de todos los partidos con un solo
+``UPDATE`` y registra en ``CambioResultado`` los partidos que realmente
+cambiaron, con el resultado anterior y el nuevo.
+
+* Si se corrige un resultado (el partido ya tenia resultado y lo sigue
+  teniendo) solo se leen las apuestas de ese partido, por el indice de
+  ``Apuesta.partido``, y a los puntajes de cada apostador se les suma la
+  diferencia entre los puntos con el resultado nuevo y con el anterior. Se
+  hace en la misma transaccion que guarda el resultado y con los apostadores
+  bloqueados (ver ``utils.bloquear_usuarios``), asi los puntajes guardados
+  siempre corresponden a los resultados guardados y un recalculo simultaneo
+  no suma la diferencia dos veces.
+* Si es el primer resultado del partido (o se borra) cambian los puntos
+  maximos de todos los usuarios, por lo que el cambio queda pendiente y
+  ``aplicar`` (en ``tasks.puntuar_partidos``) recalcula los puntajes como
+  antes con ``utils.actualizar_puntajes``. Las correcciones de un partido con
+  un cambio pendiente tambien quedan pendientes.
+
+Los cambios aplicados se marcan como tales, asi aplicar de nuevo no recalcula
+lo que ya se recalculo.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import (
+    Case,
+    F,
+    PositiveSmallIntegerField,
+    Value,
+    When,
+)
+
+from . import (
+    leaderboard,
+    models,
+    puntuacion,
+    utils,
+)
+
+CAMPOS = ('goles_local', 'goles_visitante')
+
+
+def _por_partido(partidos, campo):
+    return Case(*[When(pk=partido.pk, then=Value(getattr(partido, campo)))
+                  for partido in partidos],
+                output_field=PositiveSmallIntegerField())
+
+
+@transaction.atomic
+def guardar(partidos):
+    """Guarda los resultados de los partidos, registra los que cambiaron y
+    aplica las correcciones a los puntajes guardados.
+
+    No dispara ``post_save``: los cambios que no son correcciones se aplican
+    luego con ``aplicar``.
+
+    :param partidos: Instancias de ``Partido`` con los resultados nuevos
+    :returns: Lista de ``CambioResultado`` guardados
+    """
+    partidos = list(partidos)
+    # dos cargas simultaneas del mismo partido se esperan
+    anteriores = {
+        pk: resultado
+        for pk, *resultado in (models.Partido.objects
+                               .select_for_update()
+                               .filter(pk__in=[partido.pk
+                                               for partido in partidos])
+                               .order_by('pk')
+                               .values_list('pk', *CAMPOS))
+    }
+    cambios = [
+        models.CambioResultado(
+            partido=partido,
+            goles_local_anterior=anteriores[partido.pk][0],
+            goles_visitante_anterior=anteriores[partido.pk][1],
+            goles_local=partido.goles_local,
+            goles_visitante=partido.goles_visitante,
+        )
+        for partido in partidos
+        if anteriores[partido.pk] != [partido.goles_local,
+                                      partido.goles_visitante]
+    ]
+    if not cambios:
+        return []
+    pendientes = set(models.CambioResultado.objects
+                     .filter(partido__in=[cambio.partido
+                                          for cambio in cambios],
+                             aplicado=False)
+                     .values_list('partido', flat=True))
+    correcciones = [cambio for cambio in cambios
+                    if cambio.correccion and
+                    cambio.partido.pk not in pendientes]
+    if correcciones:
+        utils.bloquear_usuarios(
+            models.Apuesta.objects
+            .filter(partido__in=[cambio.partido for cambio in correcciones])
+            .values('usuario'))
+    cambiados = [cambio.partido for cambio in cambios]
+    (models.Partido.objects
+     .filter(pk__in=[partido.pk for partido in cambiados])
+     .update(**{campo: _por_partido(cambiados, campo) for campo in CAMPOS}))
+    if correcciones:
+        sumar_diferencias(diferencias(correcciones))
+        for cambio in correcciones:
+            cambio.aplicado = True
+    return models.CambioResultado.objects.bulk_create(cambios)
+
+
+def diferencias(cambios):
+    """Calcula cuantos puntos gana o pierde cada apostador con las
+    correcciones de resultados.
+
+    :param cambios: ``CambioResultado`` que son correcciones
+    :returns: Diccionario {id de etapa o None para el total: {id de usuario:
+              diferencia}}, sin las diferencias nulas
+    """
+    por_partido = defaultdict(list)
+    for cambio in cambios:
+        por_partido[cambio.partido_id].append(cambio)
+    apuestas = defaultdict(list)
+    for partido, *apuesta in (models.Apuesta.objects
+                              .filter(partido__in=list(por_partido))
+                              .order_by()
+                              .values_list('partido', 'usuario', 'ganador',
+                                           *CAMPOS)):
+        apuestas[partido].append(apuesta)
+    etapas = models.Etapa.objects.in_bulk(
+        {cambio.partido.etapa_id for cambio in cambios} - {None})
+
+    diferencia = defaultdict(lambda: defaultdict(int))
+    for partido, cambios_partido in por_partido.items():
+        if not apuestas[partido]:
+            continue
+        usuarios, ganadores, goles_local, goles_visitante = zip(
+            *apuestas[partido])
+        etapa = etapas.get(cambios_partido[0].partido.etapa_id)
+        cantidad = len(usuarios)
+        puntos_etapa = {campo: [getattr(etapa, campo, None)] * cantidad
+                        for campo in puntuacion.REGLA.campos_etapa}
+
+        def puntos(local, visitante):
+            return puntuacion.calcular_puntos(
+                ganadores, goles_local, goles_visitante,
+                [local] * cantidad, [visitante] * cantidad, **puntos_etapa)
+
+        for cambio in cambios_partido:
+            delta = (puntos(cambio.goles_local, cambio.goles_visitante) -
+                     puntos(cambio.goles_local_anterior,
+                            cambio.goles_visitante_anterior))
+            for usuario, puntos_usuario in zip(usuarios, delta.tolist()):
+                diferencia[None][usuario] += puntos_usuario
+                if etapa is not None:
+                    diferencia[etapa.pk][usuario] += puntos_usuario
+    return {
+        etapa: {usuario: puntos
+                for usuario, puntos in por_usuario.items() if puntos}
+        for etapa, por_usuario in diferencia.items()
+    }
+
+
+def sumar_diferencias(diferencia):
+    """Suma las diferencias a los puntajes guardados, con un ``UPDATE`` por
+    etapa y diferencia distinta, y al leaderboard si esta configurado.
+
+    El leaderboard se actualiza al confirmar la transaccion con los puntajes
+    que quedaron guardados.
+
+    La diferencia tambien se suma al maximo, que incluye los puntos de los
+    partidos terminados.
+
+    :param diferencia: Devuelto por ``diferencias``
+    """
+    for etapa, por_usuario in diferencia.items():
+        usuarios = defaultdict(list)
+        for usuario, puntos in por_usuario.items():
+            usuarios[puntos].append(usuario)
+        for puntos, ids in usuarios.items():
+            (models.Puntaje.objects
+             .filter(etapa=etapa, usuario__in=ids)
+             .update(puntos=F('puntos') + puntos,
+                     maximo=F('maximo') + puntos))
+    tablero = leaderboard.get_leaderboard()
+    if tablero is not None:
+        def actualizar_tablero():
+            for etapa, por_usuario in diferencia.items():
+                tablero.guardar(models.Puntaje.objects
+                                .filter(etapa=etapa,
+                                        usuario__in=list(por_usuario))
+                                .values_list('usuario__username', 'etapa',
+                                             'puntos'))
+        transaction.on_commit(actualizar_tablero)
+
+
+@transaction.atomic
+def aplicar(partidos):
+    """Recalcula los puntajes de los partidos con cambios de resultado
+    pendientes.
+
+    :returns: Lista de ``CambioResultado`` aplicados
+    """
+    cambios = list(models.CambioResultado.objects
+                   .filter(partido__in=partidos, aplicado=False)
+                   .select_related('partido'))
+    if not cambios:
+        return []
+    # el recalculo lee los resultados actuales, incluye todos los cambios
+    utils.actualizar_puntajes({cambio.partido for cambio in cambios})
+    (models.CambioResultado.objects
+     .filter(pk__in=[cambio.pk for cambio in cambios])
+     .update(aplicado=True))
+    return cambios
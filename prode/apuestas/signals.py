@@ -0,0 +1,175 @@
+import threading
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+
+from . import (
+    cache,
+    estadisticas,
+    leaderboard,
+    models,
+    utils,
+)
+
+
+@receiver(post_save, sender=models.Partido)
+def actualizar_puntajes_partido(sender, instance, created, raw=False,
+                                **kwargs):
+    """Recalcula los puntajes de quienes apostaron en el partido guardado.
+
+    Un partido recien creado no tiene apuestas, por lo que no hay nada que
+    recalcular.
+    """
+    if raw or created:
+        return
+    utils.actualizar_puntajes([instance])
+    cache.invalidar()
+    cache.invalidar_partidos([instance])
+
+
+@receiver(post_save, sender=models.Apuesta)
+def actualizar_puntajes_apuesta(sender, instance, created, raw=False,
+                                **kwargs):
+    """Recalcula el puntaje del usuario que hizo la apuesta.
+
+    Solo es necesario si la apuesta es nueva (el usuario tiene que aparecer
+    en el ranking) o si el partido ya tiene resultado.
+    """
+    if raw:
+        return
+    partido = instance.partido
+    if created or partido.terminado():
+        utils.recalcular_puntajes(usuarios=[instance.usuario_id],
+                                  etapas=[partido.etapa_id])
+    if partido.terminado():
+        cache.invalidar()
+
+
+class _Recalculo:
+    """Recalculo de los puntajes afectados por los borrados de una
+    transaccion, que se hace una sola vez al confirmarla."""
+    def __init__(self):
+        # usuarios que tenian apuestas borradas
+        self.usuarios = set()
+        # etapas con partidos sin resultado borrados
+        self.etapas = set()
+
+    def __call__(self):
+        if self.usuarios:
+            utils.recalcular_puntajes(usuarios=sorted(self.usuarios))
+        if self.etapas:
+            utils.actualizar_maximos(list(self.etapas))
+        cache.invalidar()
+
+
+_pendiente = threading.local()
+
+
+def _get_recalculo():
+    """Obtiene el recalculo pendiente de la transaccion actual, o crea uno que
+    se ejecuta al confirmarla."""
+    pendientes = transaction.get_connection().run_on_commit
+    recalculo = getattr(_pendiente, 'recalculo', None)
+    if not any(callback is recalculo for _, callback in pendientes):
+        # no hay o ya se ejecuto o se deshizo su transaccion
+        recalculo = _pendiente.recalculo = _Recalculo()
+        transaction.on_commit(recalculo)
+    return recalculo
+
+
+@receiver(pre_delete, sender=models.Apuesta)
+def actualizar_puntajes_apuesta_borrada(sender, instance, **kwargs):
+    """Recalcula los puntajes del usuario que hizo la apuesta borrada al
+    confirmar la transaccion.
+
+    Si no le quedan apuestas el usuario sale del ranking. Si se borran varias
+    apuestas juntas se hace un solo recalculo con todos sus usuarios.
+    """
+    _get_recalculo().usuarios.add(instance.usuario_id)
+
+
+@receiver(pre_delete, sender=models.Partido)
+def actualizar_puntajes_partido_borrado(sender, instance, **kwargs):
+    """Actualiza los maximos al confirmar la transaccion si se borra un
+    partido sin resultado, ya que todos los usuarios podian sumar puntos en
+    el.
+
+    Los puntajes de quienes apostaron en el partido se recalculan al borrarse
+    sus apuestas.
+    """
+    recalculo = _get_recalculo()
+    if not instance.terminado():
+        recalculo.etapas.add(instance.etapa_id)
+
+
+@receiver(post_delete, sender=get_user_model())
+def quitar_usuario_leaderboard(sender, instance, **kwargs):
+    """Quita al usuario borrado de los rankings del leaderboard."""
+    tablero = leaderboard.get_leaderboard()
+    if tablero is not None:
+        transaction.on_commit(
+            lambda: tablero.quitar_usuario(instance.username))
+
+
+@receiver(post_delete, sender=models.Etapa)
+def borrar_etapa_leaderboard(sender, instance, **kwargs):
+    """Borra el ranking de la etapa borrada del leaderboard."""
+    tablero = leaderboard.get_leaderboard()
+    if tablero is not None:
+        etapa_id = instance.pk
+        transaction.on_commit(lambda: tablero.borrar_etapa(etapa_id))
+
+
+@receiver(post_save, sender=models.Etapa)
+def actualizar_puntajes_etapa(sender, instance, created, raw=False, **kwargs):
+    """Recalcula los puntajes de la etapa, ya que pueden haber cambiado los
+    puntos que otorga cada acierto.
+    """
+    if raw or created:
+        return
+    partidos = list(instance.partidos.filter(goles_local__isnull=False,
+                                             goles_visitante__isnull=False))
+    if partidos:
+        utils.actualizar_puntajes(partidos)
+        cache.invalidar()
+
+
+@receiver(post_save, sender=models.Partido)
+def actualizar_estadisticas_partido(sender, instance, created, raw=False,
+                                    **kwargs):
+    """Recalcula las estadisticas del partido, ya que pueden haber cambiado
+    los puntos obtenidos."""
+    if raw or created:
+        return
+    estadisticas.actualizar_vencidos([instance])
+
+
+@receiver(post_save, sender=models.Apuesta)
+def actualizar_estadisticas_apuesta(sender, instance, created, raw=False,
+                                    **kwargs):
+    """Recalcula las estadisticas si se modifica una apuesta de una etapa
+    vencida."""
+    if raw:
+        return
+    estadisticas.actualizar_vencidos([instance.partido])
+
+
+@receiver(post_save, sender=models.Etapa)
+def actualizar_estadisticas_etapa(sender, instance, created, raw=False,
+                                  **kwargs):
+    """Recalcula las estadisticas de la etapa vencida, pueden haber cambiado
+    los puntos que otorga cada acierto. Si la etapa se vuelve a abrir se
+    borran, ya que pueden cambiar las apuestas.
+    """
+    if raw or created:
+        return
+    if instance.vencida:
+        estadisticas.actualizar(instance.partidos.all())
+    else:
+        estadisticas.borrar(instance.partidos.all())
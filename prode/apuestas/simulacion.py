@@ -0,0 +1,326 @@
+"""Simulacion de Monte Carlo de los partidos que faltan jugar.
+
+Responde a la pregunta "¿todavia puedo ganar?": a partir de los puntajes
+actuales y de las apuestas de cada usuario en los partidos sin resultado, se
+sortean muchas veces los resultados de esos partidos y se cuenta en cuantas
+simulaciones cada usuario termina primero o entre los primeros ``puestos``.
+
+Para cada partido se simulan los resultados exactos que aposto algun usuario
+mas un resultado "otro" por cada ganador posible (uno que nadie aposto). Los
+resultados se sortean con la misma probabilidad para cada ganador
+(``UNIFORME``) o con la distribucion de las apuestas de los usuarios
+(``APUESTAS``).
+
+El calculo esta vectorizado sobre usuarios y simulaciones: para cada partido
+se arma una matriz con los puntos que suma cada usuario con cada resultado
+posible y los puntos finales de un bloque de simulaciones se obtienen
+sumando las filas de los resultados sorteados. No se simulan los usuarios que
+no pueden alcanzar a los primeros aunque acierten todo.
+"""
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+
+from . import (
+    models,
+    puntuacion,
+)
+
+UNIFORME = 'uniforme'
+APUESTAS = 'apuestas'
+METODOS = (UNIFORME, APUESTAS)
+
+# Resultados que nadie aposto, uno por ganador (los goles apostados nunca son
+# negativos)
+OTROS = {
+    1: (-1, -2),
+    0: (-1, -1),
+    -1: (-2, -1),
+}
+
+# Cantidad maxima de puntos (usuarios x simulaciones) que se calculan juntos
+TAMANIO_BLOQUE = 2 ** 24
+
+
+class ApuestasPartido:
+    """Apuestas de los usuarios en un partido sin resultado.
+
+    :param usuarios: Indice de cada usuario apostador en el array de puntajes
+    :param ganador: Ganador apostado por cada usuario
+    :param goles_local: Goles apostados al local por cada usuario
+    :param goles_visitante: Goles apostados al visitante por cada usuario
+    :param puntos: Puntos redefinidos por la etapa del partido, con el nombre
+                   del campo de ``Etapa`` como clave
+    """
+
+    def __init__(self, usuarios, ganador, goles_local, goles_visitante,
+                 **puntos):
+        self.usuarios = np.asarray(usuarios, dtype=int)
+        self.ganador = list(ganador)
+        self.goles_local = np.asarray(goles_local, dtype=int)
+        self.goles_visitante = np.asarray(goles_visitante, dtype=int)
+        self.puntos = puntos
+
+    def __len__(self):
+        return len(self.usuarios)
+
+    def resultados(self):
+        """Obtiene los resultados posibles del partido.
+
+        :returns: Tupla (goles local, goles visitante) de arrays
+        """
+        apostados = set(zip(self.goles_local.tolist(),
+                            self.goles_visitante.tolist()))
+        resultados = sorted(apostados) + list(OTROS.values())
+        goles_local, goles_visitante = zip(*resultados)
+        return np.array(goles_local), np.array(goles_visitante)
+
+    def probabilidades(self, goles_local, goles_visitante, metodo=UNIFORME):
+        """Obtiene la probabilidad de cada resultado posible.
+
+        Primero se reparte la probabilidad entre los tres ganadores posibles
+        y luego entre los resultados de cada ganador. Con ``UNIFORME`` ambos
+        repartos son en partes iguales; con ``APUESTAS`` son proporcionales a
+        la cantidad de apuestas (mas una, para no descartar ningun
+        resultado).
+        """
+        signos = np.sign(goles_local - goles_visitante)
+        if metodo == UNIFORME:
+            pesos = np.ones(len(signos))
+            pesos_ganador = {signo: 1 for signo in OTROS}
+        elif metodo == APUESTAS:
+            cantidades = {}
+            for resultado in zip(self.goles_local.tolist(),
+                                 self.goles_visitante.tolist()):
+                cantidades[resultado] = cantidades.get(resultado, 0) + 1
+            pesos = np.array([
+                cantidades.get(resultado, 1)
+                for resultado in zip(goles_local.tolist(),
+                                     goles_visitante.tolist())
+            ], dtype=float)
+            signos_apostados = [puntuacion.SIGNO_GANADOR[ganador]
+                                for ganador in self.ganador]
+            pesos_ganador = {signo: signos_apostados.count(signo) + 1
+                             for signo in OTROS}
+        else:
+            raise ValueError(f'Metodo de simulacion desconocido: {metodo}')
+        total_ganadores = sum(pesos_ganador.values())
+        probabilidades = np.zeros(len(signos))
+        for signo, peso in pesos_ganador.items():
+            mismo_ganador = signos == signo
+            probabilidades[mismo_ganador] = (
+                peso / total_ganadores *
+                pesos[mismo_ganador] / pesos[mismo_ganador].sum()
+            )
+        return probabilidades
+
+    def puntos_posibles(self, goles_local, goles_visitante):
+        """Calcula los puntos de cada apuesta con cada resultado posible.
+
+        Los puntos se calculan una sola vez por cada apuesta distinta, que
+        son muchas menos que los usuarios.
+
+        :returns: ``numpy.ndarray`` de (apuestas x resultados)
+        """
+        ganadores = sorted(puntuacion.SIGNO_GANADOR)
+        codigos = np.array([ganadores.index(ganador)
+                            for ganador in self.ganador], dtype=int)
+        # cada apuesta distinta se codifica como un entero
+        base = np.concatenate([[0], self.goles_local,
+                               self.goles_visitante]).max() + 1
+        distintas, indices = np.unique(
+            (codigos * base + self.goles_local) * base + self.goles_visitante,
+            return_inverse=True,
+        )
+        resto, goles_visitante_apostados = np.divmod(distintas, base)
+        codigos_apostados, goles_local_apostados = np.divmod(resto, base)
+        cantidad = len(goles_local)
+        puntos = {
+            campo: [valor] * len(distintas) * cantidad
+            for campo, valor in self.puntos.items()
+        }
+        puntos_apuestas = puntuacion.calcular_puntos(
+            [ganadores[codigo]
+             for codigo in np.repeat(codigos_apostados, cantidad)],
+            np.repeat(goles_local_apostados, cantidad),
+            np.repeat(goles_visitante_apostados, cantidad),
+            np.tile(goles_local, len(distintas)),
+            np.tile(goles_visitante, len(distintas)),
+            **puntos
+        ).reshape(len(distintas), cantidad)
+        return puntos_apuestas[indices]
+
+
+def simular(puntos, partidos, cantidad=10000, puestos=3, metodo=UNIFORME,
+            semilla=None):
+    """Simula los partidos pendientes.
+
+    :param puntos: Puntos actuales de cada usuario
+    :param partidos: Lista de ``ApuestasPartido`` de los partidos pendientes
+    :param cantidad: Cantidad de simulaciones
+    :param puestos: Cantidad de primeros puestos para ``entre_primeros``
+    :param metodo: ``UNIFORME`` o ``APUESTAS``
+    :param semilla: Semilla del generador de numeros aleatorios
+
+    :returns: Tupla (primero, entre_primeros) de arrays con la probabilidad
+              de cada usuario de terminar primero (compartido o no) y entre
+              los primeros ``puestos``
+    """
+    puntos = np.asarray(puntos, dtype=int)
+    usuarios = len(puntos)
+    primero = np.zeros(usuarios)
+    entre_primeros = np.zeros(usuarios)
+    if usuarios == 0 or cantidad == 0:
+        return primero, entre_primeros
+    puestos = min(puestos, usuarios)
+    random = np.random.RandomState(semilla)
+
+    # puntos de cada usuario con cada resultado de cada partido, una fila
+    # por resultado
+    matrices = []
+    probabilidades = []
+    for partido in partidos:
+        goles_local, goles_visitante = partido.resultados()
+        matriz = np.zeros((len(goles_local), usuarios), dtype=int)
+        matriz[:, partido.usuarios] = partido.puntos_posibles(
+            goles_local, goles_visitante).T
+        matrices.append(matriz)
+        probabilidades.append(
+            partido.probabilidades(goles_local, goles_visitante, metodo))
+
+    # Quien no alcanza los puntos actuales del usuario en el puesto
+    # ``puestos`` ni ganando todo no puede terminar entre los primeros, no
+    # hace falta simularlo
+    alcanzable = puntos + sum(matriz.max(axis=0) for matriz in matrices)
+    minimo = np.partition(puntos, usuarios - puestos)[usuarios - puestos]
+    candidatos = np.flatnonzero(alcanzable >= minimo)
+    # los puntos se desplazan para empezar en 0 y usar enteros chicos
+    desplazamiento = puntos[candidatos].min()
+    rango = alcanzable[candidatos].max() - desplazamiento + 1
+    tipo = next(tipo for tipo in (np.int8, np.int16, np.int32, np.int64)
+                if rango <= np.iinfo(tipo).max)
+    base = (puntos[candidatos] - desplazamiento).astype(tipo)
+    matrices, probabilidades = _agrupar(
+        [matriz[:, candidatos].astype(tipo) for matriz in matrices],
+        probabilidades,
+        max(1, TAMANIO_BLOQUE // len(candidatos)),
+    )
+
+    bloque = max(1, min(cantidad, TAMANIO_BLOQUE // len(candidatos)))
+    primero_candidatos = np.zeros(len(candidatos), dtype=int)
+    entre_primeros_candidatos = np.zeros(len(candidatos), dtype=int)
+    for desde in range(0, cantidad, bloque):
+        simulaciones = min(bloque, cantidad - desde)
+        # puntos finales de (simulaciones x candidatos)
+        totales = np.tile(base, (simulaciones, 1))
+        for matriz, probabilidad in zip(matrices, probabilidades):
+            elegidos = random.choice(len(probabilidad), size=simulaciones,
+                                     p=probabilidad)
+            totales += matriz[elegidos]
+        maximos = totales.max(axis=1)
+        es_maximo = totales == maximos[:, np.newaxis]
+        primero_candidatos += es_maximo.sum(axis=0, dtype=np.int32)
+        # quedan entre los primeros quienes tienen al menos los puntos del
+        # usuario en el puesto ``puestos``, que suele ser el maximo
+        umbrales = maximos
+        faltan = es_maximo.sum(axis=1) < puestos
+        while faltan.any():
+            # bajo el umbral al siguiente puntaje de cada simulacion
+            totales_faltan = totales[faltan]
+            umbrales[faltan] = np.where(
+                totales_faltan < umbrales[faltan, np.newaxis],
+                totales_faltan, -1
+            ).max(axis=1)
+            faltan[faltan] = (
+                (totales_faltan >= umbrales[faltan, np.newaxis])
+                .sum(axis=1) < puestos
+            )
+        entre_primeros_candidatos += (
+            totales >= umbrales[:, np.newaxis]).sum(axis=0, dtype=np.int32)
+    primero[candidatos] = primero_candidatos / cantidad
+    entre_primeros[candidatos] = entre_primeros_candidatos / cantidad
+    return primero, entre_primeros
+
+
+def _agrupar(matrices, probabilidades, filas):
+    """Agrupa partidos para sortearlos juntos.
+
+    Los resultados de partidos distintos son independientes, de modo que un
+    grupo de partidos se puede sortear como un unico partido cuyos resultados
+    son todas las combinaciones. Asi se suman menos filas por simulacion.
+
+    :param filas: Cantidad maxima de combinaciones de cada grupo
+    :returns: Tupla (matrices, probabilidades) de los grupos
+    """
+    agrupadas = []
+    agrupadas_probabilidades = []
+    for matriz, probabilidad in zip(matrices, probabilidades):
+        if (agrupadas and
+                len(agrupadas[-1]) * len(matriz) <= filas):
+            anterior = agrupadas.pop()
+            matriz = (anterior[:, np.newaxis] + matriz).reshape(
+                -1, matriz.shape[1])
+            probabilidad = np.outer(agrupadas_probabilidades.pop(),
+                                    probabilidad).ravel()
+        agrupadas.append(matriz)
+        agrupadas_probabilidades.append(probabilidad)
+    return agrupadas, agrupadas_probabilidades
+
+
+def simular_ranking(cantidad=None, puestos=None, metodo=None, semilla=None):
+    """Simula los partidos pendientes con los datos de la base de datos y
+    guarda las probabilidades de cada usuario en ``Probabilidad``.
+
+    Los parametros por defecto se toman de ``settings.SIMULACION``.
+
+    :returns: Cantidad de usuarios simulados
+    """
+    configuracion = getattr(settings, 'SIMULACION', {})
+    cantidad = cantidad or configuracion.get('CANTIDAD', 10000)
+    puestos = puestos or configuracion.get('PUESTOS', 3)
+    metodo = metodo or configuracion.get('METODO', UNIFORME)
+
+    totales = dict(models.Puntaje.objects
+                   .filter(etapa__isnull=True)
+                   .values_list('usuario_id', 'puntos'))
+    campos_etapa = puntuacion.REGLA.campos_etapa
+    apuestas = (models.Apuesta.objects
+                .filter(partido__goles_local__isnull=True)
+                .order_by('partido_id')
+                .values_list('partido_id', 'usuario_id', 'ganador',
+                             'goles_local', 'goles_visitante',
+                             *(f'partido__etapa__{campo}'
+                               for campo in campos_etapa)))
+    por_partido = {}
+    for partido, usuario, *apuesta in apuestas:
+        totales.setdefault(usuario, 0)
+        por_partido.setdefault(partido, []).append((usuario, *apuesta))
+
+    ids = sorted(totales)
+    indices = {usuario: indice for indice, usuario in enumerate(ids)}
+    partidos = []
+    for filas in por_partido.values():
+        usuarios, ganador, goles_local, goles_visitante, *puntos = zip(*filas)
+        partidos.append(ApuestasPartido(
+            [indices[usuario] for usuario in usuarios],
+            ganador, goles_local, goles_visitante,
+            **{campo: valores[0]
+               for campo, valores in zip(campos_etapa, puntos)}
+        ))
+    primero, entre_primeros = simular([totales[usuario] for usuario in ids],
+                                      partidos, cantidad=cantidad,
+                                      puestos=puestos, metodo=metodo,
+                                      semilla=semilla)
+    probabilidades = [
+        models.Probabilidad(usuario_id=usuario,
+                            primero=primero[indice],
+                            entre_primeros=entre_primeros[indice],
+                            puestos=puestos,
+                            simulaciones=cantidad)
+        for indice, usuario in enumerate(ids)
+    ]
+    with transaction.atomic():
+        models.Probabilidad.objects.all().delete()
+        models.Probabilidad.objects.bulk_create(probabilidades,
+                                                batch_size=1000)
+    return len(probabilidades)
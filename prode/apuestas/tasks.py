@@ -0,0 +1,208 @@
+"""Tareas de celery.
+
+Luego de cargar resultados se encola ``procesar_resultados``, una cadena de
+tareas que actualiza todo lo que depende de los resultados antes de que lo
+pida un usuario. Cada paso recibe los ids de los partidos con resultados
+nuevos, se puede repetir sin cambiar el resultado y registra cuanto tardo.
+"""
+import functools
+import logging
+import time
+from datetime import timedelta
+
+from celery import (
+    chain,
+    shared_task,
+)
+from django.core.cache import cache as django_cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import (
+    cache,
+    cola,
+    estadisticas,
+    fragmentos,
+    leaderboard,
+    models,
+    puestos,
+    resultados,
+    simulacion,
+    utils,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def cronometrar(tarea):
+    """Decorador que registra cuanto tarda la tarea.
+
+    :returns: Segundos que tardo la tarea
+    """
+    @functools.wraps(tarea)
+    def tarea_cronometrada(*args, **kwargs):
+        inicio = time.perf_counter()
+        tarea(*args, **kwargs)
+        segundos = time.perf_counter() - inicio
+        logger.info('%s tardo %.3f segundos', tarea.__name__, segundos)
+        return segundos
+    return tarea_cronometrada
+
+
+def _partidos(partidos):
+    return list(models.Partido.objects
+                .filter(pk__in=partidos)
+                .select_related('etapa'))
+
+
+@shared_task(bind=True, max_retries=5, default_retry_delay=10)
+def drenar_apuestas(self):
+    """Guarda en bloque las apuestas encoladas cerca del vencimiento de las
+    etapas.
+
+    Si falla las apuestas vuelven a la cola y se reintenta; ademas celery beat
+    la ejecuta cada minuto (ver ``CELERYBEAT_SCHEDULE``).
+    """
+    try:
+        return cola.drenar()
+    except Exception as error:
+        raise self.retry(exc=error)
+
+
+@shared_task
+def reconstruir_leaderboard():
+    """Vuelve a cargar el leaderboard si no esta completo, por ejemplo luego
+    de reiniciar el redis. Celery beat la ejecuta periodicamente."""
+    tablero = leaderboard.get_leaderboard()
+    if tablero is not None and not tablero.completo():
+        tablero.reconstruir()
+
+
+CIERRE_KEY = 'prode:maximos:cierre'
+
+
+@shared_task
+def actualizar_maximos():
+    """Actualiza los maximos de las etapas con partidos que cerraron desde la
+    ultima ejecucion, sin resultado todavia.
+
+    Cerrar un partido no dispara ninguna senal, por eso celery beat la
+    ejecuta periodicamente (ver ``CELERYBEAT_SCHEDULE``).
+    """
+    ahora = timezone.now()
+    desde = django_cache.get(CIERRE_KEY) or ahora - timedelta(days=1)
+    etapas = set(models.Partido.objects
+                 .cerrados(desde, ahora)
+                 .values_list('etapa', flat=True))
+    if etapas:
+        utils.actualizar_maximos(etapas)
+        cache.invalidar()
+    django_cache.set(CIERRE_KEY, ahora, timeout=None)
+
+
+@shared_task
+@cronometrar
+def puntuar_partidos(partidos):
+    """Actualiza los puntajes con los cambios de resultado de los partidos
+    (ver ``resultados.aplicar``) e invalida el cache de resultados."""
+    partidos = _partidos(partidos)
+    resultados.aplicar(partidos)
+    cache.invalidar()
+    cache.invalidar_partidos(partidos)
+
+
+@shared_task
+@cronometrar
+def actualizar_puestos(partidos):
+    """Recalcula los puestos del ranking total y de las etapas de los
+    partidos, guardando cuantos puestos cambio cada usuario."""
+    etapas = {partido.etapa_id for partido in _partidos(partidos)}
+    puestos.actualizar([None] + sorted(etapa for etapa in etapas
+                                       if etapa is not None))
+
+
+@shared_task
+@cronometrar
+def actualizar_estadisticas(partidos):
+    """Recalcula las estadisticas de los partidos de etapas vencidas."""
+    estadisticas.actualizar_vencidos(_partidos(partidos))
+
+
+@shared_task
+@cronometrar
+def calentar_cache(partidos):
+    """Calcula de antemano la primera pagina del ranking y los fragmentos
+    del detalle de las etapas vencidas de los partidos."""
+    ranking = utils.RankingPaginado()
+    len(ranking)
+    ranking[0:ranking.por_pagina]
+    etapas = {partido.etapa for partido in _partidos(partidos)
+              if partido.etapa is not None}
+    for etapa in etapas:
+        if etapa.vencida:
+            fragmentos.calentar(etapa)
+
+
+@shared_task
+@cronometrar
+def simular_ranking(partidos):
+    """Estima la probabilidad de ganar de cada usuario simulando los partidos
+    pendientes, con los puntajes ya actualizados."""
+    simulacion.simular_ranking()
+
+
+PASOS = (puntuar_partidos, actualizar_puestos, actualizar_estadisticas,
+         calentar_cache, simular_ranking)
+
+
+def procesar_resultados(partidos):
+    """Encola los pasos a seguir luego de cargar los resultados de los
+    partidos, uno detras de otro.
+
+    :param partidos: Ids de los partidos con resultados nuevos, guardados
+                     con ``resultados.guardar``
+    """
+    partidos = sorted(partidos)
+    return chain(*[paso.si(partidos) for paso in PASOS]).apply_async()
+
+
+def procesar_al_confirmar(partidos, si_falla=None):
+    """Encola ``procesar_resultados`` al confirmar la transaccion, cuando las
+    tareas ya pueden leer los resultados nuevos.
+
+    Los resultados ya estan guardados, por eso si no se puede encolar (por
+    ejemplo se cayo el broker) solo se registra el error: los cambios quedan
+    sin aplicar y los procesa ``procesar_pendientes``.
+
+    :param partidos: Ids de los partidos con resultados nuevos
+    :param si_falla: Funcion sin parametros que se llama si no se pudo
+                     encolar, por ejemplo para avisarle al usuario
+    """
+    def encolar():
+        try:
+            procesar_resultados(partidos)
+        except Exception:
+            logger.exception('No se pudo encolar el procesamiento de los '
+                             'partidos %s', partidos)
+            if si_falla is not None:
+                si_falla()
+    transaction.on_commit(encolar)
+
+
+# antiguedad de los cambios que procesa procesar_pendientes, para no repetir
+# los que todavia se estan procesando
+PENDIENTES_DEMORA = timedelta(minutes=5)
+
+
+@shared_task
+def procesar_pendientes():
+    """Procesa los partidos con cambios de resultado sin aplicar, por ejemplo
+    si no se pudo encolar ``procesar_resultados`` o fallo un paso. Celery beat
+    la ejecuta periodicamente (ver ``CELERYBEAT_SCHEDULE``).
+    """
+    partidos = set(models.CambioResultado.objects
+                   .filter(aplicado=False,
+                           fecha__lte=timezone.now() - PENDIENTES_DEMORA)
+                   .values_list('partido', flat=True))
+    if partidos:
+        procesar_resultados(partidos)
@@ -1,6 +1,9 @@
 from django import template
 
-from prode.apuestas import models
+from prode.apuestas import (
+    models,
+    renderizado,
+)
 
 register = template.Library()
 
@@ -19,3 +22,28 @@ def get_etapas(current_user):
     if not current_user.has_perm('apuestas.change_etapa'):
         return queryset.filter(publica=True)
     return queryset
+
+
+@register.filter
+def obtener(diccionario, clave):
+    """Obtiene el valor de ``clave`` en el diccionario o None."""
+    return diccionario.get(clave)
+
+
+@register.filter
+def absoluto(numero):
+    """Obtiene el valor absoluto del numero."""
+    return abs(numero)
+
+
+@register.simple_tag
+def titulo_partido(partido):
+    """Muestra los equipos del partido con sus banderas."""
+    return renderizado.titulo(partido)
+
+
+@register.simple_tag
+def campos_apuesta(form):
+    """Renderiza los campos de un ``ApuestaForm`` sin errores, mas rapido
+    que ``{{ form|crispy }}`` (ver ``prode.apuestas.renderizado``)."""
+    return renderizado.campos(form)
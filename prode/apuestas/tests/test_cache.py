@@ -0,0 +1,106 @@
+from django.core.cache import cache as django_cache
+
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    cache,
+    constants,
+    models,
+)
+
+from . import factories
+
+
+class Contador:
+    """Funcion que cuenta cuantas veces fue llamada."""
+
+    def __init__(self):
+        self.llamadas = 0
+
+    def __call__(self):
+        self.llamadas += 1
+        return self.llamadas
+
+
+class CacheTests(TestCase):
+    def test_obtener(self):
+        calcular = Contador()
+        self.assertEqual(cache.obtener('foo', calcular), 1)
+        self.assertEqual(cache.obtener('foo', calcular), 1)
+        self.assertEqual(calcular.llamadas, 1)
+
+    def test_invalidar(self):
+        calcular = Contador()
+        cache.obtener('foo', calcular)
+        cache.invalidar()
+        self.assertEqual(cache.obtener('foo', calcular), 2)
+
+    def test_invalidar__sin_version(self):
+        calcular = Contador()
+        cache.obtener('foo', calcular)
+        django_cache.delete(cache.VERSION_KEY)
+        cache.invalidar()
+        self.assertEqual(cache.obtener('foo', calcular), 2)
+
+    def test_cargar_resultado_invalida(self):
+        partido = factories.PartidoFactory(goles_local=None,
+                                           goles_visitante=None)
+        factories.ApuestaFactory(partido=partido,
+                                 ganador=constants.EMPATE)
+        calcular = Contador()
+        cache.obtener('foo', calcular)
+        partido.goles_local = partido.goles_visitante = 1
+        partido.save()
+        self.assertEqual(cache.obtener('foo', calcular), 2)
+
+    def test_apuesta_partido_no_terminado_no_invalida(self):
+        calcular = Contador()
+        cache.obtener('foo', calcular)
+        factories.ApuestaFactory(partido__goles_local=None,
+                                 partido__goles_visitante=None)
+        self.assertEqual(cache.obtener('foo', calcular), 1)
+
+
+class VersionesPartidosTests(TestCase):
+    def setUp(self):
+        self.partidos = factories.PartidoFactory.create_batch(2)
+
+    def test_versiones_partidos(self):
+        version = cache.versiones_partidos(self.partidos)
+        self.assertEqual(version, cache.versiones_partidos(self.partidos))
+        self.assertEqual(version, '-'.join(str(partido.version)
+                                           for partido in self.partidos))
+
+    def test_invalidar_partidos(self):
+        cache.versiones_partidos(self.partidos)
+        primero, segundo = [partido.version for partido in self.partidos]
+        cache.invalidar_partidos(self.partidos[:1])
+        cache.versiones_partidos(self.partidos)
+        self.assertNotEqual(self.partidos[0].version, primero)
+        self.assertEqual(self.partidos[1].version, segundo)
+
+    def test_cargar_resultado_invalida(self):
+        partido = self.partidos[0]
+        cache.versiones_partidos([partido])
+        version = partido.version
+        partido.goles_local = partido.goles_visitante = 1
+        partido.save()
+        cache.versiones_partidos([partido])
+        self.assertNotEqual(partido.version, version)
+
+
+class RankingCacheTests(TestCase):
+    def test_ranking_cacheado(self):
+        user = self.make_user()
+        factories.ApuestaFactory(usuario=user,
+                                 partido__goles_local=1,
+                                 partido__goles_visitante=1,
+                                 goles_local=0,
+                                 goles_visitante=0,
+                                 ganador=constants.EMPATE)
+        with self.login(user):
+            self.get('apuestas:ranking')
+            # borro los puntajes sin invalidar, el ranking sale del cache
+            models.Puntaje.objects.all().delete()
+            self.get('apuestas:ranking')
+        self.assertEqual(self.context['ranking'], [(user.username, 1)])
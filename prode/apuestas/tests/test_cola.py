@@ -0,0 +1,242 @@
+import datetime
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    cola,
+    constants,
+    models,
+    tasks,
+)
+
+from . import factories
+
+COLA_APUESTAS = {'CACHE': 'default', 'MINUTOS': 15, 'LOTE': 1000}
+
+
+def apuesta(usuario, partido, goles_local=1, goles_visitante=0):
+    return models.Apuesta(usuario=usuario, partido=partido,
+                          ganador=constants.GANA_LOCAL,
+                          goles_local=goles_local,
+                          goles_visitante=goles_visitante)
+
+
+class ColaApuestasTests(TestCase):
+    def setUp(self):
+        self.cola = cola.ColaApuestas(cola.ColaEnMemoria())
+        self.user = self.make_user()
+        self.partidos = factories.PartidoFactory.create_batch(3)
+
+    def test_agregar_y_extraer(self):
+        recibida = timezone.now()
+        cantidad = self.cola.agregar(
+            [apuesta(self.user, partido) for partido in self.partidos],
+            recibida=recibida,
+        )
+        self.assertEqual(cantidad, 3)
+        pendientes = self.cola.extraer(2)
+        self.assertEqual([pendiente['partido_id'] for pendiente in pendientes],
+                         [partido.pk for partido in self.partidos[:2]])
+        self.assertEqual(pendientes[0]['usuario_id'], self.user.pk)
+        self.assertEqual(pendientes[0]['goles_local'], 1)
+        self.assertAlmostEqual(pendientes[0]['recibida'].timestamp(),
+                               recibida.timestamp(), places=3)
+        self.assertEqual(self.cola.cantidad(), 1)
+
+    def test_devolver(self):
+        self.cola.agregar(apuesta(self.user, partido)
+                          for partido in self.partidos)
+        pendientes = self.cola.extraer(2)
+        self.cola.devolver(pendientes)
+        self.assertEqual(
+            [pendiente['partido_id'] for pendiente in self.cola.extraer(10)],
+            [partido.pk for partido in self.partidos],
+        )
+
+
+class GuardarPendientesTests(TestCase):
+    def setUp(self):
+        self.cola = cola.ColaApuestas(cola.ColaEnMemoria())
+        self.user = self.make_user()
+        self.inicio = timezone.now() + datetime.timedelta(minutes=10)
+        self.etapa = factories.EtapaFactory(
+            vencimiento=self.inicio - datetime.timedelta(minutes=1))
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                fecha=self.inicio,
+                                                goles_local=None,
+                                                goles_visitante=None)
+
+    def guardar(self, recibida):
+        self.cola.agregar([apuesta(self.user, self.partido)],
+                          recibida=recibida)
+        return cola.guardar_pendientes(self.cola.extraer(10))
+
+    def test_recibida_a_tiempo_se_guarda_despues_del_vencimiento(self):
+        recibida = self.etapa.vencimiento - datetime.timedelta(seconds=1)
+        # la cola se vacia con el partido ya empezado
+        ahora = self.inicio + datetime.timedelta(minutes=5)
+        with mock.patch('django.utils.timezone.now', return_value=ahora):
+            self.assertEqual(self.guardar(recibida), 1)
+        self.assertTrue(models.Apuesta.objects.filter(usuario=self.user,
+                                                      partido=self.partido))
+        # la apuesta nueva aparece en el ranking
+        self.assertEqual(models.Puntaje.objects.posicion(self.user), 1)
+
+    def test_recibida_despues_del_vencimiento(self):
+        recibida = self.etapa.vencimiento + datetime.timedelta(seconds=1)
+        self.assertEqual(self.guardar(recibida), 0)
+        self.assertFalse(models.Apuesta.objects.exists())
+
+    def test_recibida_despues_del_comienzo(self):
+        self.etapa.vencimiento = self.inicio + datetime.timedelta(hours=1)
+        self.etapa.save()
+        self.assertEqual(self.guardar(self.inicio), 0)
+        self.assertFalse(models.Apuesta.objects.exists())
+
+    def test_guarda_la_ultima_apuesta(self):
+        factories.ApuestaFactory(usuario=self.user, partido=self.partido,
+                                 goles_local=0, goles_visitante=0)
+        ahora = timezone.now()
+        self.cola.agregar([apuesta(self.user, self.partido, 3, 3)],
+                          recibida=ahora)
+        self.cola.agregar([apuesta(self.user, self.partido, 2, 2)],
+                          recibida=ahora - datetime.timedelta(seconds=1))
+        cola.guardar_pendientes(self.cola.extraer(10))
+        guardada = models.Apuesta.objects.get(usuario=self.user,
+                                              partido=self.partido)
+        self.assertEqual(guardada.goles_local, 3)
+
+
+@override_settings(COLA_APUESTAS=COLA_APUESTAS)
+class DrenarTests(TestCase):
+    def setUp(self):
+        cola._clientes_en_memoria.clear()
+        self.cola = cola.get_cola()
+        self.user = self.make_user()
+        self.partidos = factories.PartidoFactory.create_batch(
+            3, goles_local=None, goles_visitante=None)
+
+    def test_drenar(self):
+        self.cola.agregar(apuesta(self.user, partido)
+                          for partido in self.partidos)
+        self.assertEqual(cola.drenar(lote=2), 3)
+        self.assertEqual(self.cola.cantidad(), 0)
+        self.assertEqual(models.Apuesta.objects.count(), 3)
+
+    def test_otro_proceso_esta_drenando(self):
+        self.cola.agregar([apuesta(self.user, self.partidos[0])])
+        cache.add(f'{self.cola.key}:drenando', True)
+        try:
+            self.assertEqual(cola.drenar(), 0)
+        finally:
+            cache.delete(f'{self.cola.key}:drenando')
+        self.assertEqual(self.cola.cantidad(), 1)
+
+    def test_error_devuelve_las_apuestas(self):
+        self.cola.agregar(apuesta(self.user, partido)
+                          for partido in self.partidos)
+        with mock.patch.object(cola, 'guardar_pendientes',
+                               side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                cola.drenar()
+        self.assertEqual(self.cola.cantidad(), 3)
+        # se libera el bloqueo
+        self.assertEqual(cola.drenar(), 3)
+
+    def test_tarea_reintenta(self):
+        self.cola.agregar(apuesta(self.user, partido)
+                          for partido in self.partidos)
+        with mock.patch.object(cola, 'guardar_pendientes',
+                               side_effect=[RuntimeError, 3]) as guardar:
+            tasks.drenar_apuestas.delay()
+        self.assertEqual(guardar.call_count, 2)
+        self.assertEqual(self.cola.cantidad(), 0)
+
+    @override_settings(COLA_APUESTAS=dict(COLA_APUESTAS, CACHE=None))
+    def test_sin_cola(self):
+        self.assertEqual(cola.drenar(), 0)
+
+    @override_settings(CELERY_ALWAYS_EAGER=False)
+    def test_cola_en_memoria_sin_eager(self):
+        # el worker no veria las apuestas encoladas en este proceso
+        with self.assertRaises(ImproperlyConfigured):
+            cola.get_cola()
+
+
+@override_settings(COLA_APUESTAS=COLA_APUESTAS)
+class UsarColaTests(TestCase):
+    def test_cerca_del_vencimiento(self):
+        etapa = factories.EtapaFactory(
+            vencimiento=timezone.now() + datetime.timedelta(minutes=10))
+        self.assertIsNotNone(cola.usar_cola(etapa))
+
+    def test_lejos_del_vencimiento(self):
+        etapa = factories.EtapaFactory(
+            vencimiento=timezone.now() + datetime.timedelta(hours=1))
+        self.assertIsNone(cola.usar_cola(etapa))
+
+    @override_settings(COLA_APUESTAS=dict(COLA_APUESTAS, MINUTOS=None))
+    def test_siempre(self):
+        etapa = factories.EtapaFactory(
+            vencimiento=timezone.now() + datetime.timedelta(days=10))
+        self.assertIsNotNone(cola.usar_cola(etapa))
+
+    @override_settings(COLA_APUESTAS=dict(COLA_APUESTAS, CACHE=None))
+    def test_sin_cola(self):
+        etapa = factories.EtapaFactory(vencimiento=timezone.now())
+        self.assertIsNone(cola.usar_cola(etapa))
+
+
+@override_settings(COLA_APUESTAS=dict(COLA_APUESTAS, MINUTOS=None))
+class EncolarDesdeVistasTests(TestCase):
+    def setUp(self):
+        cola._clientes_en_memoria.clear()
+        self.user = self.make_user()
+        self.partido = factories.PartidoFactory(goles_local=None,
+                                                goles_visitante=None)
+
+    def test_apostar(self):
+        data = {
+            'form-TOTAL_FORMS': 1,
+            'form-INITIAL_FORMS': 0,
+            'form-0-ganador': constants.GANA_LOCAL,
+            'form-0-goles_local': 1,
+            'form-0-goles_visitante': 0,
+        }
+        with self.login(self.user):
+            self.post('apuestas:apostar', slug=self.partido.etapa.slug,
+                      data=data)
+            self.assertEqual(cola.get_cola().cantidad(), 1)
+            self.assertFalse(models.Apuesta.objects.exists())
+            # TestCase no confirma la transaccion, ejecuto lo pendiente
+            for _, callback in connection.run_on_commit:
+                callback()
+        self.assertEqual(cola.get_cola().cantidad(), 0)
+        self.assertTrue(models.Apuesta.objects.filter(usuario=self.user,
+                                                      goles_local=1))
+
+    def test_apostar_partido(self):
+        data = {
+            'ganador': constants.EMPATE,
+            'goles_local': 2,
+            'goles_visitante': 2,
+        }
+        with mock.patch('prode.apuestas.tasks.drenar_apuestas.delay') as delay:
+            with self.login(self.user):
+                self.post('apuestas:apostar_partido', pk=self.partido.pk,
+                          data=data)
+                self.post('apuestas:apostar_partido', pk=self.partido.pk,
+                          data=data)
+                for _, callback in connection.run_on_commit:
+                    callback()
+        self.response_200()
+        # cada pedido programa la tarea, el bloqueo evita vaciar dos veces
+        self.assertEqual(delay.call_args_list, [mock.call(), mock.call()])
+        self.assertEqual(cola.get_cola().cantidad(), 2)
@@ -0,0 +1,176 @@
+import datetime
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from test_plus import TestCase
+
+from prode.apuestas import (
+    constants,
+    leaderboard,
+    models,
+)
+
+from . import factories
+
+
+class RebuildPuntajesTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(slug='grupos')
+        self.otra_etapa = factories.EtapaFactory(slug='final')
+        self.user1 = self.make_user('user1')
+        self.user2 = self.make_user('user2')
+        for etapa in (self.etapa, self.otra_etapa):
+            partido = factories.PartidoFactory(etapa=etapa,
+                                               goles_local=1,
+                                               goles_visitante=0)
+            # user1 acierta ganador y goles, user2 solo el ganador
+            factories.ApuestaFactory(usuario=self.user1,
+                                     partido=partido,
+                                     goles_local=1,
+                                     goles_visitante=0,
+                                     ganador=constants.GANA_LOCAL)
+            factories.ApuestaFactory(usuario=self.user2,
+                                     partido=partido,
+                                     goles_local=2,
+                                     goles_visitante=0,
+                                     ganador=constants.GANA_LOCAL)
+
+    def rebuild(self, *args):
+        salida = StringIO()
+        call_command('rebuild_puntajes', '--procesos', '1', '--lote', '1',
+                     *args, stdout=salida)
+        return salida.getvalue()
+
+    def puntajes(self):
+        return set(models.Puntaje.objects.values_list('usuario__username',
+                                                      'etapa__slug',
+                                                      'puntos'))
+
+    def test_recalcula_todo(self):
+        models.Puntaje.objects.all().delete()
+        salida = self.rebuild()
+        expected = {
+            ('user1', 'grupos', 4),
+            ('user1', 'final', 4),
+            ('user1', None, 8),
+            ('user2', 'grupos', 1),
+            ('user2', 'final', 1),
+            ('user2', None, 2),
+        }
+        self.assertEqual(self.puntajes(), expected)
+        self.assertIn('Lote 2/2', salida)
+        self.assertIn('usuarios/s', salida)
+
+    def test_etapa(self):
+        models.Puntaje.objects.update(puntos=0)
+        self.rebuild('--etapa', 'grupos')
+        puntajes = self.puntajes()
+        self.assertIn(('user1', 'grupos', 4), puntajes)
+        self.assertIn(('user1', None, 8), puntajes)
+        self.assertIn(('user1', 'final', 0), puntajes)
+
+    def test_etapa_inexistente(self):
+        with self.assertRaises(CommandError):
+            self.rebuild('--etapa', 'no-existe')
+
+    def test_dry_run(self):
+        models.Puntaje.objects.filter(usuario=self.user2,
+                                      etapa=self.etapa).update(puntos=10)
+        models.Puntaje.objects.filter(usuario=self.user1,
+                                      etapa__isnull=True).delete()
+        antes = self.puntajes()
+        salida = self.rebuild('--dry-run')
+        self.assertEqual(self.puntajes(), antes)
+        self.assertIn('user1 [total]: None -> 8', salida)
+        self.assertIn('user2 [grupos]: 10 -> 1', salida)
+        self.assertIn('2 puntajes distintos', salida)
+
+    def test_borra_puntajes_sin_apuestas(self):
+        models.Apuesta.objects.filter(usuario=self.user2).delete()
+        self.rebuild()
+        self.assertFalse(models.Puntaje.objects.filter(usuario=self.user2))
+
+    @override_settings(LEADERBOARD_CACHE='default')
+    def test_reconstruye_leaderboard(self):
+        leaderboard._clientes_en_memoria.clear()
+        tablero = leaderboard.get_leaderboard()
+        tablero.cliente.delete(tablero.key())
+        salida = self.rebuild()
+        self.assertIn('Leaderboard reconstruido', salida)
+        self.assertEqual(tablero.pagina(0, 10), [('user1', 8), ('user2', 2)])
+
+
+class ImportarResultadosTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(slug='grupos')
+        fecha = timezone.now() - datetime.timedelta(days=2)
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                local='AR', visitante='IS',
+                                                fecha=fecha,
+                                                goles_local=None,
+                                                goles_visitante=None)
+        self.otro = factories.PartidoFactory(etapa=self.etapa,
+                                             local='BR', visitante='CH',
+                                             fecha=fecha,
+                                             goles_local=1,
+                                             goles_visitante=1)
+        self.apuesta = factories.ApuestaFactory(partido=self.partido,
+                                                ganador=constants.GANA_LOCAL,
+                                                goles_local=2,
+                                                goles_visitante=0)
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.archivo = os.path.join(directorio.name, 'resultados.csv')
+        with open(self.archivo, 'w') as archivo:
+            archivo.write('etapa,local,visitante,goles_local,goles_visitante\n'
+                          'grupos,AR,IS,2,0\n'
+                          'grupos,BR,CH,1,1\n')
+
+    def importar(self, *args):
+        salida = StringIO()
+        call_command('importar_resultados', *args, stdout=salida)
+        # fuera de una transaccion las tareas se encolan en el momento, en
+        # los tests quedan pendientes
+        for _, callback in connection.run_on_commit:
+            callback()
+        return salida.getvalue()
+
+    def test_importa(self):
+        salida = self.importar(self.archivo)
+        self.partido.refresh_from_db()
+        self.assertEqual(
+            (self.partido.goles_local, self.partido.goles_visitante), (2, 0))
+        self.assertIn('1 resultados importados, 1 sin cambios', salida)
+        self.assertEqual(self.apuesta.usuario.puntajes.puntos(self.etapa), 4)
+
+    def test_feed_configurado(self):
+        with override_settings(RESULTADOS_FEED=self.archivo):
+            self.importar()
+        self.partido.refresh_from_db()
+        self.assertEqual(self.partido.goles_local, 2)
+
+    def test_sin_feed(self):
+        with self.assertRaises(CommandError):
+            self.importar()
+
+    def test_dry_run(self):
+        salida = self.importar(self.archivo, '--dry-run')
+        self.partido.refresh_from_db()
+        self.assertIsNone(self.partido.goles_local)
+        self.assertIn('AR 2 - 0 IS [grupos]', salida)
+
+    def test_errores_no_guarda_nada(self):
+        with open(self.archivo, 'a') as archivo:
+            archivo.write('grupos,AR,MX,1,0\n')
+        with self.assertRaisesMessage(CommandError,
+                                      'Fila 3: AR - MX en grupos no existe'):
+            self.importar(self.archivo)
+        self.partido.refresh_from_db()
+        self.assertIsNone(self.partido.goles_local)
@@ -0,0 +1,141 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    constants,
+    estadisticas,
+    models,
+)
+
+from . import factories
+
+
+class EstadisticasTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(
+            vencimiento=timezone.now() - datetime.timedelta(days=1))
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                goles_local=2,
+                                                goles_visitante=1)
+
+    def apostar(self, ganador, goles_local, goles_visitante, partido=None):
+        return factories.ApuestaFactory(partido=partido or self.partido,
+                                        ganador=ganador,
+                                        goles_local=goles_local,
+                                        goles_visitante=goles_visitante)
+
+    def test_calcular(self):
+        self.apostar(constants.GANA_LOCAL, 2, 1)
+        self.apostar(constants.GANA_LOCAL, 2, 1)
+        self.apostar(constants.GANA_LOCAL, 1, 0)
+        self.apostar(constants.EMPATE, 1, 1)
+        [estadistica], resultados, puntos = estadisticas.calcular(
+            [self.partido])
+        self.assertEqual(estadistica.apuestas, 4)
+        self.assertEqual(estadistica.gana_local, 3)
+        self.assertEqual(estadistica.empate, 1)
+        self.assertEqual(estadistica.gana_visitante, 0)
+        self.assertEqual(
+            [(resultado.goles_local, resultado.goles_visitante,
+              resultado.cantidad) for resultado in resultados],
+            [(2, 1, 2), (1, 0, 1), (1, 1, 1)],
+        )
+        self.assertEqual(
+            sorted((punto.puntos, punto.cantidad) for punto in puntos),
+            [(0, 1), (1, 1), (4, 2)],
+        )
+
+    def test_calcular__partido_sin_resultado(self):
+        self.partido.goles_local = self.partido.goles_visitante = None
+        self.partido.save()
+        self.apostar(constants.EMPATE, 0, 0)
+        _, resultados, puntos = estadisticas.calcular([self.partido])
+        self.assertEqual(len(resultados), 1)
+        self.assertEqual(puntos, [])
+
+    def test_calcular__resultados_frecuentes(self):
+        for goles in range(estadisticas.RESULTADOS_FRECUENTES + 2):
+            self.apostar(constants.GANA_LOCAL, goles + 1, 0)
+        _, resultados, _ = estadisticas.calcular([self.partido])
+        self.assertEqual(len(resultados), estadisticas.RESULTADOS_FRECUENTES)
+
+    def test_calcular__consultas_no_dependen_de_partidos(self):
+        partidos = [self.partido] + factories.PartidoFactory.create_batch(
+            5, etapa=self.etapa)
+        for partido in partidos:
+            self.apostar(constants.EMPATE, 0, 0, partido=partido)
+        with self.assertNumQueries(3):
+            estadisticas.calcular(partidos)
+
+    def test_de_etapa__calcula_las_que_faltan(self):
+        self.apostar(constants.EMPATE, 1, 1)
+        estadisticas.borrar([self.partido])
+        [partido] = estadisticas.de_etapa(self.etapa)
+        self.assertEqual(partido.estadistica.empate, 1)
+        self.assertTrue(models.EstadisticaPartido.objects
+                        .filter(partido=self.partido).exists())
+
+    def test_de_etapa__no_recorre_apuestas(self):
+        factories.PartidoFactory.create_batch(3, etapa=self.etapa)
+        self.apostar(constants.EMPATE, 1, 1)
+        estadisticas.de_etapa(self.etapa)
+        with CaptureQueriesContext(connection) as consultas:
+            partidos = estadisticas.de_etapa(self.etapa)
+            for partido in partidos:
+                list(partido.resultados_apostados.all())
+                list(partido.puntos_obtenidos.all())
+        self.assertEqual(len(consultas), 3)
+        self.assertFalse(any('"apuestas_apuesta"' in consulta['sql']
+                             for consulta in consultas))
+
+
+class SignalsTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(
+            vencimiento=timezone.now() - datetime.timedelta(days=1))
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                goles_local=1,
+                                                goles_visitante=0)
+        self.apuesta = factories.ApuestaFactory(partido=self.partido,
+                                                ganador=constants.GANA_LOCAL,
+                                                goles_local=1,
+                                                goles_visitante=0)
+
+    def puntos(self):
+        return list(models.PuntosObtenidos.objects
+                    .filter(partido=self.partido)
+                    .values_list('puntos', 'cantidad'))
+
+    def test_apuesta_en_etapa_vencida(self):
+        estadistica = models.EstadisticaPartido.objects.get(
+            partido=self.partido)
+        self.assertEqual(estadistica.gana_local, 1)
+
+    def test_apuesta_en_etapa_no_vencida(self):
+        partido = factories.PartidoFactory()
+        factories.ApuestaFactory(partido=partido)
+        self.assertFalse(models.EstadisticaPartido.objects
+                         .filter(partido=partido).exists())
+
+    def test_cambia_resultado(self):
+        self.assertEqual(self.puntos(), [(4, 1)])
+        self.partido.goles_local = 2
+        self.partido.save()
+        self.assertEqual(self.puntos(), [(1, 1)])
+
+    def test_cambian_puntos_de_la_etapa(self):
+        self.etapa.puntos_goles = 10
+        self.etapa.save()
+        self.assertEqual(self.puntos(), [(11, 1)])
+
+    def test_etapa_reabierta(self):
+        self.etapa.vencimiento = timezone.now() + datetime.timedelta(days=1)
+        self.etapa.save()
+        self.assertFalse(models.EstadisticaPartido.objects
+                         .filter(partido=self.partido).exists())
+        self.assertEqual(self.puntos(), [])
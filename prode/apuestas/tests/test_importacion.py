@@ -0,0 +1,191 @@
+import datetime
+import json
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+from django.utils import timezone
+
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    constants,
+    importacion,
+    models,
+)
+
+from . import factories
+
+CSV = '''etapa,local,visitante,goles_local,goles_visitante,fecha
+grupos,AR,IS,1,1,
+grupos,Brasil,Switzerland,1,1,
+'''
+
+
+class LeerTests(TestCase):
+    def test_csv(self):
+        filas = importacion.leer(CSV, 'csv')
+        self.assertEqual(
+            filas,
+            [importacion.Fila(1, 'grupos', 'AR', 'IS', 1, 1, None),
+             importacion.Fila(2, 'grupos', 'BR', 'CH', 1, 1, None)],
+        )
+
+    def test_json(self):
+        contenido = json.dumps([{'etapa': 'grupos', 'local': 'AR',
+                                 'visitante': 'IS', 'goles_local': 1,
+                                 'goles_visitante': 0,
+                                 'fecha': '2018-06-16'}])
+        [fila] = importacion.leer(contenido, 'json')
+        self.assertEqual((fila.goles_local, fila.goles_visitante, fila.fecha),
+                         (1, 0, datetime.date(2018, 6, 16)))
+
+    def test_errores(self):
+        contenido = ('etapa,local,visitante,goles_local,goles_visitante\n'
+                     'grupos,AR,XX,1,-1\n'
+                     'grupos,AR,IS,,1\n')
+        with self.assertRaises(importacion.ErrorImportacion) as contexto:
+            importacion.leer(contenido, 'csv')
+        self.assertEqual(contexto.exception.errores, [
+            'Fila 1: no se reconoce el pais XX',
+            'Fila 1: los goles deben ser enteros positivos',
+            'Fila 2: faltan goles_local',
+        ])
+
+    def test_json_invalido(self):
+        with self.assertRaises(importacion.ErrorImportacion):
+            importacion.leer('{"etapa": "grupos"}', 'json')
+
+    def test_formato_de(self):
+        self.assertEqual(importacion.formato_de('resultados.JSON'), 'json')
+        with self.assertRaises(importacion.ErrorImportacion):
+            importacion.formato_de('resultados.xls')
+
+
+class EmparejarTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(slug='grupos')
+        self.fecha = timezone.now() - datetime.timedelta(days=2)
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                local='AR', visitante='IS',
+                                                fecha=self.fecha,
+                                                goles_local=None,
+                                                goles_visitante=None)
+
+    def fila(self, numero=1, etapa='grupos', local='AR', visitante='IS',
+             goles_local=2, goles_visitante=0, fecha=None):
+        return importacion.Fila(numero, etapa, local, visitante, goles_local,
+                                goles_visitante, fecha)
+
+    def assertErrores(self, filas, errores, **kwargs):
+        with self.assertRaises(importacion.ErrorImportacion) as contexto:
+            importacion.emparejar(filas, **kwargs)
+        self.assertEqual(contexto.exception.errores, errores)
+
+    def test_empareja(self):
+        [partido] = importacion.emparejar([self.fila()])
+        self.assertEqual(partido, self.partido)
+        self.assertEqual((partido.goles_local, partido.goles_visitante),
+                         (2, 0))
+
+    def test_por_fecha(self):
+        revancha = factories.PartidoFactory(
+            etapa=self.etapa, local='AR', visitante='IS',
+            fecha=self.fecha - datetime.timedelta(days=7))
+        self.assertErrores(
+            [self.fila()],
+            ['Fila 1: AR - IS en grupos se juega mas de una vez, indique la '
+             'fecha'],
+        )
+        fecha = timezone.localtime(revancha.fecha).date()
+        [partido] = importacion.emparejar([self.fila(fecha=fecha)])
+        self.assertEqual(partido, revancha)
+
+    def test_errores(self):
+        factories.PartidoFactory(etapa=self.etapa, local='BR',
+                                 visitante='CH')
+        self.assertErrores(
+            [self.fila(), self.fila(numero=2),
+             self.fila(numero=3, local='IS', visitante='AR'),
+             self.fila(numero=4, local='BR', visitante='CH')],
+            ['Fila 2: AR - IS en grupos esta repetido',
+             'Fila 3: IS - AR en grupos no existe',
+             'Fila 4: BR - CH en grupos todavia no termino'],
+        )
+
+    def test_correcciones(self):
+        self.partido.goles_local = self.partido.goles_visitante = 1
+        self.partido.save()
+        self.assertErrores([self.fila()],
+                           ['Fila 1: AR - IS en grupos ya tiene resultado'],
+                           correcciones=False)
+        # el mismo resultado no es una correccion
+        importacion.emparejar([self.fila(goles_local=1, goles_visitante=1)],
+                              correcciones=False)
+        importacion.emparejar([self.fila()])
+
+    def test_una_consulta_por_tabla(self):
+        filas = [self.fila(numero=numero, local=local, visitante=visitante)
+                 for numero, (local, visitante) in enumerate(
+                     (('BR', 'CH'), ('DE', 'MX'), ('ES', 'PT')), start=1)]
+        for fila in filas:
+            factories.PartidoFactory(etapa=self.etapa, local=fila.local,
+                                     visitante=fila.visitante,
+                                     fecha=self.fecha)
+        with self.assertNumQueries(2):
+            importacion.emparejar(filas)
+
+
+class ImportarTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(slug='grupos')
+        fecha = timezone.now() - datetime.timedelta(days=2)
+        self.partidos = [
+            factories.PartidoFactory(etapa=self.etapa, local=local,
+                                     visitante=visitante, fecha=fecha,
+                                     goles_local=None, goles_visitante=None)
+            for local, visitante in (('AR', 'IS'), ('BR', 'CH'))
+        ]
+        self.apuesta = factories.ApuestaFactory(partido=self.partidos[0],
+                                                ganador=constants.EMPATE,
+                                                goles_local=1,
+                                                goles_visitante=1)
+
+    def test_un_solo_procesamiento(self):
+        partidos = importacion.emparejar(importacion.leer(CSV, 'csv'))
+        with mock.patch('prode.apuestas.tasks.procesar_resultados') as tarea:
+            cambios = importacion.importar(partidos)
+            for _, callback in connection.run_on_commit:
+                callback()
+        self.assertEqual(len(cambios), 2)
+        tarea.assert_called_once_with(
+            [partido.pk for partido in self.partidos])
+
+    def test_error_al_encolar(self):
+        partidos = importacion.emparejar(importacion.leer(CSV, 'csv'))
+        si_falla = mock.Mock()
+        with mock.patch('prode.apuestas.tasks.procesar_resultados',
+                        side_effect=ConnectionError), \
+                self.assertLogs('prode.apuestas.tasks', 'ERROR'):
+            cambios = importacion.importar(partidos, si_falla=si_falla)
+            for _, callback in connection.run_on_commit:
+                callback()
+        si_falla.assert_called_once_with()
+        # los resultados quedan guardados, sin aplicar
+        self.assertEqual(len(cambios), 2)
+        self.assertFalse(models.CambioResultado.objects
+                         .filter(aplicado=True).exists())
+
+    def test_actualiza_puntajes(self):
+        importacion.importar(
+            importacion.emparejar(importacion.leer(CSV, 'csv')))
+        for _, callback in connection.run_on_commit:
+            callback()
+        self.assertEqual(self.apuesta.usuario.puntajes.puntos(self.etapa), 4)
+
+    def test_fuente_configurada(self):
+        self.assertIsNone(importacion.get_fuente())
+        with override_settings(RESULTADOS_FEED='/feed/resultados.json'):
+            fuente = importacion.get_fuente()
+        self.assertEqual((fuente.ruta, fuente.formato),
+                         ('/feed/resultados.json', 'json'))
@@ -0,0 +1,217 @@
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    constants,
+    leaderboard,
+    models,
+    tasks,
+    utils,
+)
+
+from . import factories
+
+
+class LeaderboardTests(TestCase):
+    def setUp(self):
+        self.tablero = leaderboard.Leaderboard(leaderboard.RedisEnMemoria())
+        self.tablero.guardar([
+            ('user1', None, 0),
+            ('user2', None, 30),
+            ('user3', None, 10),
+            ('user4', None, 10),
+            ('user1', 1, 5),
+        ])
+
+    def test_posicion(self):
+        self.assertEqual(self.tablero.posicion('user2'), 1)
+        self.assertEqual(self.tablero.posicion('user3'), 2)
+        self.assertEqual(self.tablero.posicion('user4'), 3)
+        self.assertEqual(self.tablero.posicion('user1'), 4)
+        self.assertEqual(self.tablero.posicion('user1', etapa=1), 1)
+
+    def test_posicion__usuario_inexistente(self):
+        self.assertIsNone(self.tablero.posicion('foo'))
+        self.assertIsNone(self.tablero.posicion('user2', etapa=1))
+
+    def test_puesto(self):
+        self.assertEqual(self.tablero.puesto('user2'), 1)
+        self.assertEqual(self.tablero.puesto('user3'), 2)
+        self.assertEqual(self.tablero.puesto('user4'), 2)
+        self.assertEqual(self.tablero.puesto('user1'), 4)
+        self.assertIsNone(self.tablero.puesto('foo'))
+
+    def test_puntos(self):
+        self.assertEqual(self.tablero.puntos('user2'), 30)
+        self.assertEqual(self.tablero.puntos('user1', etapa=1), 5)
+        self.assertIsNone(self.tablero.puntos('foo'))
+
+    def test_actualizar_puntos(self):
+        self.tablero.guardar([('user1', None, 40)])
+        self.assertEqual(self.tablero.posicion('user1'), 1)
+        self.assertEqual(self.tablero.cantidad(), 4)
+
+    def test_pagina(self):
+        pagina = self.tablero.pagina(1, 2)
+        self.assertEqual(pagina, [('user3', 10), ('user4', 10)])
+        self.assertEqual([rank.puesto for rank in pagina], [2, 2])
+        pagina = self.tablero.pagina(2, 10)
+        self.assertEqual(pagina, [('user4', 10), ('user1', 0)])
+        self.assertEqual([rank.puesto for rank in pagina], [2, 4])
+
+    def test_reconstruir(self):
+        user = self.make_user('user5')
+        factories.ApuestaFactory(usuario=user,
+                                 partido__goles_local=1,
+                                 partido__goles_visitante=1,
+                                 ganador=constants.EMPATE,
+                                 goles_local=1,
+                                 goles_visitante=1)
+        self.tablero.reconstruir()
+        self.assertEqual(self.tablero.pagina(0, 10), [('user5', 4)])
+        # no quedan usuarios ni etapas que ya no existen
+        self.assertIsNone(self.tablero.posicion('user1', etapa=1))
+        self.assertEqual(self.tablero.cliente.scan_iter('prode:ranking*'),
+                         [self.tablero.key(),
+                          self.tablero.key(user.puntajes.get(
+                              etapa__isnull=False).etapa),
+                          self.tablero.marca])
+        self.assertTrue(self.tablero.completo())
+
+    def test_reconstruir__por_lotes(self):
+        for numero in range(5):
+            factories.ApuestaFactory(usuario=self.make_user(f'lote{numero}'),
+                                     partido__goles_local=1,
+                                     partido__goles_visitante=1,
+                                     ganador=constants.EMPATE,
+                                     goles_local=1,
+                                     goles_visitante=1)
+        self.tablero.lote = 2
+        with mock.patch.object(self.tablero.cliente, 'execute_command',
+                               wraps=self.tablero.cliente.execute_command
+                               ) as comando:
+            self.tablero.reconstruir()
+        # 5 usuarios en el total y en cada una de sus 5 etapas
+        self.assertEqual(comando.call_count, 3 + 5)
+        self.assertEqual(self.tablero.cantidad(), 5)
+
+    def test_quitar(self):
+        self.tablero.quitar([('user2', None), ('user1', 1), ('foo', None)])
+        self.assertIsNone(self.tablero.posicion('user2'))
+        self.assertEqual(self.tablero.posicion('user3'), 1)
+        self.assertIsNone(self.tablero.posicion('user1', etapa=1))
+
+
+@override_settings(LEADERBOARD_CACHE='default')
+class SincronizarLeaderboardTests(TestCase):
+    def setUp(self):
+        leaderboard._clientes_en_memoria.clear()
+
+    def confirmar(self):
+        """TestCase no confirma la transaccion, ejecuto lo pendiente."""
+        while connection.run_on_commit:
+            _, callback = connection.run_on_commit.pop(0)
+            callback()
+
+    def test_get_leaderboard(self):
+        tablero = leaderboard.get_leaderboard()
+        self.assertIsInstance(tablero.cliente, leaderboard.RedisEnMemoria)
+
+    @override_settings(LEADERBOARD_CACHE=None)
+    def test_get_leaderboard__sin_configurar(self):
+        self.assertIsNone(leaderboard.get_leaderboard())
+
+    def test_cargar_resultado(self):
+        partido = factories.PartidoFactory(goles_local=None,
+                                           goles_visitante=None)
+        user1 = self.make_user('user1')
+        user2 = self.make_user('user2')
+        factories.ApuestaFactory(usuario=user1,
+                                 partido=partido,
+                                 ganador=constants.GANA_LOCAL)
+        factories.ApuestaFactory(usuario=user2,
+                                 partido=partido,
+                                 ganador=constants.GANA_VISITANTE)
+        tablero = leaderboard.get_leaderboard()
+        # hasta confirmar la transaccion no se escribe en el leaderboard
+        self.assertEqual(tablero.cantidad(), 0)
+        self.confirmar()
+        self.assertEqual(tablero.pagina(0, 10), [('user1', 0), ('user2', 0)])
+        partido.goles_local = 0
+        partido.goles_visitante = 1
+        partido.save()
+        self.confirmar()
+        self.assertEqual(tablero.puntos('user2', etapa=partido.etapa), 1)
+        self.assertEqual(utils.get_ranking(user2), 1)
+        self.assertEqual(utils.get_ranking(user1), 2)
+        self.assertEqual(tablero.pagina(0, 10),
+                         models.Puntaje.objects.ranking())
+
+    def test_ranking_incompleto_lee_la_base(self):
+        factories.ApuestaFactory(usuario=self.make_user('user1'),
+                                 partido__goles_local=1,
+                                 partido__goles_visitante=1,
+                                 ganador=constants.EMPATE,
+                                 goles_local=1,
+                                 goles_visitante=1)
+        leaderboard.get_leaderboard().reconstruir()
+        self.assertIsNotNone(utils.RankingPaginado().tablero)
+        # por ejemplo luego de vaciar el redis, un usuario nuevo apuesta
+        leaderboard._clientes_en_memoria.clear()
+        factories.ApuestaFactory(usuario=self.make_user('user2'),
+                                 partido__goles_local=None,
+                                 partido__goles_visitante=None)
+        self.confirmar()
+        self.assertEqual(leaderboard.get_leaderboard().cantidad(), 1)
+        ranking = utils.RankingPaginado()
+        self.assertIsNone(ranking.tablero)
+        self.assertEqual(ranking.count(), 2)
+        self.assertEqual(ranking[0:10], [('user1', 4), ('user2', 0)])
+        self.assertEqual(utils.get_puesto(self.make_user('user3')), None)
+
+    def test_tarea_reconstruye_si_no_esta_completo(self):
+        factories.ApuestaFactory(usuario=self.make_user('user1'))
+        self.confirmar()
+        tablero = leaderboard.get_leaderboard()
+        tablero.cliente.delete(tablero.key())
+        tasks.reconstruir_leaderboard()
+        self.assertTrue(tablero.completo())
+        self.assertEqual(tablero.cantidad(), 1)
+        with mock.patch.object(leaderboard.Leaderboard,
+                               'reconstruir') as reconstruir:
+            tasks.reconstruir_leaderboard()
+        reconstruir.assert_not_called()
+
+    def test_sin_puntajes_sale_del_ranking(self):
+        user = self.make_user('user1')
+        apuesta = factories.ApuestaFactory(usuario=user)
+        self.confirmar()
+        tablero = leaderboard.get_leaderboard()
+        self.assertEqual(tablero.posicion('user1'), 1)
+        apuesta.delete()
+        self.confirmar()
+        self.assertIsNone(tablero.posicion('user1'))
+        self.assertIsNone(tablero.posicion('user1',
+                                           etapa=apuesta.partido.etapa))
+
+    def test_usuario_borrado(self):
+        user = self.make_user('user1')
+        tablero = leaderboard.get_leaderboard()
+        tablero.guardar([('user1', None, 10)])
+        user.delete()
+        self.confirmar()
+        self.assertEqual(tablero.cantidad(), 0)
+
+    def test_etapa_borrada(self):
+        apuesta = factories.ApuestaFactory(usuario=self.make_user('user1'))
+        self.confirmar()
+        etapa = apuesta.partido.etapa
+        tablero = leaderboard.get_leaderboard()
+        self.assertEqual(tablero.cantidad(etapa=etapa), 1)
+        etapa.delete()
+        self.confirmar()
+        self.assertEqual(tablero.cantidad(etapa=etapa), 0)
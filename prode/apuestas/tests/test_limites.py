@@ -0,0 +1,118 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import (
+    RequestFactory,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+
+from test_plus.test import TestCase
+
+from prode.apuestas import limites
+
+from . import factories
+
+
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.balde = limites.TokenBucket('balde', capacidad=2, por_minuto=6)
+
+    def test_consumir(self):
+        self.assertEqual(self.balde.consumir(ahora=100), 0)
+        self.assertEqual(self.balde.consumir(ahora=100), 0)
+        # se recarga una ficha cada 10 segundos
+        self.assertAlmostEqual(self.balde.consumir(ahora=100), 10)
+        self.assertAlmostEqual(self.balde.consumir(ahora=104), 6)
+        self.assertEqual(self.balde.consumir(ahora=110), 0)
+
+    def test_no_supera_la_capacidad(self):
+        self.balde.consumir(ahora=0)
+        self.assertEqual(self.balde.consumir(ahora=1000), 0)
+        self.assertEqual(self.balde.consumir(ahora=1000), 0)
+        self.assertGreater(self.balde.consumir(ahora=1000), 0)
+
+
+class IpClienteTests(TestCase):
+    def request(self, **meta):
+        return RequestFactory().get('/', REMOTE_ADDR='10.0.0.1', **meta)
+
+    @override_settings(LIMITES_PROXIES=0)
+    def test_sin_proxies(self):
+        request = self.request(HTTP_X_FORWARDED_FOR='1.1.1.1')
+        self.assertEqual(limites.ip_cliente(request), '10.0.0.1')
+
+    @override_settings(LIMITES_PROXIES=1)
+    def test_con_proxy(self):
+        # el cliente puede inventar las primeras IPs
+        request = self.request(HTTP_X_FORWARDED_FOR='9.9.9.9, 1.1.1.1')
+        self.assertEqual(limites.ip_cliente(request), '1.1.1.1')
+
+    @override_settings(LIMITES_PROXIES=1)
+    def test_con_proxy_sin_cabecera(self):
+        self.assertEqual(limites.ip_cliente(self.request()), '10.0.0.1')
+
+
+@override_settings(LIMITES={
+    'ranking': {'usuario': (2, 1), 'ip': (3, 1)},
+    'apostar': {'usuario': (1, 1)},
+})
+class LimitarVistasTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = self.make_user('user1')
+
+    def test_ranking(self):
+        with self.login(self.user):
+            self.get('apuestas:ranking')
+            self.response_200()
+            self.get('apuestas:ranking')
+            self.response_200()
+            with CaptureQueriesContext(connection) as consultas:
+                response = self.get('apuestas:ranking')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')
+        # solo la sesion y el usuario
+        consultas = [consulta for consulta in consultas
+                     if consulta['sql'].startswith('SELECT')]
+        self.assertEqual(len(consultas), 2)
+        self.assertEqual(limites.rechazos()[('ranking', 'usuario')], 1)
+        self.assertEqual(limites.rechazos()[('ranking', 'ip')], 0)
+
+    def test_limite_por_usuario(self):
+        otro = self.make_user('user2')
+        with self.login(self.user):
+            self.get('apuestas:ranking')
+            self.get('apuestas:ranking')
+        with self.login(otro):
+            self.get('apuestas:ranking')
+        self.response_200()
+
+    def test_limite_por_ip(self):
+        for numero in range(3):
+            with self.login(self.make_user(f'otro{numero}')):
+                self.get('apuestas:ranking')
+                self.response_200()
+        with self.login(self.user):
+            self.get('apuestas:ranking')
+        self.assertEqual(self.last_response.status_code, 429)
+        self.assertEqual(limites.rechazos()[('ranking', 'ip')], 1)
+
+    def test_apostar(self):
+        etapa = factories.EtapaFactory()
+        with self.login(self.user):
+            self.post('apuestas:apostar', slug=etapa.slug, data={
+                'form-TOTAL_FORMS': 0,
+                'form-INITIAL_FORMS': 0,
+            })
+            self.response_302()
+            self.get('apuestas:apostar', slug=etapa.slug)
+        self.assertEqual(self.last_response.status_code, 429)
+        self.assertEqual(limites.rechazos()[('apostar', 'usuario')], 1)
+
+    def test_vista_sin_limites(self):
+        etapa = factories.EtapaFactory()
+        with self.login(self.user):
+            for _ in range(5):
+                self.get('apuestas:detail', slug=etapa.slug)
+                self.response_302()
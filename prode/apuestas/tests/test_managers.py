@@ -1,4 +1,5 @@
 from datetime import timedelta
+from unittest import mock
 
 from django.utils import timezone
 
@@ -61,6 +62,121 @@ class ApuestaManagerTests(TestCase):
         puntajes = models.Apuesta.objects.get_puntajes(etapa=etapa)
         self.assertEqual(puntajes, expected)
 
+    def test_get_puntajes__limite(self):
+        etapa = self.get_etapa()
+        puntajes = models.Apuesta.objects.get_puntajes(etapa=etapa,
+                                                       desde=1,
+                                                       limite=1)
+        self.assertEqual(puntajes, [('user1', 15)])
+        self.assertEqual(puntajes[0].puesto, 2)
+
+    def test_ranking__puestos(self):
+        etapa = self.get_etapa()
+        # user4 empata con user1 acertando solo los goles en 5 partidos
+        user4 = self.make_user('user4')
+        factories.ApuestaFactory.create_batch(
+            5,
+            ganador=constants.GANA_LOCAL,
+            goles_local=2,
+            goles_visitante=2,
+            partido__goles_local=2,
+            partido__goles_visitante=2,
+            partido__etapa=etapa,
+            usuario=user4,
+        )
+        ranking = models.Apuesta.objects.ranking()
+        self.assertEqual([(rank.username, rank.puntos, rank.puesto)
+                          for rank in ranking],
+                         [('user2', 20, 1),
+                          ('user1', 15, 2),
+                          ('user4', 15, 2),
+                          ('user3', 5, 4)])
+
+    def test_con_puntaje(self):
+        etapa = self.get_etapa()
+        apuestas = models.Apuesta.objects.con_puntaje().filter(
+            partido__etapa=etapa)
+        self.assertEqual(len(apuestas), 15)
+        for apuesta in apuestas:
+            self.assertEqual(apuesta.puntos, apuesta.puntaje)
+            self.assertEqual(apuesta.ganador_display,
+                             apuesta.get_ganador_display())
+
+    def test_con_puntaje__partido_sin_resultado(self):
+        apuesta = factories.ApuestaFactory(partido__goles_local=None,
+                                           partido__goles_visitante=None,
+                                           ganador=constants.GANA_VISITANTE)
+        apuesta = models.Apuesta.objects.con_puntaje().get(pk=apuesta.pk)
+        self.assertIsNone(apuesta.puntos)
+        self.assertEqual(apuesta.ganador_display,
+                         apuesta.partido.visitante.name)
+
+    def test_con_puntaje__no_accede_al_partido(self):
+        self.get_etapa()
+        with self.assertNumQueries(1):
+            for apuesta in models.Apuesta.objects.con_puntaje():
+                apuesta.puntos, apuesta.ganador_display
+
+
+class GuardarApuestasTests(TestCase):
+    def setUp(self):
+        self.user = self.make_user()
+        self.partidos = factories.PartidoFactory.create_batch(
+            3, goles_local=None, goles_visitante=None)
+        self.existente = factories.ApuestaFactory(usuario=self.user,
+                                                  partido=self.partidos[0],
+                                                  ganador=constants.EMPATE,
+                                                  goles_local=0,
+                                                  goles_visitante=0)
+
+    def guardar(self):
+        self.existente.ganador = constants.GANA_LOCAL
+        self.existente.goles_local = 2
+        apuestas = [self.existente] + [
+            models.Apuesta(usuario=self.user, partido=partido,
+                           ganador=constants.GANA_VISITANTE,
+                           goles_local=0, goles_visitante=1)
+            for partido in self.partidos[1:]
+        ]
+        models.Apuesta.objects.guardar(apuestas)
+        return set(models.Apuesta.objects.values_list('partido', 'ganador',
+                                                      'goles_local',
+                                                      'goles_visitante'))
+
+    def esperado(self):
+        return {
+            (self.partidos[0].pk, constants.GANA_LOCAL, 2, 0),
+            (self.partidos[1].pk, constants.GANA_VISITANTE, 0, 1),
+            (self.partidos[2].pk, constants.GANA_VISITANTE, 0, 1),
+        }
+
+    def test_guardar(self):
+        self.assertEqual(self.guardar(), self.esperado())
+
+    def test_guardar__sin_upsert(self):
+        with mock.patch('prode.apuestas.managers.soporta_upsert',
+                        return_value=False):
+            self.assertEqual(self.guardar(), self.esperado())
+
+    def test_guardar__reemplaza_apuesta_sin_pk(self):
+        # otra solicitud guardo la apuesta mientras tanto
+        apuesta = models.Apuesta(usuario=self.user,
+                                 partido=self.partidos[0],
+                                 ganador=constants.GANA_VISITANTE,
+                                 goles_local=1,
+                                 goles_visitante=3)
+        models.Apuesta.objects.guardar([apuesta])
+        self.existente.refresh_from_db()
+        self.assertEqual(self.existente.goles_visitante, 3)
+        self.assertEqual(models.Apuesta.objects.count(), 1)
+
+    def test_guardar__una_consulta(self):
+        apuestas = [models.Apuesta(usuario_id=self.user.pk,
+                                   partido_id=partido.pk)
+                    for partido in self.partidos]
+        with self.assertNumQueries(1):
+            models.Apuesta.objects.guardar(apuestas)
+
 
 class PartidoManagerTests(TestCase):
     def test_terminados(self):
@@ -74,6 +190,142 @@ class PartidoManagerTests(TestCase):
         self.assertEqual(models.Partido.objects.no_empezados().count(), 0)
 
 
+    def test_abiertos(self):
+        ayer = timezone.now() - timedelta(days=1)
+        abierto = factories.PartidoFactory(goles_local=None,
+                                           goles_visitante=None)
+        factories.PartidoFactory(goles_local=None,
+                                 goles_visitante=None,
+                                 etapa__vencimiento=ayer)
+        factories.PartidoFactory(goles_local=None,
+                                 goles_visitante=None,
+                                 fecha=ayer)
+        self.assertEqual(list(models.Partido.objects.abiertos()), [abierto])
+
+    def test_puntos_abiertos(self):
+        partido = factories.PartidoFactory(goles_local=None,
+                                           goles_visitante=None,
+                                           etapa__puntos_goles=6)
+        factories.PartidoFactory(goles_local=None,
+                                 goles_visitante=None,
+                                 etapa=partido.etapa)
+        self.assertEqual(models.Partido.objects.puntos_abiertos(),
+                         {partido.etapa_id: 14})
+
     def test_no_empezados(self):
         factories.PartidoFactory()
         self.assertEqual(models.Partido.objects.no_empezados().count(), 1)
+
+
+class PuntajeManagerTests(TestCase):
+    def hacer_apuestas(self):
+        """Hace apuestas en una etapa.
+
+        Usuario     Puntos
+        user2       4
+        user3       4
+        user1       0
+        """
+        self.etapa = factories.EtapaFactory()
+        self.user1 = self.make_user('user1')
+        self.user2 = self.make_user('user2')
+        self.user3 = self.make_user('user3')
+        partido = factories.PartidoFactory(etapa=self.etapa,
+                                           goles_local=1,
+                                           goles_visitante=0)
+        factories.ApuestaFactory(usuario=self.user1,
+                                 partido=partido,
+                                 goles_local=0,
+                                 goles_visitante=0,
+                                 ganador=constants.EMPATE)
+        for user in (self.user3, self.user2):
+            factories.ApuestaFactory(usuario=user,
+                                     partido=partido,
+                                     goles_local=1,
+                                     goles_visitante=0,
+                                     ganador=constants.GANA_LOCAL)
+
+    def test_ranking(self):
+        self.hacer_apuestas()
+        expected = [
+            ('user2', 4),
+            ('user3', 4),
+            ('user1', 0),
+        ]
+        self.assertEqual(models.Puntaje.objects.ranking(), expected)
+        self.assertEqual(models.Puntaje.objects.ranking(self.etapa), expected)
+
+    def test_ranking__otra_etapa(self):
+        self.hacer_apuestas()
+        etapa = factories.EtapaFactory()
+        self.assertEqual(models.Puntaje.objects.ranking(etapa), [])
+
+    def test_puntos(self):
+        self.hacer_apuestas()
+        self.assertEqual(self.user2.puntajes.puntos(), 4)
+        self.assertEqual(self.user2.puntajes.puntos(self.etapa), 4)
+        self.assertEqual(self.user1.puntajes.puntos(), 0)
+
+    def test_posicion(self):
+        self.hacer_apuestas()
+        self.assertEqual(models.Puntaje.objects.posicion(self.user2), 1)
+        self.assertEqual(models.Puntaje.objects.posicion(self.user3), 2)
+        self.assertEqual(models.Puntaje.objects.posicion(self.user1), 3)
+
+    def test_posicion__sin_apuestas(self):
+        user = self.make_user()
+        self.assertIsNone(models.Puntaje.objects.posicion(user))
+
+    def test_puesto(self):
+        self.hacer_apuestas()
+        puestos = [models.Puntaje.objects.puesto(user)
+                   for user in (self.user2, self.user3, self.user1)]
+        self.assertEqual(puestos, [1, 1, 3])
+        self.assertEqual(models.Puntaje.objects.puesto(self.user3,
+                                                       etapa=self.etapa), 1)
+        self.assertIsNone(models.Puntaje.objects.puesto(self.make_user()))
+
+    def test_ranking__puestos(self):
+        self.hacer_apuestas()
+        puestos = [rank.puesto for rank in models.Puntaje.objects.ranking()]
+        self.assertEqual(puestos, [1, 1, 3])
+
+    def test_ranking__limite(self):
+        self.hacer_apuestas()
+        ranking = models.Puntaje.objects.ranking(desde=1, limite=1)
+        self.assertEqual(ranking, [('user3', 4)])
+        # comparte puesto con user2 aunque este fuera de la pagina
+        self.assertEqual(ranking[0].puesto, 1)
+        ranking = models.Puntaje.objects.ranking(desde=2, limite=5)
+        self.assertEqual(ranking, [('user1', 0)])
+        self.assertEqual(ranking[0].puesto, 3)
+
+    def test_alrededor(self):
+        self.hacer_apuestas()
+        self.assertEqual(models.Puntaje.objects.alrededor(self.user3, 1),
+                         [('user2', 4), ('user3', 4), ('user1', 0)])
+        self.assertEqual(models.Puntaje.objects.alrededor(self.user2, 1),
+                         [('user2', 4), ('user3', 4)])
+        self.assertEqual(models.Puntaje.objects.alrededor(self.user1, 1),
+                         [('user3', 4), ('user1', 0)])
+
+    def test_alrededor__sin_apuestas(self):
+        self.assertEqual(
+            models.Puntaje.objects.alrededor(self.make_user(), 5), [])
+
+    def test_alcanzables(self):
+        for username, puntos, maximo in (('user1', 10, 14),
+                                         ('user2', 5, 10),
+                                         ('user3', 5, 9),
+                                         ('user4', 0, None)):
+            models.Puntaje.objects.create(usuario=self.make_user(username),
+                                          puntos=puntos,
+                                          maximo=maximo)
+        alcanzables = models.Puntaje.objects.alcanzables(
+            ['user1', 'user2', 'user3', 'user4'])
+        self.assertEqual(alcanzables, {
+            'user1': (14, False),
+            'user2': (10, False),
+            'user3': (9, True),
+        })
+        self.assertTrue(alcanzables['user3'].eliminado)
@@ -0,0 +1,92 @@
+from unittest import mock
+
+from django.db import (
+    IntegrityError,
+    transaction,
+)
+
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    models,
+    puestos,
+    utils,
+)
+
+from . import factories
+
+
+class PuestosTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory()
+        self.user1 = self.make_user('user1')
+        self.user2 = self.make_user('user2')
+        self.user3 = self.make_user('user3')
+        self.puntuar(self.user1, 10)
+        self.puntuar(self.user2, 10)
+        self.puntuar(self.user3, 5)
+
+    def puntuar(self, usuario, puntos, etapa=None):
+        models.Puntaje.objects.update_or_create(
+            usuario=usuario, etapa=etapa, defaults={'puntos': puntos})
+
+    def test_calcular(self):
+        self.assertEqual(puestos.calcular(), {
+            self.user1.pk: 1,
+            self.user2.pk: 1,
+            self.user3.pk: 3,
+        })
+
+    def test_calcular__etapa(self):
+        self.puntuar(self.user3, 1, etapa=self.etapa)
+        self.assertEqual(puestos.calcular(self.etapa), {self.user3.pk: 1})
+
+    def test_actualizar(self):
+        puestos.actualizar()
+        self.assertEqual(puestos.cambios(['user1', 'user2', 'user3']), {})
+        self.puntuar(self.user3, 20)
+        puestos.actualizar()
+        self.assertEqual(puestos.cambios(['user1', 'user2', 'user3']), {
+            'user1': -1,
+            'user2': -1,
+            'user3': 2,
+        })
+
+    def test_actualizar__idempotente(self):
+        puestos.actualizar()
+        self.puntuar(self.user3, 20)
+        puestos.actualizar()
+        puestos.actualizar()
+        self.assertEqual(puestos.cambios(['user3']), {'user3': 2})
+
+    def test_actualizar__usuario_nuevo(self):
+        puestos.actualizar()
+        nuevo = self.make_user('nuevo')
+        self.puntuar(nuevo, 1)
+        puestos.actualizar()
+        puesto = models.Puesto.objects.get(usuario=nuevo, etapa=None)
+        self.assertEqual(puesto.puesto, 4)
+        self.assertIsNone(puesto.cambio)
+
+    def test_actualizar__solo_las_etapas_pedidas(self):
+        self.puntuar(self.user1, 1, etapa=self.etapa)
+        puestos.actualizar([self.etapa.pk])
+        self.assertEqual(
+            list(models.Puesto.objects.values_list('etapa', flat=True)),
+            [self.etapa.pk],
+        )
+
+    def test_total_unico_por_usuario(self):
+        puestos.actualizar()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            models.Puesto.objects.create(usuario=self.user1, etapa=None,
+                                         puesto=1)
+
+    def test_actualizar__bloquea_los_usuarios(self):
+        with mock.patch.object(utils, 'bloquear_usuarios',
+                               wraps=utils.bloquear_usuarios) as bloquear:
+            puestos.actualizar([None, self.etapa])
+        self.assertEqual(bloquear.call_count, 2)
+        usuarios = bloquear.call_args_list[0][0][0]
+        self.assertCountEqual(usuarios.values_list('usuario', flat=True),
+                              [self.user1.pk, self.user2.pk, self.user3.pk])
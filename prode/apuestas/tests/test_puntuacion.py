@@ -0,0 +1,211 @@
+from hypothesis import (
+    given,
+    settings,
+    strategies as st,
+)
+from hypothesis.extra.django import TestCase as HypothesisTestCase
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    constants,
+    models,
+    puntuacion,
+)
+
+from . import factories
+
+goles = st.integers(min_value=0, max_value=4)
+apuestas = st.lists(
+    st.tuples(
+        st.sampled_from((constants.EMPATE,
+                         constants.GANA_LOCAL,
+                         constants.GANA_VISITANTE)),
+        goles,
+        goles,
+    ),
+    min_size=1,
+    max_size=20,
+)
+# resultado del partido o None si no se jugo
+resultados = st.one_of(st.none(), st.tuples(goles, goles))
+
+
+def columnas(apuestas, resultado):
+    """Arma los parametros de ``calcular_puntos`` para apuestas a un partido
+    con el resultado dado.
+    """
+    ganador, goles_local, goles_visitante = zip(*apuestas)
+    partido_local, partido_visitante = resultado or (None, None)
+    cantidad = len(apuestas)
+    return (ganador, goles_local, goles_visitante,
+            [partido_local] * cantidad, [partido_visitante] * cantidad)
+
+
+class CalcularPuntosTests(HypothesisTestCase):
+    @given(apuestas, resultados)
+    def test_igual_a_puntaje(self, apuestas, resultado):
+        puntos = puntuacion.calcular_puntos(*columnas(apuestas, resultado))
+        for (ganador, goles_local, goles_visitante), puntos in zip(apuestas,
+                                                                   puntos):
+            if resultado is None:
+                # Apuesta.puntaje no esta definido para partidos sin resultado
+                self.assertEqual(puntos, 0)
+                continue
+            partido = models.Partido(goles_local=resultado[0],
+                                     goles_visitante=resultado[1])
+            apuesta = models.Apuesta(partido=partido,
+                                     ganador=ganador,
+                                     goles_local=goles_local,
+                                     goles_visitante=goles_visitante)
+            self.assertEqual(puntos, apuesta.puntaje)
+
+    def test_puntos(self):
+        puntos = puntuacion.calcular_puntos(
+            [constants.GANA_LOCAL, constants.EMPATE, constants.GANA_LOCAL,
+             constants.EMPATE],
+            [2, 2, 0, 1],
+            [1, 1, 0, 1],
+            [2, 2, 2, None],
+            [1, 1, 1, None],
+        )
+        self.assertEqual(puntos.tolist(), [4, 3, 1, 0])
+
+    def test_puntos_redefinidos(self):
+        puntos = puntuacion.calcular_puntos(
+            [constants.GANA_LOCAL, constants.GANA_LOCAL],
+            [2, 2],
+            [1, 1],
+            [2, 2],
+            [1, 1],
+            puntos_ganador=[2, None],
+            puntos_goles=[6, None],
+        )
+        self.assertEqual(puntos.tolist(), [8, 4])
+
+
+class CalcularPuntosSQLTests(HypothesisTestCase):
+    @settings(max_examples=25, deadline=None)
+    @given(apuestas, resultados)
+    def test_igual_a_sql(self, apuestas, resultado):
+        partido_local, partido_visitante = resultado or (None, None)
+        partido = factories.PartidoFactory(goles_local=partido_local,
+                                           goles_visitante=partido_visitante)
+        for ganador, goles_local, goles_visitante in apuestas:
+            factories.ApuestaFactory(partido=partido,
+                                     ganador=ganador,
+                                     goles_local=goles_local,
+                                     goles_visitante=goles_visitante)
+        esperado = list(
+            models.Apuesta.objects
+            .filter(partido=partido)
+            .annotate(puntos=puntuacion.REGLA.expresion())
+            .order_by('pk')
+            .values_list('puntos', flat=True)
+        )
+        puntos = puntuacion.calcular_puntos(*columnas(apuestas, resultado))
+        self.assertEqual(puntos.tolist(), esperado)
+
+
+class MaximoTests(HypothesisTestCase):
+    @settings(max_examples=25, deadline=None)
+    @given(apuestas, st.tuples(goles, goles))
+    def test_maximo(self, apuestas, resultado):
+        partido = factories.PartidoFactory(goles_local=None,
+                                           goles_visitante=None)
+        for ganador, goles_local, goles_visitante in apuestas:
+            factories.ApuestaFactory(partido=partido,
+                                     ganador=ganador,
+                                     goles_local=goles_local,
+                                     goles_visitante=goles_visitante)
+        queryset = (models.Apuesta.objects
+                    .filter(partido=partido)
+                    .select_related('partido__etapa')
+                    .order_by('pk'))
+        maximos = list(queryset
+                       .annotate(maximo=puntuacion.REGLA.expresion_maxima())
+                       .values_list('maximo', flat=True))
+        partido.goles_local, partido.goles_visitante = resultado
+        for apuesta, maximo in zip(queryset, maximos):
+            # ningun resultado da mas puntos que el maximo
+            apuesta.partido = partido
+            self.assertLessEqual(apuesta.puntaje, maximo)
+            # y acertando el resultado apostado o solo el ganador se llega
+            partido.goles_local = apuesta.goles_local
+            partido.goles_visitante = apuesta.goles_visitante
+            alcanzado = apuesta.puntaje
+            self.assertIn(maximo, (alcanzado,
+                                   constants.PUNTOS_GANADOR))
+            partido.goles_local, partido.goles_visitante = resultado
+
+    def test_maximo_etapa(self):
+        apuesta = factories.ApuestaFactory(
+            partido__etapa__puntos_ganador=2,
+            partido__etapa__puntos_goles=5,
+            ganador=constants.EMPATE,
+            goles_local=1,
+            goles_visitante=0,
+        )
+
+        def maximo():
+            return (models.Apuesta.objects
+                    .annotate(maximo=puntuacion.REGLA.expresion_maxima())
+                    .get(pk=apuesta.pk)
+                    .maximo)
+
+        # el ganador apostado no coincide con los goles apostados
+        self.assertEqual(maximo(), 5)
+        apuesta.ganador = constants.GANA_LOCAL
+        apuesta.save()
+        self.assertEqual(maximo(), 7)
+
+
+class ReglaPuntajeTests(TestCase):
+    def get_apuestas(self, **kwargs):
+        """Crea una etapa con un partido 2-1 y una apuesta que acierta todo
+        y otra que solo acierta el ganador."""
+        etapa = factories.EtapaFactory(**kwargs)
+        partido = factories.PartidoFactory(etapa=etapa,
+                                           goles_local=2,
+                                           goles_visitante=1)
+        for goles_local in (2, 3):
+            factories.ApuestaFactory(partido=partido,
+                                     ganador=constants.GANA_LOCAL,
+                                     goles_local=goles_local,
+                                     goles_visitante=1)
+        return models.Apuesta.objects.filter(partido=partido).order_by('pk')
+
+    def puntos(self, apuestas):
+        """Obtiene los puntos por cada forma de calcularlos."""
+        sql = list(apuestas.annotate(puntos=puntuacion.REGLA.expresion())
+                   .values_list('puntos', flat=True))
+        vectorizado = puntuacion.calcular_puntos(
+            *zip(*((apuesta.ganador, apuesta.goles_local,
+                    apuesta.goles_visitante, apuesta.partido.goles_local,
+                    apuesta.partido.goles_visitante)
+                   for apuesta in apuestas)),
+            **{campo: [getattr(apuesta.partido.etapa, campo)
+                       for apuesta in apuestas]
+               for campo in puntuacion.REGLA.campos_etapa}
+        ).tolist()
+        instancia = [apuesta.puntaje for apuesta in apuestas]
+        return sql, vectorizado, instancia
+
+    def test_puntos_por_defecto(self):
+        apuestas = self.get_apuestas()
+        for puntos in self.puntos(apuestas):
+            self.assertEqual(puntos, [4, 1])
+
+    def test_puntos_redefinidos_por_etapa(self):
+        apuestas = self.get_apuestas(puntos_ganador=2, puntos_goles=6)
+        for puntos in self.puntos(apuestas):
+            self.assertEqual(puntos, [8, 2])
+
+    def test_cambiar_puntos_etapa(self):
+        apuestas = self.get_apuestas()
+        etapa = apuestas[0].partido.etapa
+        usuario = apuestas[0].usuario
+        self.assertEqual(usuario.puntajes.puntos(etapa), 4)
+        etapa.puntos_goles = 10
+        etapa.save()
+        self.assertEqual(usuario.puntajes.puntos(etapa), 11)
+        self.assertEqual(usuario.puntaje, 11)
@@ -0,0 +1,70 @@
+import re
+
+from crispy_forms.templatetags.crispy_forms_filters import as_crispy_form
+from django.utils import translation
+
+from test_plus import TestCase
+
+from prode.apuestas import (
+    constants,
+    forms,
+    renderizado,
+)
+
+from . import factories
+
+
+def crispy(form):
+    """Renderiza con crispy, sin los espacios de mas en los atributos
+    ``class``."""
+    return re.sub(r'class="([^"]*)"',
+                  lambda match: f'class="{" ".join(match.group(1).split())}"',
+                  as_crispy_form(form))
+
+
+class RenderizadoTests(TestCase):
+    def setUp(self):
+        self.user = self.make_user()
+        self.partido = factories.PartidoFactory(local='AR', visitante='BR')
+
+    def form(self, **kwargs):
+        # como en el formset de la pantalla de apuestas
+        return forms.ApuestaForm(usuario=self.user, partido=self.partido,
+                                 prefix='form-3',
+                                 use_required_attribute=False, **kwargs)
+
+    def test_igual_a_crispy(self):
+        apuesta = factories.ApuestaFactory(usuario=self.user,
+                                           partido=self.partido,
+                                           ganador=constants.GANA_VISITANTE,
+                                           goles_local=0, goles_visitante=2)
+        form = self.form(instance=apuesta)
+        self.assertHTMLEqual(renderizado.campos(form), crispy(form))
+
+    def test_igual_a_crispy__sin_apuesta(self):
+        form = self.form()
+        self.assertHTMLEqual(renderizado.campos(form), crispy(form))
+
+    def test_titulo(self):
+        self.assertEqual(renderizado.titulo(self.partido),
+                         'Argentina 🇦🇷 - Brasil 🇧🇷')
+
+    def test_etiquetas_por_idioma(self):
+        with translation.override('en'):
+            self.assertEqual(renderizado.etiquetas(self.partido)['visitante'],
+                             'Brazil')
+        with translation.override('es'):
+            self.assertEqual(renderizado.etiquetas(self.partido)['visitante'],
+                             'Brasil')
+
+    def test_labels_del_form(self):
+        form = self.form()
+        self.assertEqual(form.fields['goles_local'].label, 'Argentina')
+        self.assertIn((constants.GANA_VISITANTE, 'Gana Brasil'),
+                      form.fields['ganador'].choices)
+
+    def test_valores_escapados(self):
+        form = self.form(data={'form-3-ganador': constants.EMPATE,
+                               'form-3-goles_local': '"><b>',
+                               'form-3-goles_visitante': '1'})
+        self.assertNotIn('"><b>', renderizado.campos(form))
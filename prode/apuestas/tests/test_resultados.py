@@ -0,0 +1,151 @@
+import datetime
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    constants,
+    models,
+    resultados,
+    utils,
+)
+
+from . import factories
+
+
+class ResultadosTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(
+            vencimiento=timezone.now() - datetime.timedelta(days=1),
+            puntos_goles=5)
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                goles_local=2,
+                                                goles_visitante=1)
+        self.otro = factories.PartidoFactory(etapa=self.etapa,
+                                             goles_local=0,
+                                             goles_visitante=0)
+        self.user1 = self.make_user('user1')
+        self.user2 = self.make_user('user2')
+        self.user3 = self.make_user('user3')
+        for usuario, ganador, local, visitante in (
+                (self.user1, constants.GANA_LOCAL, 2, 1),
+                (self.user2, constants.GANA_LOCAL, 3, 1),
+                (self.user3, constants.EMPATE, 0, 0)):
+            factories.ApuestaFactory(partido=self.partido, usuario=usuario,
+                                     ganador=ganador, goles_local=local,
+                                     goles_visitante=visitante)
+            factories.ApuestaFactory(partido=self.otro, usuario=usuario,
+                                     ganador=constants.EMPATE,
+                                     goles_local=0, goles_visitante=0)
+
+    def puntajes(self):
+        return list(models.Puntaje.objects
+                    .order_by('usuario', 'etapa')
+                    .values_list('usuario', 'etapa', 'puntos', 'maximo'))
+
+    def recalculados(self):
+        utils.recalcular_puntajes()
+        return self.puntajes()
+
+    def corregir(self, partido, goles_local, goles_visitante):
+        partido.goles_local = goles_local
+        partido.goles_visitante = goles_visitante
+        return resultados.guardar([partido])
+
+    def test_guardar__registra_cambios(self):
+        self.partido.goles_local = 3
+        cambios = resultados.guardar([self.partido, self.otro])
+        self.assertEqual(len(cambios), 1)
+        cambio = models.CambioResultado.objects.get()
+        self.assertEqual(
+            (cambio.partido, cambio.goles_local_anterior,
+             cambio.goles_visitante_anterior, cambio.goles_local,
+             cambio.goles_visitante, cambio.aplicado),
+            (self.partido, 2, 1, 3, 1, True),
+        )
+        self.partido.refresh_from_db()
+        self.assertEqual(self.partido.goles_local, 3)
+
+    def test_guardar__un_solo_update(self):
+        partidos = factories.PartidoFactory.create_batch(
+            5, etapa=self.etapa, goles_local=None, goles_visitante=None)
+        for goles, partido in enumerate(partidos):
+            partido.goles_local, partido.goles_visitante = goles, 0
+        with CaptureQueriesContext(connection) as consultas:
+            resultados.guardar(partidos)
+        updates = [consulta['sql'] for consulta in consultas
+                   if consulta['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(
+            list(models.Partido.objects
+                 .filter(pk__in=[partido.pk for partido in partidos])
+                 .order_by('goles_local')
+                 .values_list('goles_local', flat=True)),
+            [0, 1, 2, 3, 4],
+        )
+
+    def test_guardar__sin_cambios(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.assertEqual(resultados.guardar([self.partido]), [])
+        self.assertFalse(any(consulta['sql'].startswith(('UPDATE', 'INSERT'))
+                             for consulta in consultas))
+
+    def test_guardar__correccion_igual_a_recalcular(self):
+        self.corregir(self.partido, 3, 1)
+        self.assertEqual(self.puntajes(), self.recalculados())
+        self.assertEqual(self.user2.puntajes.puntos(self.etapa), 6 + 5 + 1)
+        self.assertEqual(resultados.aplicar([self.partido]), [])
+
+    def test_guardar__varias_correcciones(self):
+        self.corregir(self.partido, 0, 0)
+        self.corregir(self.partido, 1, 1)
+        self.corregir(self.otro, 1, 0)
+        self.assertEqual(self.puntajes(), self.recalculados())
+
+    def test_guardar__correccion_solo_lee_apuestas_del_partido(self):
+        with CaptureQueriesContext(connection) as consultas:
+            self.corregir(self.partido, 3, 1)
+        apuestas = [consulta['sql'] for consulta in consultas
+                    if consulta['sql'].startswith('SELECT "apuestas_apuesta"')]
+        self.assertEqual(len(apuestas), 1)
+        self.assertIn('"apuestas_apuesta"."partido_id" IN', apuestas[0])
+
+    def test_guardar__correccion_y_recalculo(self):
+        self.corregir(self.partido, 3, 1)
+        # una apuesta nueva recalcula el total de user2 antes de que corra
+        # la tarea, que no debe volver a sumar la correccion
+        factories.ApuestaFactory(usuario=self.user2,
+                                 partido=factories.PartidoFactory(
+                                     goles_local=1, goles_visitante=0),
+                                 ganador=constants.GANA_LOCAL,
+                                 goles_local=1, goles_visitante=0)
+        resultados.aplicar([self.partido])
+        self.assertEqual(self.user2.puntajes.puntos(), 12 + 4)
+        self.assertEqual(self.puntajes(), self.recalculados())
+
+    def test_aplicar__primer_resultado(self):
+        partido = factories.PartidoFactory(etapa=self.etapa,
+                                           goles_local=None,
+                                           goles_visitante=None)
+        factories.ApuestaFactory(partido=partido, usuario=self.user1,
+                                 ganador=constants.GANA_VISITANTE,
+                                 goles_local=0, goles_visitante=1)
+        self.corregir(partido, 0, 1)
+        # la correccion queda pendiente junto al primer resultado
+        self.corregir(partido, 0, 2)
+        self.assertFalse(models.CambioResultado.objects
+                         .filter(partido=partido, aplicado=True).exists())
+        self.assertEqual(len(resultados.aplicar([partido])), 2)
+        self.assertEqual(self.puntajes(), self.recalculados())
+
+    def test_aplicar__idempotente(self):
+        self.otro.goles_local = self.otro.goles_visitante = None
+        resultados.guardar([self.otro])
+        self.assertEqual(len(resultados.aplicar([self.otro])), 1)
+        antes = self.puntajes()
+        self.assertEqual(resultados.aplicar([self.otro]), [])
+        self.assertEqual(self.puntajes(), antes)
+        self.assertTrue(models.CambioResultado.objects.get().aplicado)
@@ -0,0 +1,188 @@
+import datetime
+from unittest import mock
+
+import numpy as np
+from django.db import connection
+from django.utils import timezone
+
+from test_plus import TestCase
+
+from prode.apuestas import (
+    constants,
+    models,
+    simulacion,
+)
+
+from . import factories
+
+
+class ApuestasPartidoTests(TestCase):
+    def setUp(self):
+        self.partido = simulacion.ApuestasPartido(
+            [0, 1, 2],
+            [constants.GANA_LOCAL, constants.GANA_LOCAL, constants.EMPATE],
+            [1, 1, 0],
+            [0, 0, 0],
+        )
+
+    def test_resultados(self):
+        goles_local, goles_visitante = self.partido.resultados()
+        resultados = set(zip(goles_local.tolist(), goles_visitante.tolist()))
+        expected = {(0, 0), (1, 0)} | set(simulacion.OTROS.values())
+        self.assertEqual(resultados, expected)
+
+    def test_probabilidades_uniforme(self):
+        resultados = self.partido.resultados()
+        probabilidades = self.partido.probabilidades(*resultados)
+        signos = np.sign(resultados[0] - resultados[1])
+        self.assertAlmostEqual(probabilidades.sum(), 1)
+        for signo in (1, 0, -1):
+            self.assertAlmostEqual(probabilidades[signos == signo].sum(), 1 / 3)
+
+    def test_probabilidades_apuestas(self):
+        resultados = self.partido.resultados()
+        probabilidades = self.partido.probabilidades(*resultados,
+                                                     simulacion.APUESTAS)
+        signos = np.sign(resultados[0] - resultados[1])
+        self.assertAlmostEqual(probabilidades.sum(), 1)
+        # 2 apuestas al local, 1 al empate, 0 al visitante (mas uno cada uno)
+        self.assertAlmostEqual(probabilidades[signos == 1].sum(), 3 / 6)
+        self.assertAlmostEqual(probabilidades[signos == 0].sum(), 2 / 6)
+        self.assertAlmostEqual(probabilidades[signos == -1].sum(), 1 / 6)
+
+    def test_metodo_desconocido(self):
+        with self.assertRaises(ValueError):
+            self.partido.probabilidades(*self.partido.resultados(), 'otro')
+
+    def test_puntos_posibles(self):
+        goles_local, goles_visitante = np.array([1, 0]), np.array([0, 0])
+        puntos = self.partido.puntos_posibles(goles_local, goles_visitante)
+        expected = [[4, 0], [4, 0], [0, 4]]
+        self.assertEqual(puntos.tolist(), expected)
+
+    def test_puntos_posibles_etapa(self):
+        partido = simulacion.ApuestasPartido([0], [constants.GANA_LOCAL],
+                                             [1], [0], puntos_ganador=2)
+        puntos = partido.puntos_posibles(np.array([1, 2]), np.array([0, 0]))
+        self.assertEqual(puntos.tolist(), [[5, 2]])
+
+
+class SimularTests(TestCase):
+    def test_sin_partidos_pendientes(self):
+        primero, entre_primeros = simulacion.simular([10, 5, 5], [],
+                                                     cantidad=10, puestos=2)
+        self.assertEqual(primero.tolist(), [1, 0, 0])
+        self.assertEqual(entre_primeros.tolist(), [1, 1, 1])
+
+    def test_sin_usuarios(self):
+        primero, entre_primeros = simulacion.simular([], [])
+        self.assertEqual(len(primero), 0)
+        self.assertEqual(len(entre_primeros), 0)
+
+    def test_ventaja_inalcanzable(self):
+        partido = simulacion.ApuestasPartido(
+            [0, 1], [constants.GANA_LOCAL, constants.GANA_VISITANTE],
+            [1, 0], [0, 1])
+        primero, _ = simulacion.simular([10, 0], [partido], cantidad=100,
+                                        puestos=1, semilla=1)
+        self.assertEqual(primero.tolist(), [1, 0])
+
+    def test_probabilidad(self):
+        # empatados antes del ultimo partido: cada uno gana si acierta el
+        # ganador y ambos terminan primeros si es empate
+        partido = simulacion.ApuestasPartido(
+            [0, 1], [constants.GANA_LOCAL, constants.GANA_VISITANTE],
+            [1, 0], [0, 1])
+        primero, entre_primeros = simulacion.simular(
+            [3, 3, 0], [partido], cantidad=20000, puestos=1, semilla=1)
+        self.assertAlmostEqual(primero[0], 2 / 3, delta=0.02)
+        self.assertAlmostEqual(primero[1], 2 / 3, delta=0.02)
+        self.assertEqual(primero[2], 0)
+        self.assertEqual(entre_primeros.tolist(), primero.tolist())
+
+    def test_bloques(self):
+        partido = simulacion.ApuestasPartido(
+            [0, 1], [constants.GANA_LOCAL, constants.GANA_VISITANTE],
+            [1, 0], [0, 1])
+        resultado = simulacion.simular([3, 3], [partido], cantidad=1000,
+                                       semilla=1)
+        with mock.patch.object(simulacion, 'TAMANIO_BLOQUE', 10):
+            en_bloques = simulacion.simular([3, 3], [partido], cantidad=1000,
+                                            semilla=1)
+        self.assertEqual(len(en_bloques[0]), 2)
+        self.assertAlmostEqual(en_bloques[0][0], resultado[0][0], delta=0.1)
+
+
+class SimularRankingTests(TestCase):
+    def setUp(self):
+        self.user1 = self.make_user('user1')
+        self.user2 = self.make_user('user2')
+        terminado = factories.PartidoFactory(goles_local=1, goles_visitante=0)
+        factories.ApuestaFactory(usuario=self.user1, partido=terminado,
+                                 goles_local=1, goles_visitante=0,
+                                 ganador=constants.GANA_LOCAL)
+        factories.ApuestaFactory(usuario=self.user2, partido=terminado,
+                                 goles_local=2, goles_visitante=2,
+                                 ganador=constants.EMPATE)
+        self.pendiente = factories.PartidoFactory(goles_local=None,
+                                                  goles_visitante=None)
+        factories.ApuestaFactory(usuario=self.user2, partido=self.pendiente,
+                                 goles_local=1, goles_visitante=0,
+                                 ganador=constants.GANA_LOCAL)
+
+    def test_guarda_probabilidades(self):
+        cantidad = simulacion.simular_ranking(cantidad=1000, puestos=1,
+                                              semilla=1)
+        self.assertEqual(cantidad, 2)
+        probabilidad1 = models.Probabilidad.objects.get(usuario=self.user1)
+        probabilidad2 = models.Probabilidad.objects.get(usuario=self.user2)
+        # user2 alcanza a user1 solo si acierta el resultado exacto
+        self.assertEqual(probabilidad1.primero, 1)
+        self.assertLess(probabilidad2.primero, 0.5)
+        self.assertGreater(probabilidad2.primero, 0)
+        self.assertEqual(probabilidad1.simulaciones, 1000)
+
+    def test_reemplaza_probabilidades(self):
+        simulacion.simular_ranking(cantidad=10)
+        simulacion.simular_ranking(cantidad=10)
+        self.assertEqual(models.Probabilidad.objects.count(), 2)
+
+    def cargar_resultado(self, goles_local, goles_visitante):
+        admin = self.make_user('admin')
+        admin.is_superuser = True
+        admin.save()
+        models.Partido.objects.filter(pk=self.pendiente.pk).update(
+            fecha=timezone.now() - datetime.timedelta(hours=2))
+        data = {
+            'partidos-TOTAL_FORMS': 1,
+            'partidos-INITIAL_FORMS': 1,
+            'partidos-0-id': self.pendiente.pk,
+            'partidos-0-goles_local': goles_local,
+            'partidos-0-goles_visitante': goles_visitante,
+        }
+        with self.login(admin):
+            self.post('apuestas:cargar_resultados',
+                      slug=self.pendiente.etapa.slug, data=data)
+        # TestCase no confirma la transaccion, ejecuto lo pendiente
+        for _, callback in connection.run_on_commit:
+            callback()
+
+    def test_cargar_resultados_simula(self):
+        self.cargar_resultado(1, 0)
+        # la simulacion corre al final, con los puntajes ya actualizados
+        probabilidades = dict(models.Probabilidad.objects
+                              .values_list('usuario__username', 'primero'))
+        self.assertEqual(probabilidades, {'user1': 1, 'user2': 1})
+
+    def test_cargar_resultados_sin_cambios_no_simula(self):
+        with mock.patch('prode.apuestas.simulacion.simular_ranking') as simular:
+            self.cargar_resultado('', '')
+        simular.assert_not_called()
+
+    def test_ranking_muestra_probabilidades(self):
+        simulacion.simular_ranking(cantidad=10)
+        with self.login(self.user1):
+            self.get('apuestas:ranking')
+        self.assertEqual(set(self.context['probabilidades']),
+                         {'user1', 'user2'})
+        self.assertContains(self.last_response, 'Chances de ganar')
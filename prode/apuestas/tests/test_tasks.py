@@ -0,0 +1,141 @@
+import datetime
+from unittest import mock
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from test_plus.test import TestCase
+
+from prode.apuestas import (
+    constants,
+    models,
+    resultados,
+    tasks,
+)
+
+from . import factories
+
+
+class ProcesarResultadosTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(
+            vencimiento=timezone.now() - datetime.timedelta(days=1))
+        self.partido = factories.PartidoFactory(
+            etapa=self.etapa,
+            fecha=timezone.now() - datetime.timedelta(hours=2),
+            goles_local=None,
+            goles_visitante=None,
+        )
+        self.user1 = self.make_user('user1')
+        self.user2 = self.make_user('user2')
+        factories.ApuestaFactory(partido=self.partido, usuario=self.user1,
+                                 ganador=constants.EMPATE,
+                                 goles_local=0, goles_visitante=0)
+        factories.ApuestaFactory(partido=self.partido, usuario=self.user2,
+                                 ganador=constants.GANA_LOCAL,
+                                 goles_local=2, goles_visitante=1)
+        self.admin = self.make_user('admin')
+        self.admin.is_superuser = True
+        self.admin.save()
+
+    def cargar_resultado(self, goles_local, goles_visitante):
+        data = {
+            'partidos-TOTAL_FORMS': 1,
+            'partidos-INITIAL_FORMS': 1,
+            'partidos-0-id': self.partido.pk,
+            'partidos-0-goles_local': goles_local,
+            'partidos-0-goles_visitante': goles_visitante,
+        }
+        with self.login(self.admin):
+            self.post('apuestas:cargar_resultados', slug=self.etapa.slug,
+                      data=data)
+        # TestCase no confirma la transaccion, ejecuto lo pendiente
+        for _, callback in connection.run_on_commit:
+            callback()
+
+    def test_pipeline(self):
+        tasks.procesar_resultados([self.partido.pk])
+        self.cargar_resultado(2, 1)
+        self.assertEqual(self.user2.puntajes.puntos(self.etapa), 4)
+        # empatados en el primer puesto, user1 baja al segundo
+        self.assertEqual(self.user2.puestos.get(etapa=None).puesto, 1)
+        self.assertEqual(self.user1.puestos.get(etapa=None).cambio, -1)
+        self.assertEqual(
+            models.PuntosObtenidos.objects
+            .filter(partido=self.partido)
+            .values_list('puntos', 'cantidad')
+            .order_by('puntos')
+            .first(),
+            (0, 1),
+        )
+
+    def test_calienta_el_detalle(self):
+        self.cargar_resultado(2, 1)
+        with self.login(self.user1):
+            with CaptureQueriesContext(connection) as consultas:
+                self.get('apuestas:detail', slug=self.etapa.slug)
+        self.assertContains(self.last_response, '4 puntos: 1')
+        self.assertFalse(any('"apuestas_puntaje"' in consulta['sql'] or
+                             '"apuestas_estadisticapartido"' in consulta['sql']
+                             for consulta in consultas))
+
+    def test_error_al_encolar(self):
+        with mock.patch.object(tasks, 'procesar_resultados',
+                               side_effect=ConnectionError), \
+                mock.patch('prode.apuestas.views.messages.warning') as aviso, \
+                self.assertLogs('prode.apuestas.tasks', 'ERROR'):
+            self.cargar_resultado(2, 1)
+        # el resultado quedo guardado, se procesa luego
+        self.assertEqual(self.last_response.status_code, 302)
+        aviso.assert_called_once()
+        self.partido.refresh_from_db()
+        self.assertEqual(self.partido.goles_local, 2)
+        cambio = models.CambioResultado.objects.get(partido=self.partido)
+        self.assertFalse(cambio.aplicado)
+        self.assertFalse(self.user2.puntajes.get(etapa=self.etapa).puntos)
+
+    def test_procesar_pendientes(self):
+        with mock.patch.object(tasks, 'procesar_resultados',
+                               side_effect=ConnectionError), \
+                self.assertLogs('prode.apuestas.tasks', 'ERROR'):
+            self.cargar_resultado(2, 1)
+        # los cambios recientes todavia se pueden estar procesando
+        tasks.procesar_pendientes()
+        self.assertFalse(self.user2.puntajes.get(etapa=self.etapa).puntos)
+        models.CambioResultado.objects.update(
+            fecha=timezone.now() - tasks.PENDIENTES_DEMORA)
+        tasks.procesar_pendientes()
+        self.assertEqual(self.user2.puntajes.puntos(self.etapa), 4)
+        self.assertTrue(models.CambioResultado.objects.get().aplicado)
+        self.assertEqual(self.user1.puestos.get(etapa=None).puesto, 2)
+
+    def test_sin_cambios_no_encola(self):
+        pendientes = list(connection.run_on_commit)
+        with self.login(self.admin):
+            self.post('apuestas:cargar_resultados', slug=self.etapa.slug,
+                      data={'partidos-TOTAL_FORMS': 0,
+                            'partidos-INITIAL_FORMS': 0})
+        self.assertEqual(connection.run_on_commit, pendientes)
+
+    def test_pasos_idempotentes(self):
+        self.partido.goles_local, self.partido.goles_visitante = 2, 1
+        resultados.guardar([self.partido])
+        ids = [self.partido.pk]
+
+        def estado():
+            return (
+                list(models.Puntaje.objects.order_by('usuario', 'etapa')
+                     .values_list('usuario', 'etapa', 'puntos')),
+                list(models.Puesto.objects.order_by('usuario', 'etapa')
+                     .values_list('usuario', 'etapa', 'puesto', 'anterior')),
+                list(models.PuntosObtenidos.objects.order_by('puntos')
+                     .values_list('puntos', 'cantidad')),
+            )
+
+        for paso in tasks.PASOS:
+            paso(ids)
+        antes = estado()
+        for paso in tasks.PASOS:
+            self.assertIsInstance(paso(ids), float)
+        self.assertEqual(estado(), antes)
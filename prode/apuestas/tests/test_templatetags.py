@@ -27,3 +27,9 @@ class GetEtapaTests(TestCase):
         etapas = apuestas.get_etapas(user)
         self.assertIn(publica, etapas)
         self.assertIn(no_publica, etapas)
+
+
+class AbsolutoTests(TestCase):
+    def test_absoluto(self):
+        self.assertEqual(apuestas.absoluto(-2), 2)
+        self.assertEqual(apuestas.absoluto(3), 3)
@@ -52,6 +52,16 @@ class ApuestasURLSTests(TestCase):
             '/cuartos/cargar-resultados/'
         )
 
+    def test_resolve_importar_resultados(self):
+        self.assertEqual(
+            resolve('/resultados/importar/').view_name,
+            'apuestas:importar_resultados'
+        )
+
+    def test_reverse_importar_resultados(self):
+        self.assertEqual(reverse('apuestas:importar_resultados'),
+                         '/resultados/importar/')
+
     def test_resolve_ranking(self):
         self.assertEqual(
             resolve('/ranking/').view_name, 'apuestas:ranking'
@@ -61,3 +71,27 @@ class ApuestasURLSTests(TestCase):
         self.assertEqual(
             reverse('apuestas:ranking'), '/ranking/'
         )
+
+    def test_resolve_apostar_partido(self):
+        self.assertEqual(
+            resolve('/partidos/1/apostar/').view_name,
+            'apuestas:apostar_partido'
+        )
+
+    def test_reverse_apostar_partido(self):
+        self.assertEqual(
+            reverse('apuestas:apostar_partido', kwargs={'pk': 1}),
+            '/partidos/1/apostar/'
+        )
+
+    def test_resolve_apuestas_partido(self):
+        self.assertEqual(
+            resolve('/partidos/1/apuestas/').view_name,
+            'apuestas:apuestas_partido'
+        )
+
+    def test_reverse_apuestas_partido(self):
+        self.assertEqual(
+            reverse('apuestas:apuestas_partido', kwargs={'pk': 1}),
+            '/partidos/1/apuestas/'
+        )
@@ -1,13 +1,34 @@
+import datetime
+
+from unittest import mock
+
+from django.db import (
+    IntegrityError,
+    connection,
+    transaction,
+)
+from django.core.cache import cache
+from django.utils import timezone
+
 from test_plus import TestCase
 
 from prode.apuestas import (
     constants,
+    models,
+    resultados,
+    tasks,
     utils,
 )
 
 from . import factories
 
 class UtilsTests(TestCase):
+    def confirmar(self):
+        """TestCase no confirma la transaccion, ejecuto lo pendiente."""
+        while connection.run_on_commit:
+            _, callback = connection.run_on_commit.pop(0)
+            callback()
+
     def hacer_apuestas(self):
         """Hace apuestas
 
@@ -44,3 +65,165 @@ class UtilsTests(TestCase):
         self.assertEqual(utils.get_ranking(self.user2), 1)
         self.assertEqual(utils.get_ranking(self.user3), 2)
         self.assertEqual(utils.get_ranking(self.user1), 3)
+
+    def test_actualizar_puntajes(self):
+        self.hacer_apuestas()
+        partido = models.Partido.objects.first()
+        # actualizo sin pasar por save para que no se recalcule solo
+        models.Partido.objects.filter(pk=partido.pk).update(goles_local=0,
+                                                            goles_visitante=1)
+        utils.actualizar_puntajes([partido])
+        # user1 y user3 aciertan los goles en el partido corregido
+        self.assertEqual(self.user1.puntajes.puntos(), 3)
+        self.assertEqual(self.user3.puntajes.puntos(), 12)
+        self.assertEqual(self.user2.puntajes.puntos(), 27)
+
+    def test_recalcular_puntajes(self):
+        self.hacer_apuestas()
+        models.Puntaje.objects.all().delete()
+        utils.recalcular_puntajes()
+        self.assertEqual(models.Puntaje.objects.ranking(), [
+            ('user2', 30),
+            ('user3', 10),
+            ('user1', 0),
+        ])
+
+    def test_recalcular_puntajes__maximo(self):
+        ayer = timezone.now() - datetime.timedelta(days=1)
+        cerrada = factories.EtapaFactory(vencimiento=ayer)
+        abierta = factories.EtapaFactory()
+        terminado = factories.PartidoFactory(etapa=cerrada,
+                                             fecha=ayer,
+                                             goles_local=1,
+                                             goles_visitante=0)
+        pendiente = factories.PartidoFactory(etapa=cerrada,
+                                             fecha=ayer,
+                                             goles_local=None,
+                                             goles_visitante=None)
+        abierto = factories.PartidoFactory(etapa=abierta,
+                                           goles_local=None,
+                                           goles_visitante=None)
+        user1 = self.make_user('user1')
+        user2 = self.make_user('user2')
+        apuestas = (
+            # user1: 4 puntos, puede sumar 4 en el pendiente
+            (user1, terminado, constants.GANA_LOCAL, 1, 0),
+            (user1, pendiente, constants.GANA_LOCAL, 2, 0),
+            # user2: 0 puntos, el ganador apostado no coincide con los goles
+            # asi que puede sumar 3 en el pendiente
+            (user2, terminado, constants.EMPATE, 0, 0),
+            (user2, pendiente, constants.EMPATE, 1, 0),
+            (user2, abierto, constants.GANA_VISITANTE, 0, 1),
+        )
+        for usuario, partido, ganador, goles_local, goles_visitante in apuestas:
+            factories.ApuestaFactory(usuario=usuario,
+                                     partido=partido,
+                                     ganador=ganador,
+                                     goles_local=goles_local,
+                                     goles_visitante=goles_visitante)
+        utils.recalcular_puntajes()
+        maximos = dict(models.Puntaje.objects
+                       .filter(etapa__isnull=True)
+                       .values_list('usuario__username', 'maximo'))
+        # todos pueden cambiar la apuesta del partido abierto y sumar 4
+        self.assertEqual(maximos, {'user1': 12, 'user2': 7})
+        self.assertEqual(user2.puntajes.get(etapa=abierta).maximo, 4)
+        self.assertEqual(user2.puntajes.get(etapa=cerrada).maximo, 3)
+
+    def test_total_unico_por_usuario(self):
+        self.hacer_apuestas()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            models.Puntaje.objects.create(usuario=self.user1, etapa=None)
+
+    def test_apuesta_borrada(self):
+        self.hacer_apuestas()
+        self.user2.apuestas.first().delete()
+        self.confirmar()
+        self.assertEqual(self.user2.puntajes.puntos(), 27)
+        self.user3.apuestas.all().delete()
+        self.confirmar()
+        self.assertFalse(self.user3.puntajes.exists())
+
+    def test_apuestas_borradas__un_solo_recalculo(self):
+        self.hacer_apuestas()
+        self.confirmar()
+        with mock.patch.object(utils, 'recalcular_puntajes') as recalcular:
+            models.Apuesta.objects.filter(
+                usuario__in=[self.user1, self.user3]).delete()
+            recalcular.assert_not_called()
+            self.confirmar()
+        recalcular.assert_called_once_with(
+            usuarios=sorted([self.user1.pk, self.user3.pk]))
+
+    def test_partido_borrado(self):
+        self.hacer_apuestas()
+        abierto = factories.PartidoFactory(goles_local=None,
+                                           goles_visitante=None)
+        utils.recalcular_puntajes()
+        self.assertEqual(self.user2.puntajes.get(etapa=None).maximo, 34)
+        models.Partido.objects.exclude(pk=abierto.pk).first().delete()
+        self.confirmar()
+        self.assertEqual(self.user2.puntajes.puntos(), 27)
+        with mock.patch.object(utils, 'recalcular_puntajes') as recalcular:
+            abierto.delete()
+            self.confirmar()
+        # nadie aposto en el partido, solo cambian los maximos
+        recalcular.assert_not_called()
+        self.assertEqual(self.user2.puntajes.get(etapa=None).maximo, 27)
+
+
+class ActualizarMaximosTests(TestCase):
+    def setUp(self):
+        cache.delete(tasks.CIERRE_KEY)
+        ayer = timezone.now() - datetime.timedelta(days=1)
+        self.etapa = factories.EtapaFactory()
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                goles_local=None,
+                                                goles_visitante=None)
+        terminado = factories.PartidoFactory(etapa__vencimiento=ayer,
+                                             fecha=ayer,
+                                             goles_local=1,
+                                             goles_visitante=0)
+        self.user1 = self.make_user('user1')
+        self.user2 = self.make_user('user2')
+        # user1 apuesta en el partido abierto, user2 solo en el terminado y
+        # no suma puntos
+        factories.ApuestaFactory(usuario=self.user1, partido=self.partido,
+                                 ganador=constants.GANA_LOCAL,
+                                 goles_local=1, goles_visitante=0)
+        factories.ApuestaFactory(usuario=self.user2, partido=terminado,
+                                 ganador=constants.EMPATE,
+                                 goles_local=0, goles_visitante=0)
+
+    def maximos(self):
+        return list(models.Puntaje.objects
+                    .order_by('usuario', 'etapa')
+                    .values_list('usuario', 'etapa', 'maximo'))
+
+    def recalculados(self):
+        utils.recalcular_puntajes()
+        return self.maximos()
+
+    def test_resultado_de_partido_no_apostado(self):
+        self.assertEqual(self.user2.puntajes.get(etapa=None).maximo, 4)
+        models.Etapa.objects.filter(pk=self.etapa.pk).update(
+            vencimiento=timezone.now() - datetime.timedelta(minutes=1))
+        self.partido.goles_local = self.partido.goles_visitante = 0
+        resultados.guardar([self.partido])
+        resultados.aplicar([self.partido])
+        self.assertEqual(self.user2.puntajes.get(etapa=None).maximo, 0)
+        self.assertEqual(self.maximos(), self.recalculados())
+
+    def test_partido_cerrado(self):
+        models.Partido.objects.filter(pk=self.partido.pk).update(
+            fecha=timezone.now() - datetime.timedelta(minutes=1))
+        tasks.actualizar_maximos()
+        self.assertEqual(self.user2.puntajes.get(etapa=None).maximo, 0)
+        # user1 ya no puede cambiar la apuesta, puede sumar lo apostado
+        self.assertEqual(self.user1.puntajes.get(etapa=None).maximo, 4)
+        self.assertEqual(self.maximos(), self.recalculados())
+
+    def test_sin_partidos_cerrados(self):
+        with self.assertNumQueries(1):
+            tasks.actualizar_maximos()
+        self.assertEqual(self.user2.puntajes.get(etapa=None).maximo, 4)
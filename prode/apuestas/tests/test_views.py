@@ -1,5 +1,10 @@
 import datetime
+from unittest import mock
 
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from test_plus.test import TestCase
@@ -7,7 +12,9 @@ from test_plus.test import TestCase
 from prode.apuestas import (
     constants,
     forms,
+    leaderboard,
     models,
+    views,
 )
 
 from . import factories
@@ -67,6 +74,24 @@ class AdministrarApuestasTest(TestCase):
                                 goles_visitante=1)
                         .exists())
 
+    def test_form_invalid__muestra_errores(self):
+        partido = factories.PartidoFactory()
+        data = {
+            'form-TOTAL_FORMS': 1,
+            'form-INITIAL_FORMS': 0,
+            'form-0-ganador': constants.GANA_LOCAL,
+            'form-0-goles_local': -1,
+            'form-0-goles_visitante': 1,
+        }
+        with self.login(self.make_user()):
+            self.post('apuestas:apostar', data=data,
+                      slug=partido.etapa.slug)
+        self.response_200()
+        self.assertIs(self.context['formset'], self.context['form'])
+        # los formularios con errores se renderizan con crispy
+        self.assertContains(self.last_response, 'is-invalid')
+        self.assertFalse(models.Apuesta.objects.exists())
+
     def test_etapa_vencida(self):
         etapa = factories.EtapaFactory(vencimiento=timezone.now())
         user = self.make_user()
@@ -75,6 +100,167 @@ class AdministrarApuestasTest(TestCase):
             self.response_302()
         self.assertEqual(self.last_response.url, f"/{etapa.slug}/")
 
+    def test_form_valid__solo_guarda_cambios(self):
+        user = self.make_user()
+        etapa = factories.EtapaFactory()
+        partidos = factories.PartidoFactory.create_batch(2, etapa=etapa)
+        for partido in partidos:
+            factories.ApuestaFactory(usuario=user, partido=partido,
+                                     ganador=constants.EMPATE,
+                                     goles_local=1, goles_visitante=1)
+        data = {
+            'form-TOTAL_FORMS': 2,
+            'form-INITIAL_FORMS': 0,
+        }
+        for indice, goles in enumerate((1, 2)):
+            data[f'form-{indice}-ganador'] = constants.EMPATE
+            data[f'form-{indice}-goles_local'] = goles
+            data[f'form-{indice}-goles_visitante'] = goles
+        with self.login(user):
+            with CaptureQueriesContext(connection) as consultas:
+                self.post('apuestas:apostar', data=data, slug=etapa.slug)
+        escrituras = [consulta['sql'] for consulta in consultas
+                      if 'apuestas_apuesta' in consulta['sql'] and
+                      consulta['sql'].startswith(('INSERT', 'UPDATE'))]
+        # una sola escritura, con la apuesta modificada
+        self.assertEqual(len(escrituras), 1)
+        goles = (models.Apuesta.objects
+                 .filter(usuario=user)
+                 .order_by('partido_id')
+                 .values_list('goles_local', flat=True))
+        self.assertEqual(list(goles), [1, 2])
+
+    def test_form_valid__apuesta_nueva_aparece_en_ranking(self):
+        partido = factories.PartidoFactory(goles_local=None,
+                                           goles_visitante=None)
+        data = {
+            'form-TOTAL_FORMS': 1,
+            'form-INITIAL_FORMS': 0,
+            'form-0-ganador': constants.EMPATE,
+            'form-0-goles_local': 0,
+            'form-0-goles_visitante': 0,
+        }
+        user = self.make_user()
+        with self.login(user):
+            self.post('apuestas:apostar', data=data, slug=partido.etapa.slug)
+        self.assertTrue(models.Apuesta.objects.filter(usuario=user).exists())
+        self.assertEqual(user.puntajes.puntos(), 0)
+        self.assertEqual(models.Puntaje.objects.posicion(user), 1)
+
+    def contar_consultas(self, cantidad_partidos):
+        """Cuenta las consultas para mostrar una etapa con la cantidad de
+        partidos dada, todos con apuesta del usuario."""
+        etapa = factories.EtapaFactory()
+        user = self.make_user(f'user{cantidad_partidos}')
+        for partido in factories.PartidoFactory.create_batch(
+                cantidad_partidos, etapa=etapa):
+            factories.ApuestaFactory(usuario=user, partido=partido)
+        with self.login(user):
+            with CaptureQueriesContext(connection) as consultas:
+                self.get('apuestas:apostar', slug=etapa.slug)
+        self.response_200()
+        self.assertEqual(len(self.context['formset']), cantidad_partidos)
+        return len(consultas)
+
+    def test_cantidad_consultas_no_depende_de_partidos(self):
+        self.assertEqual(self.contar_consultas(1), self.contar_consultas(48))
+
+
+class ApostarPartidoViewTests(TestCase):
+    def setUp(self):
+        self.user = self.make_user()
+        self.partido = factories.PartidoFactory(goles_local=None,
+                                                goles_visitante=None)
+        self.data = {
+            'ganador': constants.GANA_LOCAL,
+            'goles_local': 2,
+            'goles_visitante': 1,
+        }
+
+    def apostar(self, partido=None, data=None):
+        partido = partido or self.partido
+        with self.login(self.user):
+            return self.post('apuestas:apostar_partido', pk=partido.pk,
+                             data=data or self.data)
+
+    def test_crea_apuesta(self):
+        response = self.apostar()
+        self.response_200()
+        self.assertEqual(response.json(), self.data)
+        apuesta = models.Apuesta.objects.get(usuario=self.user,
+                                             partido=self.partido)
+        self.assertEqual(apuesta.goles_local, 2)
+        # la apuesta nueva aparece en el ranking
+        self.assertEqual(models.Puntaje.objects.posicion(self.user), 1)
+
+    def test_actualiza_apuesta(self):
+        factories.ApuestaFactory(usuario=self.user, partido=self.partido,
+                                 ganador=constants.EMPATE,
+                                 goles_local=0, goles_visitante=0)
+        self.apostar()
+        self.response_200()
+        apuesta = models.Apuesta.objects.get(usuario=self.user,
+                                             partido=self.partido)
+        self.assertEqual(apuesta.ganador, constants.GANA_LOCAL)
+        self.assertEqual(apuesta.goles_visitante, 1)
+
+    def test_sin_cambios_no_escribe(self):
+        factories.ApuestaFactory(usuario=self.user, partido=self.partido,
+                                 **self.data)
+        with CaptureQueriesContext(connection) as consultas:
+            self.apostar()
+        self.response_200()
+        self.assertFalse([consulta for consulta in consultas
+                          if consulta['sql'].startswith(('INSERT', 'UPDATE'))
+                          and 'apuestas_apuesta' in consulta['sql']])
+
+    def test_datos_invalidos(self):
+        response = self.apostar(data={'ganador': 'x', 'goles_local': -1})
+        self.response_400()
+        self.assertIn('goles_local', response.json()['errores'])
+        self.assertFalse(models.Apuesta.objects.exists())
+
+    def test_partido_empezado(self):
+        partido = factories.PartidoFactory(
+            fecha=timezone.now() - datetime.timedelta(minutes=1),
+            goles_local=None, goles_visitante=None)
+        self.apostar(partido)
+        self.response_404()
+        self.assertFalse(models.Apuesta.objects.exists())
+
+    def test_etapa_vencida(self):
+        etapa = factories.EtapaFactory(vencimiento=timezone.now())
+        partido = factories.PartidoFactory(etapa=etapa, goles_local=None,
+                                           goles_visitante=None)
+        self.apostar(partido)
+        self.response_403()
+        self.assertFalse(models.Apuesta.objects.exists())
+
+    def test_requiere_login(self):
+        self.post('apuestas:apostar_partido', pk=self.partido.pk,
+                  data=self.data)
+        self.response_403()
+
+    def test_solo_post(self):
+        with self.login(self.user):
+            self.get('apuestas:apostar_partido', pk=self.partido.pk)
+        self.response_405()
+
+    def test_una_escritura_sin_importar_los_partidos(self):
+        factories.PartidoFactory.create_batch(20, etapa=self.partido.etapa)
+        with CaptureQueriesContext(connection) as consultas:
+            self.apostar()
+        escrituras = [consulta for consulta in consultas
+                      if 'apuestas_apuesta' in consulta['sql'] and
+                      consulta['sql'].startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(len(escrituras), 1)
+
+    def test_autoguardado_en_template(self):
+        with self.login(self.user):
+            self.get('apuestas:apostar', slug=self.partido.etapa.slug)
+        url = self.reverse('apuestas:apostar_partido', pk=self.partido.pk)
+        self.assertContains(self.last_response, f'data-autoguardado="{url}"')
+
 
 class EtapaDetailView(TestCase):
     def test_etapa_en_contexto(self):
@@ -115,6 +301,249 @@ class EtapaDetailView(TestCase):
             self.response_302()
         self.assertEqual(self.last_response.url, f"/{etapa.slug}/apostar/")
 
+    def test_estadisticas(self):
+        etapa = factories.EtapaFactory(vencimiento=timezone.now())
+        partido = factories.PartidoFactory(etapa=etapa)
+        factories.ApuestaFactory(partido=partido, ganador=constants.EMPATE)
+        with self.login(self.make_user()):
+            self.get('apuestas:detail', slug=etapa.slug)
+        [partido] = self.context['partidos']
+        self.assertEqual(partido.estadistica.apuestas, 1)
+        self.assertEqual(partido.estadistica.empate, 1)
+        # las apuestas se cargan aparte
+        self.assertNotContains(self.last_response, 'Apuestas para')
+        self.assertContains(self.last_response, self.reverse(
+            'apuestas:apuestas_partido', pk=partido.pk))
+
+    def test_cantidad_consultas_no_depende_de_apuestas(self):
+        def consultas():
+            with self.login(user):
+                with CaptureQueriesContext(connection) as consultas:
+                    self.get('apuestas:detail', slug=etapa.slug)
+            return len(consultas)
+
+        etapa = factories.EtapaFactory(vencimiento=timezone.now())
+        partidos = factories.PartidoFactory.create_batch(3, etapa=etapa)
+        user = self.make_user()
+        for partido in partidos:
+            factories.ApuestaFactory(partido=partido)
+        cantidad = consultas()
+        for partido in partidos:
+            factories.ApuestaFactory.create_batch(5, partido=partido)
+        self.assertEqual(consultas(), cantidad)
+
+
+class EtapaDetailViewCacheTests(TestCase):
+    def setUp(self):
+        self.user = self.make_user()
+        self.etapa = factories.EtapaFactory(vencimiento=timezone.now())
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                goles_local=1,
+                                                goles_visitante=0)
+        factories.ApuestaFactory(partido=self.partido,
+                                 usuario=self.make_user('apostador'),
+                                 ganador=constants.GANA_LOCAL,
+                                 goles_local=1,
+                                 goles_visitante=0)
+
+    def detalle(self, user=None):
+        with self.login(user or self.user):
+            with CaptureQueriesContext(connection) as consultas:
+                self.get('apuestas:detail', slug=self.etapa.slug)
+        self.response_200()
+        return [consulta['sql'] for consulta in consultas]
+
+    def test_fragmentos_cacheados(self):
+        self.detalle()
+        # sin invalidar, los puntajes y estadisticas salen del cache
+        models.Puntaje.objects.all().delete()
+        consultas = self.detalle()
+        self.assertContains(self.last_response, 'apostador')
+        self.assertFalse(any('"apuestas_puntaje"' in consulta or
+                             '"apuestas_estadisticapartido"' in consulta
+                             for consulta in consultas))
+
+    def test_cargar_resultado_invalida(self):
+        self.detalle()
+        self.partido.goles_local = 0
+        self.partido.save()
+        self.detalle()
+        [partido] = self.context['partidos']
+        self.assertEqual(partido.puntos_obtenidos.get().puntos, 0)
+        self.assertEqual(self.context['puntajes'][0], ('apostador', 0))
+        self.assertContains(self.last_response, '0 puntos: 1')
+
+    def test_boton_cargar_resultados_fuera_del_cache(self):
+        self.detalle()
+        self.assertNotContains(self.last_response, 'Cargar resultados')
+        admin = self.make_user('admin')
+        admin.is_superuser = True
+        admin.save()
+        self.detalle(user=admin)
+        self.assertContains(self.last_response, 'Cargar resultados')
+
+
+class ApuestasPartidoViewTests(TestCase):
+    def setUp(self):
+        self.user = self.make_user()
+        self.partido = factories.PartidoFactory(
+            etapa=factories.EtapaFactory(vencimiento=timezone.now()),
+            goles_local=1,
+            goles_visitante=0,
+        )
+        self.apuesta = factories.ApuestaFactory(
+            partido=self.partido,
+            usuario=self.make_user('apostador'),
+            ganador=constants.GANA_LOCAL,
+            goles_local=1,
+            goles_visitante=0,
+        )
+
+    def test_apuestas(self):
+        with self.login(self.user):
+            self.get('apuestas:apuestas_partido', pk=self.partido.pk)
+        self.response_200()
+        self.assertTemplateUsed(self.last_response,
+                                'apuestas/apuestas_partido.html')
+        [apuesta] = self.context['apuestas']
+        self.assertEqual(apuesta, self.apuesta)
+        self.assertEqual(apuesta.puntos, 4)
+
+    def test_ajax_devuelve_solo_la_tabla(self):
+        with self.login(self.user):
+            self.get('apuestas:apuestas_partido', pk=self.partido.pk,
+                     extra={'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'})
+        self.response_200()
+        self.assertTemplateNotUsed(self.last_response, 'base.html')
+        self.assertContains(self.last_response, 'apostador')
+
+    def test_paginado(self):
+        for nombre in ('c', 'a', 'b'):
+            factories.ApuestaFactory(partido=self.partido,
+                                     usuario=self.make_user(nombre))
+        with mock.patch.object(views.ApuestasPartidoView, 'paginate_by', 2):
+            with self.login(self.user):
+                with CaptureQueriesContext(connection) as consultas:
+                    self.get('apuestas:apuestas_partido', pk=self.partido.pk,
+                             data={'page': 2})
+        self.response_200()
+        self.assertEqual([apuesta.usuario.username
+                          for apuesta in self.context['apuestas']],
+                         ['b', 'c'])
+        # solo se traen las apuestas de la pagina
+        [consulta] = [consulta['sql'] for consulta in consultas
+                      if consulta['sql'].startswith('SELECT') and
+                      'FROM "apuestas_apuesta"' in consulta['sql'] and
+                      'COUNT' not in consulta['sql']]
+        self.assertIn('LIMIT 2 OFFSET 2', consulta)
+
+    def test_orden_por_puntos(self):
+        factories.ApuestaFactory(partido=self.partido,
+                                 usuario=self.make_user('a'),
+                                 ganador=constants.EMPATE,
+                                 goles_local=0, goles_visitante=0)
+        with self.login(self.user):
+            self.get('apuestas:apuestas_partido', pk=self.partido.pk,
+                     data={'orden': 'puntos'})
+        self.assertEqual([(apuesta.usuario.username, apuesta.puntos)
+                          for apuesta in self.context['apuestas']],
+                         [('apostador', 4), ('a', 0)])
+        self.assertContext('orden', 'puntos')
+
+    def test_orden_por_puntos__partido_sin_resultado(self):
+        self.partido.goles_local = self.partido.goles_visitante = None
+        self.partido.save()
+        with self.login(self.user):
+            self.get('apuestas:apuestas_partido', pk=self.partido.pk,
+                     data={'orden': 'puntos'})
+        self.response_200()
+        self.assertContext('orden', 'usuario')
+
+    def test_pagina_cacheada(self):
+        def apuestas():
+            with self.login(self.user):
+                with CaptureQueriesContext(connection) as consultas:
+                    self.get('apuestas:apuestas_partido', pk=self.partido.pk)
+            return [consulta['sql'] for consulta in consultas
+                    if 'FROM "apuestas_apuesta"' in consulta['sql'] and
+                    'COUNT' not in consulta['sql']]
+
+        self.assertEqual(len(apuestas()), 1)
+        self.assertEqual(apuestas(), [])
+        self.assertContains(self.last_response, 'apostador')
+        self.partido.goles_local = 0
+        self.partido.save()
+        self.assertEqual(len(apuestas()), 1)
+
+    def test_etapa_no_vencida(self):
+        partido = factories.PartidoFactory()
+        with self.login(self.user):
+            self.get('apuestas:apuestas_partido', pk=partido.pk)
+        self.response_404()
+
+    def test_requiere_login(self):
+        self.get('apuestas:apuestas_partido', pk=self.partido.pk)
+        self.response_302()
+
+
+class EtapaMixinTests(TestCase):
+    """Cada vista busca la etapa por slug una sola vez por pedido."""
+
+    def setUp(self):
+        self.admin = self.make_user('admin')
+        self.admin.is_superuser = True
+        self.admin.save()
+        self.etapa = factories.EtapaFactory()
+        factories.PartidoFactory.create_batch(3, etapa=self.etapa)
+        self.vencida = factories.EtapaFactory(
+            vencimiento=timezone.now() - datetime.timedelta(days=1))
+        for partido in factories.PartidoFactory.create_batch(
+                3, etapa=self.vencida,
+                fecha=timezone.now() - datetime.timedelta(days=2)):
+            factories.ApuestaFactory(partido=partido)
+
+    def consultas(self, url_name, etapa, tabla='apuestas_etapa', data=None):
+        """Hace el pedido y devuelve las consultas a ``tabla``."""
+        with self.login(self.admin):
+            with CaptureQueriesContext(connection) as consultas:
+                if data is None:
+                    self.get(url_name, slug=etapa.slug)
+                else:
+                    self.post(url_name, slug=etapa.slug, data=data)
+        self.assertIn(self.last_response.status_code, (200, 302))
+        return [consulta['sql'] for consulta in consultas
+                if consulta['sql'].startswith('SELECT') and
+                f'FROM "{tabla}"' in consulta['sql'] and
+                (tabla != 'apuestas_etapa' or '"slug" =' in consulta['sql'])]
+
+    def test_apostar(self):
+        self.assertEqual(len(self.consultas('apuestas:apostar', self.etapa)),
+                         1)
+        # los partidos se cargan junto a la etapa, sin un count aparte
+        self.assertEqual(len(self.consultas('apuestas:apostar', self.etapa,
+                                            tabla='apuestas_partido')), 1)
+
+    def test_apostar_post(self):
+        data = {'form-TOTAL_FORMS': 3, 'form-INITIAL_FORMS': 0}
+        for indice in range(3):
+            data[f'form-{indice}-ganador'] = constants.EMPATE
+            data[f'form-{indice}-goles_local'] = 0
+            data[f'form-{indice}-goles_visitante'] = 0
+        self.assertEqual(len(self.consultas('apuestas:apostar', self.etapa,
+                                            data=data)), 1)
+
+    def test_detalle(self):
+        self.assertEqual(len(self.consultas('apuestas:detail', self.vencida)),
+                         1)
+
+    def test_editar(self):
+        self.assertEqual(len(self.consultas('apuestas:update', self.etapa)),
+                         1)
+
+    def test_cargar_resultados(self):
+        self.assertEqual(
+            len(self.consultas('apuestas:cargar_resultados', self.vencida)), 1)
+
 
 class EtapaCreateViewTests(TestCase):
     def test_context(self):
@@ -402,6 +831,35 @@ class CargarResultadosView(TestCase):
         self.assertEqual(partido.goles_local, 5)
         self.assertEqual(partido.goles_visitante, 3)
 
+    def test_cargar_resultados__actualiza_puntajes(self):
+        terminado = timezone.now() - datetime.timedelta(hours=2)
+        partido = factories.PartidoFactory(
+            fecha=terminado,
+            goles_local=None,
+            goles_visitante=None,
+        )
+        apuesta = factories.ApuestaFactory(partido=partido,
+                                           ganador=constants.GANA_LOCAL,
+                                           goles_local=5,
+                                           goles_visitante=3)
+        etapa = partido.etapa
+        user = self.make_user(perms=('apuestas.change_etapa',))
+        data = {
+            'partidos-TOTAL_FORMS': 1,
+            'partidos-INITIAL_FORMS': 1,
+            'partidos-0-id': partido.id,
+            'partidos-0-goles_local': 5,
+            'partidos-0-goles_visitante': 3,
+        }
+        self.assertEqual(apuesta.usuario.puntajes.puntos(etapa), 0)
+        with self.login(user):
+            self.post('apuestas:cargar_resultados', data=data, slug=etapa.slug)
+        # los puntajes se actualizan en una tarea, al terminar la transaccion
+        for _, callback in connection.run_on_commit:
+            callback()
+        self.assertEqual(apuesta.usuario.puntajes.puntos(etapa), 4)
+        self.assertEqual(apuesta.usuario.puntajes.puntos(), 4)
+
     def test_permisos(self):
         user = self.make_user()
         etapa = factories.EtapaFactory()
@@ -428,6 +886,69 @@ class CargarResultadosView(TestCase):
         self.assertIn(partido, formset.queryset)
 
 
+class ImportarResultadosViewTests(TestCase):
+    def setUp(self):
+        self.etapa = factories.EtapaFactory(slug='grupos')
+        fecha = timezone.now() - datetime.timedelta(days=2)
+        self.partido = factories.PartidoFactory(etapa=self.etapa,
+                                                local='AR', visitante='IS',
+                                                fecha=fecha,
+                                                goles_local=None,
+                                                goles_visitante=None)
+        self.otro = factories.PartidoFactory(etapa=self.etapa,
+                                             local='BR', visitante='CH',
+                                             fecha=fecha,
+                                             goles_local=1,
+                                             goles_visitante=1)
+        self.user = self.make_user(perms=('apuestas.change_etapa',))
+
+    def importar(self, contenido, nombre='resultados.csv'):
+        archivo = SimpleUploadedFile(nombre, contenido.encode())
+        with self.login(self.user):
+            self.post('apuestas:importar_resultados',
+                      data={'archivo': archivo})
+
+    def test_importa(self):
+        self.importar('etapa,local,visitante,goles_local,goles_visitante\n'
+                      'grupos,AR,IS,2,0\n')
+        self.response_302()
+        self.partido.refresh_from_db()
+        self.assertEqual(
+            (self.partido.goles_local, self.partido.goles_visitante), (2, 0))
+
+    def test_json(self):
+        self.importar('[{"etapa": "grupos", "local": "Argentina", '
+                      '"visitante": "Islandia", "goles_local": 0, '
+                      '"goles_visitante": 0}]', nombre='resultados.json')
+        self.response_302()
+        self.partido.refresh_from_db()
+        self.assertEqual(self.partido.goles_local, 0)
+
+    def test_errores(self):
+        self.importar('etapa,local,visitante,goles_local,goles_visitante\n'
+                      'grupos,AR,IS,2,0\n'
+                      'grupos,BR,CH,2,0\n')
+        self.response_200()
+        self.assertContains(self.last_response,
+                            'Fila 2: BR - CH en grupos ya tiene resultado')
+        self.partido.refresh_from_db()
+        self.assertIsNone(self.partido.goles_local)
+
+    def test_correcciones_solo_admin(self):
+        self.user.is_superuser = True
+        self.user.save()
+        self.importar('etapa,local,visitante,goles_local,goles_visitante\n'
+                      'grupos,BR,CH,2,0\n')
+        self.response_302()
+        self.otro.refresh_from_db()
+        self.assertEqual(self.otro.goles_local, 2)
+
+    def test_permisos(self):
+        with self.login(self.make_user('otro')):
+            self.get('apuestas:importar_resultados')
+            self.response_302()
+
+
 class RankingViewTests(TestCase):
     def hacer_apuestas(self):
         self.user1 = self.make_user('user1')
@@ -468,6 +989,15 @@ class RankingViewTests(TestCase):
                                          goles_visitante=0,
                                          ganador=constants.GANA_LOCAL)
 
+    def test_ranking__cambios_de_puesto(self):
+        self.hacer_apuestas()
+        models.Puesto.objects.create(usuario=self.user3, puesto=3,
+                                     anterior=1)
+        with self.login(self.user1):
+            self.get('apuestas:ranking')
+        self.assertEqual(self.context['cambios'], {'user3': -2})
+        self.assertContains(self.last_response, '&#9660;2')
+
     def test_ranking(self):
         self.hacer_apuestas()
         with self.login(self.user1):
@@ -484,8 +1014,10 @@ class RankingViewTests(TestCase):
         self.hacer_apuestas()
         with self.login(self.user1):
             self.get('apuestas:ranking')
-        ganador = self.context['ganadores'][0]
-        self.assertEqual(ganador, 'user2')
+        ganador = self.context['ranking'][0]
+        self.assertEqual((ganador.username, ganador.puesto), ('user2', 1))
+        self.assertContains(self.last_response, 'class="table-success"',
+                            count=1)
 
     def test_ranking_sin_apuestas(self):
         user = self.make_user()
@@ -509,18 +1041,15 @@ class RankingViewTests(TestCase):
 
     def test_ganadores(self):
         self.hacer_apuestas_empate()
-        with self.login(self.user1):
-            self.get('apuestas:ranking')
-        ganadores = self.context['ganadores']
-        expected = ('user1', 'user2', 'user3')
-        self.assertEqual(ganadores, expected)
-
-    def test_ganadores__sin_apuestas(self):
-        user = self.make_user()
-        with self.login(user):
+        with self.login(self.user3):
             self.get('apuestas:ranking')
-        ganadores = list(self.context['ganadores'])
-        self.assertEqual(ganadores, [])
+        puestos = [rank.puesto for rank in self.context['ranking']]
+        self.assertEqual(puestos, [1, 1, 1])
+        self.assertContains(self.last_response, 'class="table-success"',
+                            count=3)
+        # el puesto del usuario es el mismo que se muestra en el ranking
+        self.assertEqual(self.context['puesto_actual'], 1)
+        self.assertContains(self.last_response, 'Felicitaciones')
 
     def test_ganadores__sin_partidos_definidos(self):
         user = self.make_user()
@@ -529,5 +1058,99 @@ class RankingViewTests(TestCase):
                                  usuario=user)
         with self.login(user):
             self.get('apuestas:ranking')
-        ganador = self.context['ganadores'][0]
-        self.assertEqual(ganador, user.username)
+        ganador = self.context['ranking'][0]
+        self.assertEqual((ganador.username, ganador.puesto),
+                         (user.username, 1))
+
+    def crear_puntajes(self, cantidad):
+        usuarios = [self.make_user(f'user{i:03}') for i in range(cantidad)]
+        models.Puntaje.objects.bulk_create(
+            models.Puntaje(usuario=usuario, puntos=cantidad - i)
+            for i, usuario in enumerate(usuarios)
+        )
+        return usuarios
+
+    def test_ranking__paginado(self):
+        usuarios = self.crear_puntajes(120)
+        with self.login(usuarios[0]):
+            self.get('apuestas:ranking', data={'page': 2})
+        self.response_200()
+        ranking = self.context['ranking']
+        self.assertEqual(len(ranking), 50)
+        self.assertEqual(ranking[0], ('user050', 70))
+        self.assertEqual(ranking[0].puesto, 51)
+        self.assertEqual(self.context['paginator'].num_pages, 3)
+
+    def test_ranking__pagina_del_usuario(self):
+        usuarios = self.crear_puntajes(120)
+        with self.login(usuarios[110]):
+            self.get('apuestas:ranking', data={'page': 'mia'})
+        self.response_200()
+        self.assertEqual(self.context['page_obj'].number, 3)
+        self.assertIn(('user110', 10), self.context['ranking'])
+
+    def test_ranking__pagina_del_usuario_sin_puntaje(self):
+        self.crear_puntajes(120)
+        user = self.make_user('sinpuntaje')
+        with self.login(user):
+            self.get('apuestas:ranking', data={'page': 'mia'})
+        self.response_200()
+        self.assertEqual(self.context['page_obj'].number, 1)
+
+    def test_ranking__alcanzables(self):
+        self.hacer_apuestas()
+        with self.login(self.user1):
+            self.get('apuestas:ranking')
+        alcanzables = self.context['alcanzables']
+        # no quedan partidos pendientes
+        self.assertEqual(alcanzables['user2'], (30, False))
+        self.assertEqual(alcanzables['user1'], (0, True))
+        self.assertContains(self.last_response, 'Eliminado')
+
+    def test_ranking__usuario_nuevo(self):
+        self.hacer_apuestas()
+        with self.login(self.user1):
+            self.get('apuestas:ranking')
+        self.assertEqual(self.context['paginator'].count, 3)
+        nuevo = self.make_user('nuevo')
+        factories.ApuestaFactory(usuario=nuevo,
+                                 partido__goles_local=None,
+                                 partido__goles_visitante=None)
+        # TestCase no confirma la transaccion, ejecuto lo pendiente
+        for _, callback in connection.run_on_commit:
+            callback()
+        with self.login(nuevo):
+            self.get('apuestas:ranking', data={'page': 'mia'})
+        self.response_200()
+        self.assertEqual(self.context['paginator'].count, 4)
+        self.assertIn(('nuevo', 0), self.context['ranking'])
+
+    @override_settings(LEADERBOARD_CACHE='default')
+    def test_ranking__alcanzables_de_usuarios_nuevos(self):
+        leaderboard._clientes_en_memoria.clear()
+        self.hacer_apuestas()
+        leaderboard.get_leaderboard().reconstruir()
+        with self.login(self.user1):
+            self.get('apuestas:ranking')
+        # el usuario nuevo aparece en la misma pagina con su maximo
+        nuevo = self.make_user('nuevo')
+        factories.ApuestaFactory(usuario=nuevo,
+                                 partido__goles_local=None,
+                                 partido__goles_visitante=None)
+        for _, callback in connection.run_on_commit:
+            callback()
+        with self.login(self.user1):
+            self.get('apuestas:ranking')
+        self.assertIn('nuevo', [rank.username
+                                for rank in self.context['ranking']])
+        self.assertIn('nuevo', self.context['alcanzables'])
+
+    def test_ranking__no_trae_el_ranking_completo(self):
+        usuarios = self.crear_puntajes(120)
+        with self.login(usuarios[0]):
+            with CaptureQueriesContext(connection) as consultas:
+                self.get('apuestas:ranking', data={'page': 3})
+        self.assertEqual(len(self.context['ranking']), 20)
+        sql = [consulta['sql'] for consulta in consultas.captured_queries
+               if 'apuestas_puntaje' in consulta['sql']]
+        self.assertTrue(any('LIMIT 20 OFFSET 100' in s for s in sql))
@@ -10,6 +10,15 @@ urlpatterns = [
     path('ranking/',
          views.RankingView.as_view(),
          name='ranking'),
+    path('partidos/<int:pk>/apostar/',
+         views.ApostarPartidoView.as_view(),
+         name='apostar_partido'),
+    path('partidos/<int:pk>/apuestas/',
+         views.ApuestasPartidoView.as_view(),
+         name='apuestas_partido'),
+    path('resultados/importar/',
+         views.ImportarResultadosView.as_view(),
+         name='importar_resultados'),
     path('<slug:slug>/apostar/',
          views.AdministrarApuestasFormView.as_view(),
          name='apostar'),
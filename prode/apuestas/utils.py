@@ -1,13 +1,312 @@
-from . import models
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import (
+    OuterRef,
+    Q,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+from . import (
+    cache,
+    estadisticas,
+    leaderboard,
+    managers,
+    models,
+)
+
+
+class RankingPaginado:
+    """Ranking que se obtiene por porciones, pensado para usar con
+    ``Paginator``.
+
+    Cada porcion se pide al leaderboard si esta configurado y tiene el
+    ranking cargado, o a la base de datos con LIMIT/OFFSET (guardandola en el
+    cache de resultados), nunca se arma el ranking completo.
+    """
+    # usuarios por pagina en la pantalla de ranking
+    por_pagina = 50
+
+    def __init__(self, etapa=None):
+        self.etapa = etapa
+
+    @cached_property
+    def tablero(self):
+        """Leaderboard del que se lee el ranking o None si hay que leerlo de
+        la base de datos.
+
+        Si el ranking no esta completo (recien desplegado, se vacio o se
+        reinicio el redis) se lee de la base hasta que se reconstruya.
+        """
+        return leaderboard.get_leaderboard_completo()
+
+    @property
+    def nombre(self):
+        """Nombre con el que se guarda en el cache de resultados."""
+        etapa_id = getattr(self.etapa, 'pk', 'total')
+        return f'ranking:{etapa_id}'
+
+    def count(self):
+        """Obtiene la cantidad de usuarios en el ranking."""
+        if self.tablero is not None:
+            return self.tablero.cantidad(self.etapa)
+        return cache.obtener(
+            f'{self.nombre}:cantidad',
+            lambda: models.Puntaje.objects.cantidad(self.etapa),
+        )
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, indice):
+        if not isinstance(indice, slice):
+            return self[indice:indice + 1][0]
+        desde = indice.start or 0
+        limite = indice.stop - desde
+        if self.tablero is not None:
+            return self.tablero.pagina(desde, limite, self.etapa)
+        return cache.obtener(
+            f'{self.nombre}:{desde}:{limite}',
+            lambda: models.Puntaje.objects.ranking(self.etapa,
+                                                   desde=desde,
+                                                   limite=limite),
+        )
 
 
 def get_ranking(usuario):
     """Obtiene el puesto en el ranking del usuario pasado por parametro.
 
+    Si hay un leaderboard completo se consulta ahi, sino en la base de
+    datos.
+
+    :returns: int o None si no se encontro el usuario
+    """
+    tablero = leaderboard.get_leaderboard_completo()
+    if tablero is not None:
+        posicion = tablero.posicion(usuario.username)
+        if posicion is not None:
+            return posicion
+    return models.Puntaje.objects.posicion(usuario)
+
+
+def get_puesto(usuario):
+    """Obtiene el puesto del usuario como se muestra en el ranking: los
+    usuarios empatados comparten el puesto.
+
+    A diferencia de ``get_ranking``, que es la posicion del usuario en el
+    ranking desempatando por nombre de usuario.
+
     :returns: int o None si no se encontro el usuario
     """
-    ranking = models.Apuesta.objects.ranking()
-    for puesto, (username, _) in enumerate(ranking):
-        if username == usuario.username:
-            return puesto + 1
-    return None
+    tablero = leaderboard.get_leaderboard_completo()
+    if tablero is not None:
+        puesto = tablero.puesto(usuario.username)
+        if puesto is not None:
+            return puesto
+    return models.Puntaje.objects.puesto(usuario)
+
+
+def actualizar_puntajes(partidos):
+    """Recalcula los puntajes de los usuarios que apostaron en los partidos.
+
+    Solo se recalculan las etapas de los partidos y el total de dichos
+    usuarios. Del resto de los usuarios solo cambian los maximos (por ejemplo
+    quienes no apostaron en un partido abierto que ahora tiene resultado), que
+    se actualizan con ``actualizar_maximos``.
+    """
+    usuarios = (models.Apuesta.objects
+                .filter(partido__in=partidos)
+                .values('usuario'))
+    etapas = {partido.etapa_id for partido in partidos}
+    recalcular_puntajes(usuarios=usuarios, etapas=etapas)
+    actualizar_maximos(etapas)
+
+
+def actualizar_maximos(etapas=None):
+    """Actualiza los maximos de todos los puntajes guardados de las etapas y
+    del total, con un ``UPDATE`` por etapa.
+
+    Hace falta cuando un partido deja de estar abierto (tiene resultado,
+    empezo o vencio su etapa): cambian los puntos que todos los usuarios
+    pueden sumar en el, hayan apostado o no.
+
+    :param etapas: Etapas (o ids) a actualizar ademas del total. Por defecto
+                   todas.
+    """
+    abiertos = models.Partido.objects.puntos_abiertos()
+    maximos = (models.Apuesta.objects
+               .filter(usuario=OuterRef('usuario'))
+               .order_by()
+               .values('usuario')
+               .annotate(maximo=Sum(managers.maximo_apuesta()))
+               .values('maximo'))
+    por_etapa = maximos.filter(partido__etapa=OuterRef('etapa'))
+    etapas = _sin_total(etapas)
+    if etapas is None:
+        etapas = models.Etapa.objects.values_list('pk', flat=True)
+    with transaction.atomic():
+        for etapa in etapas:
+            etapa = getattr(etapa, 'pk', etapa)
+            (models.Puntaje.objects
+             .filter(etapa=etapa)
+             .update(maximo=Coalesce(Subquery(por_etapa), Value(0)) +
+                     Value(abiertos.get(etapa, 0))))
+        (models.Puntaje.objects
+         .filter(etapa__isnull=True)
+         .update(maximo=Coalesce(Subquery(maximos), Value(0)) +
+                 Value(sum(abiertos.values()))))
+
+
+def guardar_apuestas(apuestas):
+    """Guarda las apuestas en bloque y actualiza los puntajes como lo haria
+    ``signals.actualizar_puntajes_apuesta`` con cada una.
+
+    Se recalculan los puntajes de los usuarios con apuestas nuevas (tienen que
+    aparecer en el ranking) o en partidos con resultado.
+
+    :param apuestas: Instancias de ``Apuesta`` sin guardar o modificadas, con
+                     ``partido`` cargado
+    """
+    apuestas = list(apuestas)
+    recalcular = [apuesta for apuesta in apuestas
+                  if apuesta.pk is None or apuesta.partido.terminado()]
+    models.Apuesta.objects.guardar(apuestas)
+    if recalcular:
+        recalcular_puntajes(
+            usuarios={apuesta.usuario_id for apuesta in recalcular},
+            etapas={apuesta.partido.etapa_id for apuesta in recalcular},
+        )
+    if any(apuesta.partido.terminado() for apuesta in apuestas):
+        cache.invalidar()
+    # por ejemplo apuestas encoladas que se guardan luego del vencimiento
+    estadisticas.actualizar_vencidos(
+        {apuesta.partido_id: apuesta.partido for apuesta in apuestas}.values())
+
+
+def bloquear_usuarios(usuarios=None):
+    """Bloquea los usuarios hasta el fin de la transaccion, para que dos
+    recalculos de sus puntajes no se pisen.
+
+    Se bloquea al usuario y no a sus puntajes porque un usuario nuevo todavia
+    no tiene puntajes. Debe llamarse dentro de una transaccion.
+
+    :param usuarios: Usuarios (o ids) a bloquear. Por defecto todos.
+    """
+    bloqueados = get_user_model().objects.select_for_update().order_by('pk')
+    if usuarios is not None:
+        bloqueados = bloqueados.filter(pk__in=usuarios)
+    list(bloqueados.values_list('pk', flat=True))
+
+
+def recalcular_puntajes(usuarios=None, etapas=None):
+    """Recalcula y guarda los puntajes a partir de las apuestas.
+
+    Los usuarios se bloquean antes de calcular, asi el calculo ve lo que
+    guardo un recalculo simultaneo que termino antes.
+
+    :param usuarios: Usuarios (o ids) a recalcular. Por defecto todos.
+    :param etapas: Etapas (o ids) a recalcular ademas del total. Por defecto
+                   todas.
+    """
+    with transaction.atomic():
+        bloquear_usuarios(usuarios)
+        filas = calcular_puntajes(usuarios=usuarios, etapas=etapas)
+        guardar_puntajes(filas, usuarios=usuarios, etapas=etapas)
+
+
+def _sin_total(etapas):
+    if etapas is None:
+        return None
+    return [etapa for etapa in etapas if etapa is not None]
+
+
+def calcular_puntajes(usuarios=None, etapas=None):
+    """Calcula los puntajes a partir de las apuestas sin guardarlos.
+
+    Recibe los mismos parametros que ``recalcular_puntajes``.
+
+    :returns: Lista de diccionarios con las claves ``usuario``,
+              ``usuario__username``, ``partido__etapa`` (solo en los puntajes
+              de cada etapa), ``puntos`` y ``maximo``
+    """
+    apuestas = models.Apuesta.objects.all()
+    if usuarios is not None:
+        apuestas = apuestas.filter(usuario__in=usuarios)
+    apuestas_etapas = apuestas.filter(partido__etapa__isnull=False)
+    etapas = _sin_total(etapas)
+    if etapas is not None:
+        apuestas_etapas = apuestas_etapas.filter(partido__etapa__in=etapas)
+    filas = list(models.Apuesta.objects.puntos_por_usuario(apuestas_etapas,
+                                                           por_etapa=True))
+    filas += list(models.Apuesta.objects.puntos_por_usuario(apuestas))
+    # en los partidos abiertos se puede cambiar la apuesta y acertar todo
+    abiertos = models.Partido.objects.puntos_abiertos()
+    total_abiertos = sum(abiertos.values())
+    for fila in filas:
+        if 'partido__etapa' in fila:
+            fila['maximo'] += abiertos.get(fila['partido__etapa'], 0)
+        else:
+            fila['maximo'] += total_abiertos
+    return filas
+
+
+def puntajes_guardados(usuarios=None, etapas=None):
+    """Obtiene los puntajes guardados que reemplazaria ``guardar_puntajes``.
+
+    :returns: ``QuerySet`` de ``Puntaje``
+    """
+    puntajes = models.Puntaje.objects.all()
+    if usuarios is not None:
+        puntajes = puntajes.filter(usuario__in=usuarios)
+    etapas = _sin_total(etapas)
+    if etapas is not None:
+        puntajes = puntajes.filter(Q(etapa__isnull=True) |
+                                   Q(etapa__in=etapas))
+    return puntajes
+
+
+def guardar_puntajes(filas, usuarios=None, etapas=None):
+    """Reemplaza los puntajes guardados por los calculados con
+    ``calcular_puntajes``.
+
+    Si un usuario entra o sale de algun ranking (por ejemplo con su primera
+    apuesta) se invalida el cache de resultados al confirmar la transaccion,
+    ya que cambian la cantidad de usuarios y las paginas del ranking.
+
+    El leaderboard tambien se actualiza al confirmar la transaccion, para que
+    no muestre puntajes que luego se deshacen.
+
+    :param filas: Puntajes devueltos por ``calcular_puntajes``
+    :param usuarios: Usuarios con los que se calcularon los puntajes
+    :param etapas: Etapas con las que se calcularon los puntajes
+    """
+    nuevos = [
+        models.Puntaje(usuario_id=fila['usuario'],
+                       etapa_id=fila.get('partido__etapa'),
+                       puntos=fila['puntos'],
+                       maximo=fila['maximo'])
+        for fila in filas
+    ]
+    tablero = leaderboard.get_leaderboard()
+    with transaction.atomic():
+        bloquear_usuarios(usuarios)
+        guardados = puntajes_guardados(usuarios=usuarios, etapas=etapas)
+        anteriores = set(guardados.values_list('usuario__username', 'etapa'))
+        guardados.delete()
+        models.Puntaje.objects.bulk_create(nuevos, batch_size=1000)
+    puntajes = [(fila['usuario__username'], fila.get('partido__etapa'),
+                 fila['puntos']) for fila in filas]
+    actuales = {(username, etapa) for username, etapa, _ in puntajes}
+    if actuales != anteriores:
+        transaction.on_commit(cache.invalidar)
+    if tablero is not None:
+        def actualizar_tablero():
+            pipe = tablero.cliente.pipeline()
+            # quienes ya no tienen puntaje no deben quedar en el ranking
+            tablero.quitar(anteriores - actuales, pipeline=pipe)
+            tablero.guardar(puntajes, pipeline=pipe)
+            pipe.execute()
+        transaction.on_commit(actualizar_tablero)
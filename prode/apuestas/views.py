@@ -1,24 +1,67 @@
-import itertools
-import functools
+import hashlib
 
 from django import shortcuts
 from django.contrib import messages
 from django.contrib.auth import mixins
+from django.db.models import Prefetch
+from django.http import JsonResponse
 from django.forms import (
     formset_factory,
     modelformset_factory,
     inlineformset_factory,
 )
+from django.utils.decorators import method_decorator
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.views import generic
 
 from . import (
+    cache,
+    cola,
     forms,
+    fragmentos,
+    importacion,
+    limites,
     models,
+    puestos,
+    resultados,
+    tasks,
+    utils,
 )
 
 
+class EtapaMixin(generic.detail.SingleObjectMixin):
+    """Resuelve la etapa de la url una sola vez por pedido.
+
+    Las vistas llaman a ``get_object`` desde ``dispatch``, ``test_func``,
+    ``get_form_class``, etc. La primera llamada busca la etapa por slug, con
+    los lookups de ``get_prefetch_related`` precargados, y las siguientes
+    devuelven la misma instancia.
+    """
+    model = models.Etapa
+    prefetch_related = ('partidos',)
+
+    def get_queryset(self):
+        return (super().get_queryset()
+                .prefetch_related(*self.get_prefetch_related()))
+
+    def get_prefetch_related(self):
+        """Obtiene los lookups a precargar junto a la etapa."""
+        return self.prefetch_related
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        return self.etapa
+
+    @cached_property
+    def etapa(self):
+        return super().get_object()
+
+
+@method_decorator(limites.limitar('apostar'), name='dispatch')
 class AdministrarApuestasFormView(mixins.LoginRequiredMixin,
-                                  generic.edit.SingleObjectMixin,
+                                  EtapaMixin,
                                   generic.FormView):
     """Permite administrar las apuestas.
 
@@ -26,7 +69,6 @@ class AdministrarApuestasFormView(mixins.LoginRequiredMixin,
     del usuario.
     """
     template_name = 'apuestas/apuestas_form.html'
-    model = models.Etapa
     object = None
 
     def dispatch(self, *args, **kwargs):
@@ -38,10 +80,17 @@ class AdministrarApuestasFormView(mixins.LoginRequiredMixin,
             return shortcuts.redirect(etapa)
         return super().dispatch(*args, **kwargs)
 
+    def get_prefetch_related(self):
+        """Precarga los partidos no empezados, los unicos en los que se puede
+        apostar."""
+        partidos = models.Partido.objects.no_empezados().order_by('id')
+        return [Prefetch('partidos', queryset=partidos,
+                         to_attr='partidos_no_empezados')]
+
     def get_form_class(self):
         """Obtiene la clase del formulario a traves del factory de formset."""
         self.object = self.get_object()
-        cantidad_partidos = self.object.partidos.no_empezados().count()
+        cantidad_partidos = len(self.object.partidos_no_empezados)
         return formset_factory(forms.ApuestaForm,
                                formset=forms.ApuestaBaseFormSet,
                                min_num=cantidad_partidos,
@@ -54,34 +103,115 @@ class AdministrarApuestasFormView(mixins.LoginRequiredMixin,
         kwargs = super().get_form_kwargs()
         kwargs['usuario'] = self.request.user
         kwargs['etapa'] = self.object
+        kwargs['partidos'] = self.object.partidos_no_empezados
         return kwargs
 
     def get_context_data(self, **kwargs):
-        """Agrega formset al contexto"""
-        kwargs['formset'] = self.get_form()
+        """Agrega formset al contexto. Es el mismo objeto que ``form``, asi
+        no se arma dos veces."""
+        if 'form' not in kwargs:
+            kwargs['form'] = self.get_form()
+        kwargs['formset'] = kwargs['form']
         return super().get_context_data(**kwargs)
 
     def form_valid(self, form):
         """Guarda los formularios del formset"""
         # alias para que quede claro que estoy trabajando con un formset
         formset = form
-        for _form in formset:
-            _form.save()
-        messages.success(self.request, '''La apuesta fue guardada con éxito,
-                         puede seguir editandola hasta que se acabe el tiempo
-                         para apostar''')
+        # solo se guardan las apuestas nuevas o modificadas, todas juntas
+        encoladas = cola.guardar_o_encolar(self.object, (
+            _form.save(commit=False)
+            for _form in formset
+            if _form.has_changed() or _form.instance.pk is None
+        ))
+        if encoladas:
+            messages.success(self.request, '''La apuesta fue recibida y se
+                             guardará en unos instantes, puede seguir
+                             editandola hasta que se acabe el tiempo para
+                             apostar''')
+        else:
+            messages.success(self.request, '''La apuesta fue guardada con
+                             éxito, puede seguir editandola hasta que se acabe
+                             el tiempo para apostar''')
         return shortcuts.redirect('apuestas:apostar', slug=self.object.slug)
 
 
-class EtapaDetailView(mixins.LoginRequiredMixin, generic.DetailView):
-    """Permite ver todas las apuestas de todos los partidos de la etapa.
+@method_decorator(limites.limitar('apostar_partido'), name='dispatch')
+class ApostarPartidoView(mixins.LoginRequiredMixin,
+                         generic.edit.SingleObjectMixin,
+                         generic.FormView):
+    """Guarda la apuesta del usuario en un solo partido.
+
+    La usa el autoguardado de la pantalla de apuestas: recibe los campos de
+    ``ApuestaForm`` sin prefijo y responde en JSON, asi cada cambio escribe
+    una sola apuesta en vez de reenviar todo el formset.
+
+    Solo se puede apostar en partidos no empezados (ver
+    ``PartidoManager.no_empezados``) de etapas no vencidas.
+    """
+    model = models.Partido
+    form_class = forms.ApuestaForm
+    http_method_names = ['post']
+    # para un pedido AJAX no tiene sentido redirigir al login
+    raise_exception = True
+
+    def get_queryset(self):
+        """Solo los partidos no empezados, con su etapa."""
+        return models.Partido.objects.no_empezados().select_related('etapa')
+
+    def post(self, *args, **kwargs):
+        """Si la etapa esta vencida, no se puede apostar mas."""
+        self.object = self.get_object()
+        if self.object.etapa is None or self.object.etapa.vencida:
+            return JsonResponse(
+                {'error': 'Se termino el tiempo para apostar en esta etapa'},
+                status=403,
+            )
+        return super().post(*args, **kwargs)
 
-    Ademas muestra los mejores 5 apostadores de la etapa con su puntaje
+    def get_form_kwargs(self):
+        """Agrega usuario, partido y la apuesta existente, si hay."""
+        kwargs = super().get_form_kwargs()
+        kwargs['usuario'] = self.request.user
+        kwargs['partido'] = self.object
+        kwargs['instance'] = (models.Apuesta.objects
+                              .filter(usuario=self.request.user,
+                                      partido=self.object)
+                              .first())
+        return kwargs
+
+    def form_valid(self, form):
+        """Guarda la apuesta si es nueva o cambio y la devuelve."""
+        apuesta = form.save(commit=False)
+        if form.has_changed() or apuesta.pk is None:
+            cola.guardar_o_encolar(self.object.etapa, [apuesta])
+        return JsonResponse({
+            campo: getattr(apuesta, campo)
+            for campo in models.Apuesta.objects.campos_apuesta
+        })
+
+    def form_invalid(self, form):
+        return JsonResponse({'errores': form.errors}, status=400)
+
+
+@method_decorator(limites.limitar('detalle'), name='dispatch')
+class EtapaDetailView(mixins.LoginRequiredMixin, EtapaMixin,
+                      generic.DetailView):
+    """Permite ver el resumen de las apuestas de cada partido de la etapa.
+
+    Por cada partido se muestra cuantos apostaron a cada ganador, los
+    resultados mas apostados y los puntos obtenidos (ver ``estadisticas``).
+    Las apuestas de cada partido se cargan aparte, cuando se piden (ver
+    ``ApuestasPartidoView``).
+
+    Ademas muestra los mejores 10 apostadores de la etapa con su puntaje
 
     Solo se permite ver los detalles de la etapa cuando la etapa este
-    vencida.
+    vencida. Como entonces solo cambia al cargar resultados, los partidos y
+    los puntajes se renderizan en fragmentos cacheados segun la version de
+    cada partido y se obtienen solo si el fragmento no esta en el cache (ver
+    ``fragmentos``).
     """
-    model = models.Etapa
 
     def dispatch(self, *args, **kwargs):
         """Si la etapa no esta vencida, no se puede ver las apuestas de otros
@@ -93,18 +223,75 @@ class EtapaDetailView(mixins.LoginRequiredMixin, generic.DetailView):
         return super().dispatch(*args, **kwargs)
 
     def get_context_data(self, **kwargs):
-        """Agrega ganador al contexto."""
-        kwargs['puntajes'] = self.get_puntajes()
+        """Agrega los puntajes, los partidos con sus estadisticas y las
+        versiones de los partidos al contexto (ver ``fragmentos``)."""
+        kwargs.update(fragmentos.contexto(self.object))
         return super().get_context_data(**kwargs)
 
+
+@method_decorator(limites.limitar('apuestas_partido'), name='dispatch')
+class ApuestasPartidoView(mixins.LoginRequiredMixin,
+                          generic.detail.SingleObjectMixin,
+                          generic.ListView):
+    """Permite ver las apuestas de todos los apostadores en un partido.
+
+    La usa el detalle de la etapa para cargar las apuestas de un partido
+    solo cuando se piden: con un pedido AJAX responde solo la tabla de
+    apuestas. Las apuestas se muestran paginadas, ordenadas por nombre de
+    usuario o, si el partido termino, por puntos (``?orden=puntos``), asi
+    cada pedido trae una sola pagina de apuestas.
+
+    Solo se pueden ver las apuestas de partidos de etapas vencidas. Cada
+    pagina se cachea segun la version del partido, asi en un acierto no se
+    obtienen las apuestas.
+    """
+    model = models.Partido
+    template_name = 'apuestas/apuestas_partido.html'
+    template_name_fragmento = 'apuestas/apuestas_partido_tabla.html'
+    paginate_by = 50
+    ordenes = {
+        'usuario': ('usuario__username',),
+        'puntos': ('-puntos', 'usuario__username'),
+    }
+
+    def get(self, request, *args, **kwargs):
+        """Solo los partidos de etapas vencidas, con su etapa."""
+        self.object = self.get_object(
+            queryset=(models.Partido.objects
+                      .filter(etapa__vencimiento__lt=timezone.now())
+                      .select_related('etapa'))
+        )
+        return super().get(request, *args, **kwargs)
+
+    def get_orden(self):
+        """Obtiene el orden pedido. Por puntos solo si el partido termino."""
+        orden = self.request.GET.get('orden')
+        if orden == 'puntos' and self.object.terminado():
+            return orden
+        return 'usuario'
+
     def get_queryset(self):
-        queryset = super().get_queryset()
-        return queryset.prefetch_related('partidos__apuestas__usuario')
+        """Obtiene las apuestas del partido, con los puntos y el ganador
+        calculados en la base de datos."""
+        return (self.object.apuestas
+                .con_puntaje()
+                .select_related('usuario')
+                .order_by(*self.ordenes[self.get_orden()]))
+
+    def get_template_names(self):
+        if self.request.is_ajax():
+            return [self.template_name_fragmento]
+        return super().get_template_names()
 
-    def get_puntajes(self):
-        puntajes = models.Apuesta.objects.get_puntajes(etapa=self.object)
-        # obtengo los 10 primeros
-        return puntajes[:10]
+    def get_context_data(self, **kwargs):
+        """Agrega la pagina de apuestas, el orden y la version del partido
+        al contexto."""
+        context = super().get_context_data(**kwargs)
+        context['apuestas'] = context['object_list']
+        context['orden'] = self.get_orden()
+        cache.versiones_partidos([self.object])
+        context['timeout_fragmentos'] = cache.TIMEOUT_FRAGMENTOS
+        return context
 
 
 class EtapaCreateView(mixins.PermissionRequiredMixin,
@@ -150,6 +337,7 @@ class EtapaCreateView(mixins.PermissionRequiredMixin,
 
 
 class EtapaUpdateView(mixins.UserPassesTestMixin,
+                      EtapaMixin,
                       generic.UpdateView):
     """Permite editar una etapa.
 
@@ -157,8 +345,9 @@ class EtapaUpdateView(mixins.UserPassesTestMixin,
     ``apuestas.change_etapa``. Si la etapa es publica, solo un
     superadministrador puede cambiarla.
     """
-    model = models.Etapa
     form_class = forms.EtapaForm
+    # el formset de partidos hace su propia consulta
+    prefetch_related = ()
 
     def test_func(self):
         """Si la etapa es publica, solo un administrador puede editarla"""
@@ -199,8 +388,19 @@ class EtapaUpdateView(mixins.UserPassesTestMixin,
         return shortcuts.redirect('apuestas:update', slug=etapa.slug)
 
 
+class ProcesarResultadosMixin:
+    """Avisa si no se pudo encolar el procesamiento de los resultados
+    guardados (ver ``tasks.procesar_al_confirmar``)."""
+
+    def avisar_demora(self):
+        messages.warning(self.request, '''Los resultados se guardaron, pero
+                         los puntajes y el ranking pueden demorar unos minutos
+                         en actualizarse.''')
+
+
 class CargarResultadosView(mixins.PermissionRequiredMixin,
-                           generic.edit.SingleObjectMixin,
+                           EtapaMixin,
+                           ProcesarResultadosMixin,
                            generic.FormView):
     """Permite cargas los resultados de los partidos pasados.
 
@@ -209,11 +409,12 @@ class CargarResultadosView(mixins.PermissionRequiredMixin,
     No permite editar los resultados de partidos pasados, excepto para el admin
     en caso de correcciones
     """
-    model = models.Etapa
     template_name = 'apuestas/cargar_resultados.html'
     prefix = 'partidos'
     object = None
     permission_required = 'apuestas.change_etapa'
+    # el formset de partidos hace su propia consulta
+    prefetch_related = ()
 
     def get_form_class(self):
         """Obtiene formset para cargar los resultados."""
@@ -254,47 +455,138 @@ class CargarResultadosView(mixins.PermissionRequiredMixin,
         )
 
     def form_valid(self, form):
-        """Guarda formulario y redirije a detalles de la etapa."""
-        form.save()
+        """Guarda los resultados, encola su procesamiento y redirije a
+        detalles de la etapa.
+
+        Los resultados se guardan en bloque con ``resultados.guardar``, sin
+        ``post_save``: los puntajes, puestos, estadisticas y caches de los
+        partidos que cambiaron se actualizan en
+        ``tasks.procesar_resultados``, fuera del pedido.
+        """
+        cambios = resultados.guardar(form.save(commit=False))
+        if cambios:
+            tasks.procesar_al_confirmar(
+                [cambio.partido_id for cambio in cambios],
+                si_falla=self.avisar_demora)
         messages.success(self.request, '''Los resultados se han guardado. No
                          podrá editarlos en el futuro''')
         return shortcuts.redirect('apuestas:detail', slug=self.kwargs['slug'])
 
 
+class ImportarResultadosView(mixins.PermissionRequiredMixin,
+                             ProcesarResultadosMixin,
+                             generic.FormView):
+    """Permite importar los resultados de varios partidos desde un archivo
+    CSV o JSON (ver ``importacion``).
+
+    Requiere permisos ``apuestas.change_etapa``. Como en
+    ``CargarResultadosView``, solo el admin puede corregir resultados ya
+    cargados.
+    """
+    template_name = 'apuestas/importar_resultados.html'
+    form_class = forms.ImportarResultadosForm
+    permission_required = 'apuestas.change_etapa'
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        kwargs['correcciones'] = self.request.user.is_superuser
+        return kwargs
+
+    def form_valid(self, form):
+        """Guarda todos los resultados y encola un solo procesamiento."""
+        cambios = importacion.importar(form.partidos,
+                                       si_falla=self.avisar_demora)
+        messages.success(
+            self.request,
+            f'Se importaron {len(cambios)} resultados, '
+            f'{len(form.partidos) - len(cambios)} no tenian cambios',
+        )
+        return shortcuts.redirect('apuestas:importar_resultados')
+
+
+@method_decorator(limites.limitar('ranking'), name='dispatch')
 class RankingView(mixins.LoginRequiredMixin, generic.ListView):
-    """Permite ver el ranking de mejores apostadores de todas las etapas"""
+    """Permite ver el ranking de mejores apostadores de todas las etapas.
+
+    El ranking se muestra paginado. Con ``?page=mia`` se abre la pagina en la
+    que esta el usuario en sesion.
+    """
     template_name = 'apuestas/ranking.html'
     context_object_name = 'ranking'
+    paginate_by = utils.RankingPaginado.por_pagina
+    pagina_usuario = 'mia'
 
-    @functools.lru_cache()
     def get_queryset(self):
         """Obtiene ranking de mejores apostadores.
 
-        :returns: Lista de tuplas (nombre de usuario, puntaje)
+        :returns: ``RankingPaginado`` con tuplas (nombre de usuario, puntaje)
+        """
+        return utils.RankingPaginado()
+
+    def paginate_queryset(self, queryset, page_size):
+        """Si se pide la pagina del usuario, calcula el numero de pagina a
+        partir de su puesto.
         """
-        return models.Apuesta.objects.ranking()
+        pagina = self.request.GET.get(self.page_kwarg)
+        if pagina == self.pagina_usuario:
+            # con empates el puesto no alcanza, hace falta la posicion
+            posicion = self.request.user.ranking
+            self.kwargs[self.page_kwarg] = (
+                1 if posicion is None else (posicion - 1) // page_size + 1
+            )
+        return super().paginate_queryset(queryset, page_size)
 
     def get_context_data(self, **kwargs):
-        kwargs['ganadores'] = self.get_ganadores()
         kwargs['puesto_actual'] = self.get_puesto_actual()
-        return super().get_context_data(**kwargs)
+        kwargs['pagina_usuario'] = self.pagina_usuario
+        context = super().get_context_data(**kwargs)
+        context['probabilidades'] = self.get_probabilidades(
+            context['ranking'])
+        context['alcanzables'] = self.get_alcanzables(context['ranking'])
+        context['cambios'] = self.get_cambios(context['ranking'])
+        return context
+
+    def get_probabilidades(self, ranking):
+        """Obtiene la probabilidad de ganar de los usuarios de la pagina.
+
+        :returns: Diccionario {nombre de usuario: ``Probabilidad``}
+        """
+        usernames = [rank.username for rank in ranking]
+        probabilidades = (models.Probabilidad.objects
+                          .filter(usuario__username__in=usernames)
+                          .select_related('usuario'))
+        return {probabilidad.usuario.username: probabilidad
+                for probabilidad in probabilidades}
+
+    def get_alcanzables(self, ranking):
+        """Obtiene los puntos maximos que pueden alcanzar los usuarios de la
+        pagina y si estan eliminados.
+
+        Se guardan en el cache de resultados, que se invalida al cargar
+        resultados. La key depende de los usuarios de la pagina y no de su
+        numero, que muestra otros usuarios a medida que se suman al ranking.
+
+        :returns: Diccionario {nombre de usuario: ``Alcanzable``}
+        """
+        usernames = [rank.username for rank in ranking]
+        digest = hashlib.sha1('\n'.join(usernames).encode()).hexdigest()
+        return cache.obtener(
+            f'alcanzables:total:{digest}',
+            lambda: models.Puntaje.objects.alcanzables(usernames),
+        )
 
-    def get_ganadores(self):
-        """Obtiene una tupla con los nombres de usuario de ganadores.
+    def get_cambios(self, ranking):
+        """Obtiene cuantos puestos subieron o bajaron los usuarios de la
+        pagina en la ultima carga de resultados.
 
-        En caso que no haya apuestas, devuelve una tupla vacia
+        :returns: Diccionario {nombre de usuario: cambio}
         """
-        ranking = self.get_queryset()
-        if not ranking:
-            return tuple()
-        mayor_puntaje = ranking[0].puntos
-        ganadores = itertools.takewhile(lambda x: x.puntos == mayor_puntaje,
-                                        ranking)
-        return tuple(ganador.username for ganador in ganadores)
+        return puestos.cambios([rank.username for rank in ranking])
 
     def get_puesto_actual(self):
-        """Obtiene el puesto actual del usuario en sesion
+        """Obtiene el puesto actual del usuario en sesion, el mismo que se
+        muestra en el ranking.
 
         :returns: Numero de puesto del usuario o None si no se encontro
         """
-        return self.request.user.ranking
+        return utils.get_puesto(self.request.user)
@@ -0,0 +1,9 @@
+import pytest
+from django.core.cache import cache
+
+
+@pytest.fixture(autouse=True)
+def limpiar_cache():
+    """Evita que los datos cacheados en un test se usen en otro."""
+    cache.clear()
+    yield
@@ -0,0 +1,46 @@
+/*
+Apuestas de cada partido en el detalle de la etapa.
+
+El detalle muestra solo el resumen de las apuestas de cada partido. Los
+enlaces dentro de cada elemento ``data-apuestas`` ("Ver apuestas", el orden y
+las paginas de la tabla) traen la pagina de apuestas pedida y la muestran en
+su lugar. Sin javascript los enlaces abren la pagina con las apuestas del
+partido.
+*/
+(function () {
+  'use strict';
+
+  if (!window.fetch) {
+    return;
+  }
+
+  function cargar(contenedor, url) {
+    fetch(url, {
+      credentials: 'same-origin',
+      headers: {'X-Requested-With': 'XMLHttpRequest'}
+    }).then(function (respuesta) {
+      if (!respuesta.ok) {
+        throw new Error(respuesta.statusText);
+      }
+      return respuesta.text();
+    }).then(function (html) {
+      contenedor.innerHTML = html;
+    }).catch(function () {
+      // si falla se abre la pagina del partido
+      window.location = url;
+    });
+  }
+
+  var contenedores = document.querySelectorAll('[data-apuestas]');
+  Array.prototype.forEach.call(contenedores, function (contenedor) {
+    contenedor.addEventListener('click', function (evento) {
+      var enlace = evento.target.closest('a');
+      if (!enlace || !contenedor.contains(enlace)) {
+        return;
+      }
+      evento.preventDefault();
+      enlace.classList.add('disabled');
+      cargar(contenedor, enlace.href);
+    });
+  });
+})();
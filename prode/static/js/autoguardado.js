@@ -0,0 +1,63 @@
+/*
+Autoguardado de apuestas.
+
+Cada tarjeta de la pantalla de apuestas tiene en ``data-autoguardado`` la url
+para guardar solo la apuesta de ese partido. Cuando cambia algun campo se
+envian los campos de la tarjeta (sin el prefijo del formset) y se muestra el
+estado en el elemento ``data-estado``. El boton "Guardar" sigue funcionando
+para guardar todo junto.
+*/
+(function () {
+  'use strict';
+
+  var ESPERA = 500;  // ms sin cambios antes de guardar
+  var csrf = document.querySelector('[name=csrfmiddlewaretoken]');
+
+  function mostrarEstado(tarjeta, texto, clase) {
+    var estado = tarjeta.querySelector('[data-estado]');
+    estado.textContent = texto;
+    estado.className = clase;
+  }
+
+  function guardar(tarjeta) {
+    var prefijo = tarjeta.getAttribute('data-prefijo') + '-';
+    var datos = new FormData();
+    var campos = tarjeta.querySelectorAll('input, select');
+    for (var i = 0; i < campos.length; i++) {
+      var campo = campos[i];
+      if ((campo.type === 'radio' || campo.type === 'checkbox') && !campo.checked) {
+        continue;
+      }
+      datos.append(campo.name.replace(prefijo, ''), campo.value);
+    }
+    mostrarEstado(tarjeta, 'Guardando...', 'text-muted');
+    fetch(tarjeta.getAttribute('data-autoguardado'), {
+      method: 'POST',
+      body: datos,
+      credentials: 'same-origin',
+      headers: {'X-CSRFToken': csrf.value, 'X-Requested-With': 'XMLHttpRequest'}
+    }).then(function (respuesta) {
+      if (respuesta.ok) {
+        mostrarEstado(tarjeta, 'Guardado', 'text-success');
+      } else if (respuesta.status === 400) {
+        mostrarEstado(tarjeta, 'Revise los valores ingresados', 'text-danger');
+      } else {
+        mostrarEstado(tarjeta, 'Ya no se puede apostar en este partido', 'text-danger');
+      }
+    }).catch(function () {
+      mostrarEstado(tarjeta, 'No se pudo guardar, use el botón Guardar', 'text-danger');
+    });
+  }
+
+  if (!csrf || !window.fetch || !window.FormData) {
+    return;
+  }
+  var tarjetas = document.querySelectorAll('[data-autoguardado]');
+  Array.prototype.forEach.call(tarjetas, function (tarjeta) {
+    var temporizador = null;
+    tarjeta.addEventListener('change', function () {
+      clearTimeout(temporizador);
+      temporizador = setTimeout(function () { guardar(tarjeta); }, ESPERA);
+    });
+  });
+})();
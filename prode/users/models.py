@@ -21,11 +21,7 @@ class User(AbstractUser):
     @property
     def puntaje(self):
         """Obtiene el puntaje de todas sus apuestas."""
-        puntos = next(
-            (puntaje.puntos for puntaje in self.apuestas.ranking()),
-            0  # default value
-        )
-        return puntos
+        return self.puntajes.puntos()
 
     @property
     def ranking(self):
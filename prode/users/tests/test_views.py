@@ -1,7 +1,9 @@
 import datetime
 
+from django.db import connection
 from django.utils import timezone
 from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
 
 from test_plus.test import TestCase
 
@@ -91,6 +93,28 @@ class TestUserDetailView(BaseUserTestCase):
             self.assertEqual(actual[i].etapa, apuesta.partido.etapa)
             self.assertEqual(actual[i].puntos, 4)
 
+    def test_etapas_apostadas__consultas_no_dependen_de_etapas(self):
+        def consultas():
+            with self.login(self.user):
+                with CaptureQueriesContext(connection) as consultas:
+                    self.get('users:detail', username=self.user.username)
+            return len(consultas)
+
+        def apostar():
+            factories.ApuestaFactory(
+                partido__etapa__vencimiento=timezone.now(),
+                usuario=self.user,
+                partido__goles_local=1,
+                partido__goles_visitante=0,
+            )
+
+        apostar()
+        cantidad = consultas()
+        for _ in range(3):
+            apostar()
+        self.assertEqual(consultas(), cantidad)
+        self.assertEqual(len(self.context['etapas_apostadas']), 4)
+
     def test_no_mostrar_etapas_sin_vencer(self):
         """No muestro apuestas de etapas que siguen activas"""
         # Creo apuesta con vencimiento de etapa en el futuro
@@ -1,4 +1,7 @@
-from collections import namedtuple
+from collections import (
+    defaultdict,
+    namedtuple,
+)
 
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse
@@ -10,21 +13,7 @@ from prode.apuestas import models as apuestas_models
 from .models import User
 
 
-
-def get_puntaje(usuario, etapa):
-    """Obtiene una tupla de (etapa, apuestas, puntos).
-
-    Los puntos es la sumatoria del puntaje obtenido por el usuario en la etapa
-    """
-    EtapaApostada = namedtuple('EtapaApostada', 'etapa apuestas puntos')
-    apuestas = apuestas_models.Apuesta.objects.filter(
-        partido__etapa=etapa,
-        usuario=usuario,
-    ).prefetch_related('partido')
-    puntaje = usuario.apuestas.ranking(apuestas)
-    if not puntaje:
-        return EtapaApostada(etapa, apuestas, 0)
-    return EtapaApostada(etapa, apuestas, puntaje[0].puntos)
+EtapaApostada = namedtuple('EtapaApostada', 'etapa apuestas puntos')
 
 
 class UserDetailView(LoginRequiredMixin, DetailView):
@@ -47,11 +36,24 @@ class UserDetailView(LoginRequiredMixin, DetailView):
         informacion
         """
         usuario = self.get_object()
-        etapas = apuestas_models.Etapa.objects.filter(
+        etapas = list(apuestas_models.Etapa.objects.filter(
             vencimiento__lt=timezone.now(),
             partidos__apuestas__usuario=usuario,
-        ).distinct()
-        return tuple(get_puntaje(usuario, etapa) for etapa in etapas)
+        ).distinct())
+        # todas las apuestas juntas, con los puntos calculados en la base de
+        # datos
+        apuestas = defaultdict(list)
+        for apuesta in (apuestas_models.Apuesta.objects
+                        .con_puntaje()
+                        .filter(partido__etapa__in=etapas, usuario=usuario)
+                        .select_related('partido')):
+            apuestas[apuesta.partido.etapa_id].append(apuesta)
+        puntos = dict(usuario.puntajes
+                      .filter(etapa__in=etapas)
+                      .values_list('etapa', 'puntos'))
+        return tuple(EtapaApostada(etapa, apuestas[etapa.pk],
+                                   puntos.get(etapa.pk, 0))
+                     for etapa in etapas)
 
 
 class UserRedirectView(LoginRequiredMixin, RedirectView):